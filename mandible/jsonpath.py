@@ -1,10 +1,12 @@
+import functools
 import re
-from collections.abc import Generator
-from typing import Union
+from collections.abc import Generator, Iterable, Mapping
+from typing import Optional, Union
 
 try:
     import jsonpath_ng
     import jsonpath_ng.ext
+    from jsonpath_ng.ext.parser import ExtendedJsonPathLexer
 except ImportError:
     jsonpath_ng = None  # type: ignore
 
@@ -23,24 +25,250 @@ JsonValue = Union[
 ]
 
 BRACKET_PATTERN = re.compile(r"\[(.*)\]$")
+SIMPLE_PART_PATTERN = re.compile(r"\.([A-Za-z_][A-Za-z0-9_]*)|\[(0|[1-9][0-9]*)\]")
+# Maximum number of compiled expressions to keep in the cache
+CACHE_SIZE = 4096
+
+
+class JsonPath:
+    """A compiled path expression which can be evaluated many times.
+
+    When `jsonpath_ng` is installed, simple paths made up of only `.field`
+    and `[index]` parts are evaluated directly with a chain of lookups, and
+    only paths which use other features such as filters, wildcards or
+    recursive descent are handed to `jsonpath_ng`. Both give the same
+    results.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._expr = None
+        self._simple_parts: Optional[list[Union[str, int]]] = None
+        self._parts: list[str] = []
+
+        # Fall back to simple dot paths
+        if jsonpath_ng is None:
+            self._parts = [part for part in _parse_dot_path(path) if part != "$"]
+            return
+
+        self._simple_parts = _parse_simple_path(path)
+        if self._simple_parts is None:
+            self._expr = jsonpath_ng.ext.parse(path)
+
+    @property
+    def is_simple(self) -> bool:
+        """Whether the path is evaluated without using `jsonpath_ng`."""
+        return jsonpath_ng is None or self._simple_parts is not None
+
+    def get(self, data: JsonValue) -> list[JsonValue]:
+        if self._simple_parts is not None:
+            try:
+                return _get_simple_path(data, self._simple_parts)
+            except _UnsupportedValue:
+                # Defer to jsonpath_ng for any values where its behavior is
+                # not trivially the same
+                return self._find(data)
+
+        if self._expr is None:
+            return _get_dot_path(data, self.path, self._parts)
+
+        return self._find(data)
+
+    @property
+    def steps(self) -> Optional[list[Union[str, int]]]:
+        """The lookups used to evaluate the path without `jsonpath_ng`."""
+        if jsonpath_ng is None:
+            return list(self._parts)
+
+        return self._simple_parts
+
+    def _find(self, data: JsonValue) -> list[JsonValue]:
+        if self._expr is None:
+            self._expr = jsonpath_ng.ext.parse(self.path)
+
+        return [match.value for match in self._expr.find(data)]
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({repr(self.path)})"
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compile(path: str) -> JsonPath:
+    """Compile a path expression so it can be evaluated many times.
+
+    Compiled expressions are kept in a bounded LRU cache, so compiling the
+    same path again is cheap.
+    """
+    return JsonPath(path)
+
+
+def cache_info() -> "functools._CacheInfo":
+    """Return the hit and miss statistics of the compiled expression cache."""
+    return compile.cache_info()
+
+
+def cache_clear() -> None:
+    compile.cache_clear()
 
 
 def get(data: JsonValue, path: str) -> list[JsonValue]:
-    # Fall back to simple dot paths
-    if jsonpath_ng is None:
-        return _get_dot_path(data, path)
+    return compile(path).get(data)
 
-    expr = jsonpath_ng.ext.parse(path)
-    return [match.value for match in expr.find(data)]
 
+def get_steps(path: str) -> Optional[list[Union[str, int]]]:
+    """Return the lookups used to evaluate a path without `jsonpath_ng`.
 
-def _get_dot_path(data: JsonValue, path: str) -> list[JsonValue]:
-    val = data
-    for part in _parse_dot_path(path):
-        if part == "$":
+    :returns: the lookups, or None if the path can't be evaluated as a chain
+        of lookups. Invalid paths also return None, so that the error is
+        raised when the path is evaluated with `get`.
+    """
+    try:
+        return compile(path).steps
+    except Exception:
+        return None
+
+
+def batch_get(data: JsonValue, paths: Iterable[str]) -> dict[str, list[JsonValue]]:
+    """Evaluate many simple paths against the same data in one traversal.
+
+    The paths are arranged into a prefix tree so that any shared prefixes
+    are only walked once. Paths which can't be evaluated this way, either
+    because they use complex syntax or because they don't fully resolve, are
+    left out of the result and should be evaluated with `get` instead.
+
+    :returns: a mapping of path to the same result that `get` would return
+    """
+    root = _TrieNode()
+    for path in paths:
+        steps = get_steps(path)
+        if steps is None:
             continue
 
-        if isinstance(val, dict):
+        node = root
+        for step in steps:
+            node = node.children.setdefault(step, _TrieNode())
+        node.paths.append(path)
+
+    results: dict[str, list[JsonValue]] = {}
+    _walk_trie(data, root, results)
+
+    return results
+
+
+class _UnsupportedValue(Exception):
+    pass
+
+
+class _TrieNode:
+    __slots__ = ("children", "paths")
+
+    def __init__(self) -> None:
+        self.children: dict[Union[str, int], _TrieNode] = {}
+        self.paths: list[str] = []
+
+
+def _walk_trie(
+    val: JsonValue,
+    node: _TrieNode,
+    results: dict[str, list[JsonValue]],
+) -> None:
+    for path in node.paths:
+        results[path] = [val]
+
+    for step, child in node.children.items():
+        try:
+            child_val = _trie_step(val, step)
+        except _UnsupportedValue:
+            continue
+
+        _walk_trie(child_val, child, results)
+
+
+def _trie_step(val: JsonValue, step: Union[str, int]) -> JsonValue:
+    if isinstance(step, int):
+        if isinstance(val, list) and step < len(val):
+            return val[step]
+    elif isinstance(val, Mapping):
+        if step in val:
+            return val[step]
+    elif jsonpath_ng is None and isinstance(val, list):
+        # The dot path fallback allows indexing lists with any integer
+        try:
+            return val[int(step)]
+        except (ValueError, IndexError):
+            pass
+
+    raise _UnsupportedValue()
+
+
+def _parse_simple_path(path: str) -> Optional[list[Union[str, int]]]:
+    """Parse a path which only uses `.field` and `[index]` parts.
+
+    :returns: the parts of the path, or None if it uses any other syntax
+    """
+    if path == "$":
+        return []
+
+    if path.startswith("$"):
+        rest = path[1:]
+    else:
+        # Paths may start with a bare field name
+        rest = f".{path}"
+
+    parts: list[Union[str, int]] = []
+    pos = 0
+    while pos < len(rest):
+        m = SIMPLE_PART_PATTERN.match(rest, pos)
+        if m is None:
+            return None
+
+        field, index = m.groups()
+        if field is not None:
+            if not _is_field_name(field):
+                return None
+            parts.append(field)
+        else:
+            parts.append(int(index))
+        pos = m.end()
+
+    return parts
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _is_field_name(name: str) -> bool:
+    """Check that `jsonpath_ng` reads a name as a plain field, and not as a
+    keyword such as `where` or `true`.
+    """
+    tokens = list(ExtendedJsonPathLexer().tokenize(name))
+    return len(tokens) == 1 and tokens[0].type == "ID" and tokens[0].value == name
+
+
+def _get_simple_path(
+    data: JsonValue,
+    parts: list[Union[str, int]],
+) -> list[JsonValue]:
+    val = data
+    for part in parts:
+        if isinstance(part, str):
+            if not isinstance(val, Mapping):
+                raise _UnsupportedValue()
+            if part not in val:
+                return []
+            val = val[part]
+        else:
+            if not isinstance(val, list):
+                raise _UnsupportedValue()
+            if part >= len(val):
+                return []
+            val = val[part]
+
+    return [val]
+
+
+def _get_dot_path(data: JsonValue, path: str, parts: list[str]) -> list[JsonValue]:
+    val = data
+    for part in parts:
+        if isinstance(val, Mapping):
             val = val[part]
         elif isinstance(val, list):
             val = val[int(part)]
@@ -1,7 +1,7 @@
 from .context import Context
 from .format import Format
 from .mapper import MetadataMapper, MetadataMapperError
-from .source import FileSource
+from .source import FileSource, ZipSource
 from .source_provider import ConfigSourceProvider, PySourceProvider
 
 __all__ = [
@@ -12,4 +12,5 @@ __all__ = [
     "MetadataMapperError",
     "PySourceProvider",
     "FileSource",
+    "ZipSource",
 ]
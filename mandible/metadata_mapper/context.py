@@ -1,6 +1,6 @@
 import dataclasses
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, Optional
 
 from mandible import jsonpath
 
@@ -19,18 +19,42 @@ class ContextValue:
 
     path: str
 
+    def __post_init__(self) -> None:
+        self._compiled_path_cache: Optional[jsonpath.JsonPath] = None
+
+    @property
+    def _compiled_path(self) -> jsonpath.JsonPath:
+        if self._compiled_path_cache is None:
+            self._compiled_path_cache = jsonpath.compile(self.path)
+
+        return self._compiled_path_cache
+
 
 def replace_context_values(
     obj: Any,
     context: Context,
 ) -> Any:
-    return _replace_context_values(obj, dataclasses.asdict(context))
+    """Replace any `ContextValue` markers in an object with values from the
+    context.
+
+    Values are read directly from the context without copying it. Any parts
+    of the object that don't contain markers are returned as is, so an
+    object without any markers is returned unchanged.
+    """
+    # A shallow view of the context. Unlike `dataclasses.asdict` this does not
+    # copy any of the context values.
+    context_dict = {
+        # ruff hint
+        field_obj.name: getattr(context, field_obj.name)
+        for field_obj in dataclasses.fields(context)
+    }
+    return _replace_context_values(obj, context_dict)
 
 
 def _replace_context_values(obj: Any, context_dict: dict) -> Any:
     if isinstance(obj, ContextValue):
         try:
-            result = jsonpath.get(context_dict, obj.path)
+            result = obj._compiled_path.get(context_dict)
         except Exception as e:
             raise ContextValueError(
                 f"jsonpath error for path {repr(obj.path)}: {e}",
@@ -48,26 +72,38 @@ def _replace_context_values(obj: Any, context_dict: dict) -> Any:
         return result[0]
 
     if isinstance(obj, dict):
-        return {
-            # ruff hint
-            k: _replace_context_values(v, context_dict)
-            for k, v in obj.items()
-        }
+        replaced_dict = None
+        for k, v in obj.items():
+            replaced = _replace_context_values(v, context_dict)
+            if replaced is not v:
+                if replaced_dict is None:
+                    replaced_dict = dict(obj)
+                replaced_dict[k] = replaced
+
+        return obj if replaced_dict is None else replaced_dict
 
     if isinstance(obj, list):
-        return [_replace_context_values(v, context_dict) for v in obj]
+        replaced_list = None
+        for i, v in enumerate(obj):
+            replaced = _replace_context_values(v, context_dict)
+            if replaced is not v:
+                if replaced_list is None:
+                    replaced_list = list(obj)
+                replaced_list[i] = replaced
+
+        return obj if replaced_list is None else replaced_list
 
     if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
-        replaced = dataclasses.replace(
-            obj,
-            **{
-                field_obj.name: _replace_context_values(
-                    getattr(obj, field_obj.name),
-                    context_dict,
-                )
-                for field_obj in dataclasses.fields(obj)
-            },
-        )
-        return replaced
+        changes = {}
+        for field_obj in dataclasses.fields(obj):
+            if not field_obj.init:
+                continue
+
+            value = getattr(obj, field_obj.name)
+            replaced = _replace_context_values(value, context_dict)
+            if replaced is not value:
+                changes[field_obj.name] = replaced
+
+        return dataclasses.replace(obj, **changes) if changes else obj
 
     return obj
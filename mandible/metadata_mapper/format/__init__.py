@@ -1,10 +1,16 @@
 from .format import (
     FORMAT_REGISTRY,
     Bzip2File,
+    CompressedFile,
     FileFormat,
     Format,
     FormatError,
+    GzipFile,
     Json,
+    TarIndex,
+    TarMember,
+    XzFile,
+    ZipIndex,
     ZipInfo,
     ZipMember,
 )
@@ -19,16 +25,28 @@ try:
 except ImportError:
     from .placeholder import Xml  # type: ignore
 
+try:
+    from .zstd import ZstdFile
+except ImportError:
+    from .placeholder import ZstdFile  # type: ignore
+
 
 __all__ = (
     "FORMAT_REGISTRY",
     "Bzip2File",
+    "CompressedFile",
     "FileFormat",
     "Format",
     "FormatError",
+    "GzipFile",
     "H5",
     "Json",
+    "TarIndex",
+    "TarMember",
     "Xml",
+    "XzFile",
+    "ZipIndex",
     "ZipInfo",
     "ZipMember",
+    "ZstdFile",
 )
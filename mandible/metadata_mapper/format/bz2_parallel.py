@@ -0,0 +1,298 @@
+"""Parallel decompression of bzip2 files.
+
+A bzip2 stream is made up of blocks of at most 900 kB of input which are
+compressed independently of each other. Blocks aren't aligned to bytes, but
+each one starts with a 48 bit magic number, so the compressed data can be
+split at those bits and every block wrapped in a stream of its own which the
+standard library can decompress. The blocks are decompressed by a thread
+pool, as the bz2 module releases the GIL while decompressing, and the output
+is returned in order.
+
+The magic numbers can also occur by chance inside the compressed data. If a
+block fails to decompress for any reason, the file is decompressed again
+sequentially from the start, skipping the bytes that were already returned.
+Files which aren't seekable can only be decompressed again until the first
+bytes are returned.
+"""
+
+import bz2
+import io
+import os
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Optional, cast
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_BLOCK_MAGIC = 0x314159265359
+_END_OF_STREAM_MAGIC = 0x177245385090
+_MAGIC_MASK = (1 << 48) - 1
+_MAGIC_BITS = 48
+_CRC_BITS = 32
+# Every marker is contained in a window of this many bytes
+_WINDOW_SIZE = 7
+
+# Compressed data and the bit positions of a block within it
+_Block = tuple[bytes, int, int]
+
+
+class DecompressionError(OSError):
+    """Raised when a block fails to decompress and the file can't be
+    decompressed again sequentially.
+    """
+
+    pass
+
+
+class _SplitError(Exception):
+    pass
+
+
+class ParallelBZ2Reader(io.RawIOBase):
+    """A read only file which decompresses the blocks of a bzip2 file
+    concurrently.
+
+    At most two blocks per worker are decompressed ahead of the reader, which
+    bounds the memory used regardless of the size of the file.
+
+    :param file: The compressed file. If it isn't seekable, the compressed
+        data is kept in memory until the first bytes are returned, so that it
+        can be decompressed again if a block fails. Blocks which fail after
+        that raise a `DecompressionError`.
+    :param max_workers: Number of threads to decompress with, defaults to
+        the number of CPUs
+    :param chunk_size: Number of compressed bytes to read at a time
+    """
+
+    def __init__(
+        self,
+        file: IO[bytes],
+        max_workers: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        self._file = file
+        self._start = file.tell() if file.seekable() else None
+        self._replay = _ReplayFile(file) if self._start is None else None
+        self._chunk_size = chunk_size
+        max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._max_pending = max_workers * 2
+        self._pending: deque[Future[bytes]] = deque()
+        self._blocks: Optional[Iterator[_Block]] = _iter_blocks(
+            cast(IO[bytes], self._replay) if self._replay is not None else file,
+            chunk_size,
+        )
+        self._data = memoryview(b"")
+        self._pos = 0
+        self._fallback: Optional[bz2.BZ2File] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        if not self.closed:
+            self._shutdown()
+            if self._fallback is not None:
+                self._fallback.close()
+        super().close()
+
+    def readinto(self, buffer: "bytearray | memoryview") -> int:  # type: ignore[override]
+        while not self._data:
+            if self._fallback is not None:
+                num_bytes = self._fallback.readinto(buffer)
+                self._pos += num_bytes
+                return num_bytes
+
+            try:
+                self._submit_blocks()
+                if not self._pending:
+                    return 0
+                self._data = memoryview(self._pending.popleft().result())
+            except (_SplitError, OSError, EOFError, ValueError) as e:
+                self._start_fallback(e)
+
+        num_bytes = min(len(buffer), len(self._data))
+        memoryview(buffer).cast("B")[:num_bytes] = self._data[:num_bytes]
+        self._data = self._data[num_bytes:]
+        self._pos += num_bytes
+        if self._replay is not None:
+            # The data can't be decompressed again once any of it is returned
+            self._replay.release()
+
+        return num_bytes
+
+    def _submit_blocks(self) -> None:
+        if self._blocks is None:
+            return
+
+        while len(self._pending) < self._max_pending:
+            block = next(self._blocks, None)
+            if block is None:
+                self._blocks = None
+                return
+            self._pending.append(self._executor.submit(_decompress_block, *block))
+
+    def _start_fallback(self, error: Exception) -> None:
+        self._shutdown()
+        file: IO[bytes]
+        if self._start is not None:
+            self._file.seek(self._start)
+            file = self._file
+        elif self._replay is not None and self._replay.rewind():
+            file = cast(IO[bytes], self._replay)
+        else:
+            raise DecompressionError(
+                f"failed to decompress a block of a file which isn't seekable: {error}",
+            ) from error
+
+        self._fallback = bz2.BZ2File(file, mode="rb")
+        self._data = memoryview(b"")
+        remaining = self._pos
+        while remaining > 0:
+            skipped = len(self._fallback.read(min(remaining, self._chunk_size)))
+            if skipped == 0:
+                raise DecompressionError(f"failed to decompress a block: {error}") from error
+            remaining -= skipped
+
+    def _shutdown(self) -> None:
+        self._blocks = None
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _ReplayFile(io.RawIOBase):
+    """A read only file which keeps a copy of everything read from another
+    file, so that it can be read again from the start.
+    """
+
+    def __init__(self, file: IO[bytes]):
+        self._file = file
+        self._recorded: Optional[bytearray] = bytearray()
+        self._replay = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: "bytearray | memoryview") -> int:  # type: ignore[override]
+        if self._replay:
+            data: "bytes | memoryview" = self._replay[: len(buffer)]
+            self._replay = self._replay[len(data) :]
+        else:
+            data = self._file.read(len(buffer))
+            if self._recorded is not None:
+                self._recorded += data
+
+        memoryview(buffer).cast("B")[: len(data)] = data
+        return len(data)
+
+    def release(self) -> None:
+        """Stop keeping a copy of the data."""
+        self._recorded = None
+
+    def rewind(self) -> bool:
+        """Read the recorded data again, and stop recording.
+
+        :returns: False if the data was released
+        """
+        if self._recorded is None:
+            return False
+
+        self._replay = memoryview(bytes(self._recorded))
+        self._recorded = None
+        return True
+
+
+def _iter_blocks(file: IO[bytes], chunk_size: int) -> Iterator[_Block]:
+    """Split a bzip2 file into its compressed blocks.
+
+    :raises: _SplitError if the file can't be split
+    """
+    buf = bytearray()
+    # Bit position in `buf` of the marker at the start of the current segment
+    segment_start: Optional[int] = None
+    segment_is_block = False
+    scan_from = 0
+    eof = False
+
+    while len(buf) < 3 and not eof:
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+    if not buf.startswith(b"BZh"):
+        raise _SplitError("not a bzip2 file")
+
+    while not eof:
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+
+        for marker, is_block in _find_markers(buf, scan_from):
+            if segment_start is not None and marker <= segment_start:
+                continue
+            if segment_is_block:
+                assert segment_start is not None
+                first = segment_start // 8
+                data = bytes(buf[first : (marker + 7) // 8])
+                yield data, segment_start - first * 8, marker - first * 8
+            segment_start, segment_is_block = marker, is_block
+
+        if segment_start is None:
+            scan_from = max(len(buf) - _WINDOW_SIZE, 0)
+            continue
+
+        # Drop everything before the current segment
+        drop = segment_start // 8
+        del buf[:drop]
+        segment_start -= drop * 8
+        scan_from = max(len(buf) - _WINDOW_SIZE, 0)
+
+    if segment_start is None or segment_is_block:
+        raise _SplitError("missing end of stream marker")
+
+
+def _find_markers(buf: bytearray, start: int) -> list[tuple[int, bool]]:
+    """Find the bit positions of the block and end of stream magic numbers
+    which start in or after the byte `start` of `buf`.
+
+    :returns: sorted (bit position, is block) pairs
+    """
+    markers = []
+    for magic, is_block in ((_BLOCK_MAGIC, True), (_END_OF_STREAM_MAGIC, False)):
+        for shift in range(8):
+            window = (magic << (8 - shift)).to_bytes(_WINDOW_SIZE, "big")
+            # The middle bytes of the window don't depend on the bits around
+            # the magic number
+            pattern = window[1:6]
+            index = buf.find(pattern, start + 1)
+            while index != -1 and index - 1 + _WINDOW_SIZE <= len(buf):
+                offset = index - 1
+                value = int.from_bytes(buf[offset : offset + _WINDOW_SIZE], "big")
+                if (value >> (8 - shift)) & _MAGIC_MASK == magic:
+                    markers.append((offset * 8 + shift, is_block))
+                index = buf.find(pattern, index + 1)
+
+    markers.sort()
+    return markers
+
+
+def _decompress_block(data: bytes, start: int, end: int) -> bytes:
+    """Decompress the block between the bit positions `start` and `end` by
+    wrapping it in a bzip2 stream header and footer.
+    """
+    num_bits = end - start
+    value = int.from_bytes(data, "big") >> (len(data) * 8 - end)
+    value &= (1 << num_bits) - 1
+    # The CRC of a stream with one block is the CRC of that block
+    crc = (value >> (num_bits - _MAGIC_BITS - _CRC_BITS)) & 0xFFFFFFFF
+
+    value = (((value << _MAGIC_BITS) | _END_OF_STREAM_MAGIC) << _CRC_BITS) | crc
+    num_bits += _MAGIC_BITS + _CRC_BITS
+    padding = -num_bits % 8
+
+    # The largest block size is used, as blocks of any size fit in it
+    stream = b"BZh9" + (value << padding).to_bytes((num_bits + padding) // 8, "big")
+
+    return bz2.decompress(stream)
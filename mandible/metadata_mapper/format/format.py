@@ -1,20 +1,54 @@
 import bz2
 import contextlib
+import copy
+import gzip
 import inspect
-import json
+import io
+import lzma
+import os
 import re
+import shutil
+import tarfile
+import tempfile
+import threading
 import zipfile
 from abc import ABC, abstractmethod
-from collections.abc import Generator, Iterable
+from collections import OrderedDict
+from collections.abc import Callable, Generator, Iterable, Iterator, Mapping
 from dataclasses import dataclass
-from typing import IO, Any, Generic, TypeVar
+from typing import IO, Any, ClassVar, Generic, NoReturn, Optional, TypeVar, cast
 
 from mandible import jsonpath
 from mandible.jsonpath import JsonValue
 from mandible.metadata_mapper.key import RAISE_EXCEPTION, Key
+from mandible.metadata_mapper.pattern import literal_value
+from mandible.metadata_mapper.storage.block_cache import CountingFile, RangeFile
+
+from . import json_decoder, json_stream
+from .bz2_parallel import ParallelBZ2Reader
+
+try:
+    from s3fs import S3File as S3FSFile
+except ImportError:
+    S3FSFile = None  # type: ignore
 
 T = TypeVar("T")
 
+# Number of bytes to read from the end of a zip archive when prefetching. This
+# covers the end of central directory records and the central directory of
+# most small archives.
+ZIP_TAIL_SIZE = 64 * 1024
+# Size of the fixed length fields of a zip local file header
+ZIP_LOCAL_HEADER_SIZE = 30
+# Extra bytes to prefetch for a member in case its local header has a longer
+# extra field than its central directory entry.
+ZIP_LOCAL_HEADER_SLACK = 256
+# Maximum number of tar archives to keep member indexes for
+TAR_INDEX_CACHE_SIZE = 128
+# Compressed data larger than this is spooled to a temporary file instead of
+# memory when it needs to be seekable.
+SPOOL_MAX_MEMORY_SIZE = 64 * 1024 * 1024
+
 
 class FormatError(Exception):
     def __init__(self, reason: str):
@@ -37,6 +71,11 @@ class Format(ABC):
         super().__init_subclass__(**kwargs)
 
     # Begin class definition
+    # Formats which seek around the file they read. Archive and compression
+    # formats give these a seekable copy of their data, as seeking in a
+    # compressed stream means decompressing it again from the start.
+    random_access: ClassVar[bool] = False
+
     @abstractmethod
     def get_values(
         self,
@@ -68,11 +107,7 @@ class FileFormat(Format, Generic[T], ABC, register=False):
         """Get a list of values from a file"""
 
         with self.parse_data(file) as data:
-            return {
-                # ruff hint
-                key: self._eval_key_wrapper(data, key)
-                for key in keys
-            }
+            return self.eval_keys(data, keys)
 
     def get_value(self, file: IO[bytes], key: Key) -> Any:
         """Convenience function for getting a single value"""
@@ -80,9 +115,30 @@ class FileFormat(Format, Generic[T], ABC, register=False):
         with self.parse_data(file) as data:
             return self._eval_key_wrapper(data, key)
 
-    def _eval_key_wrapper(self, data: T, key: Key) -> Any:
+    def eval_keys(self, data: T, keys: Iterable[Key]) -> dict[Key, Any]:
+        """Query the parsed data for many keys.
+
+        Formats can override this to share work between keys.
+
+        :param data: Object returned by `parse_data`
+        :param keys: The keys to extract
+        :returns: A mapping of each key to its value
+        :raises: FormatError
+        """
+        return {
+            # ruff hint
+            key: self._eval_key_wrapper(data, key)
+            for key in keys
+        }
+
+    def _eval_key_wrapper(
+        self,
+        data: T,
+        key: Key,
+        eval_key: Optional[Callable[[T, Key], Any]] = None,
+    ) -> Any:
         try:
-            return self.eval_key(data, key)
+            return (eval_key or self.eval_key)(data, key)
         except KeyError as e:
             if key.default is not RAISE_EXCEPTION:
                 return key.default
@@ -134,12 +190,59 @@ class Json(FileFormat[JsonValue]):
     ```
     $.inventory[3].price
     ```
+
+    :param streaming: Read only the parts of the file needed by the keys,
+        and stop reading once all keys have been found. Objects containing a
+        key are read to the end, as a later duplicate field replaces an
+        earlier one. Only supported for UTF-8 files. If any key uses more
+        than the simple `.` and `[]` syntax, the whole file is read as usual.
+    :param chunk_size: Number of bytes to read at a time when streaming
+    :param decoder: The JSON decoder to use, one of "json", "orjson" or
+        "auto". The default is the standard library. "auto" uses `orjson` if
+        it's installed, falling back to the standard library for documents
+        that `orjson` rejects.
     """
 
+    streaming: bool = False
+    chunk_size: int = json_stream.DEFAULT_CHUNK_SIZE
+    decoder: str = "json"
+
+    def __post_init__(self) -> None:
+        self._decode = json_decoder.get_decoder(self.decoder)
+
+    def get_values(
+        self,
+        file: IO[bytes],
+        keys: Iterable[Key],
+    ) -> dict[Key, Any]:
+        """Get a list of values from a file"""
+
+        if not self.streaming:
+            data = json_decoder.decode_file(file, self._decode)
+            return self.eval_keys(data, keys)
+
+        keys = list(keys)
+        data = json_stream.load_paths(
+            file,
+            {key.key for key in keys},
+            chunk_size=self.chunk_size,
+            decoder=self._decode,
+        )
+        return self.eval_keys(data, keys)
+
+    def get_value(self, file: IO[bytes], key: Key) -> Any:
+        """Convenience function for getting a single value"""
+
+        if not self.streaming:
+            data = json_decoder.decode_file(file, self._decode)
+            return self._eval_key_wrapper(data, key)
+
+        return self.get_values(file, [key])[key]
+
     @staticmethod
     @contextlib.contextmanager
     def parse_data(file: IO[bytes]) -> Generator[JsonValue]:
-        yield json.load(file)
+        yield json_decoder.decode_file(file, json_decoder.get_decoder("json"))
 
     @staticmethod
     def eval_key(data: JsonValue, key: Key) -> JsonValue:
@@ -147,6 +250,24 @@ class Json(FileFormat[JsonValue]):
 
         return key.resolve_list_match(values)
 
+    def eval_keys(self, data: JsonValue, keys: Iterable[Key]) -> dict[Key, Any]:
+        keys = list(keys)
+        # Resolve as many keys as possible in a single traversal
+        batch_values = jsonpath.batch_get(data, {key.key for key in keys})
+
+        def eval_key(data: JsonValue, key: Key) -> JsonValue:
+            values = batch_values.get(key.key)
+            if values is None:
+                return self.eval_key(data, key)
+
+            return key.resolve_list_match(values)
+
+        return {
+            # ruff hint
+            key: self._eval_key_wrapper(data, key, eval_key)
+            for key in keys
+        }
+
 
 @dataclass
 class ZipMember(Format):
@@ -154,18 +275,22 @@ class ZipMember(Format):
 
     :param filters: A set of filters used to select the desired archive member
     :param format: The `Format` of the archive member
+    :param prefetch: Read the archive with as few reads as possible: one for
+        the end of the archive, which usually contains the whole central
+        directory, and one for the compressed bytes of the selected member.
+        Use this with storages that make a request for every read, such as
+        `S3File` or `HttpRequest` with `range_reads` enabled.
     """
 
     filters: dict[str, Any]
     """Filter against any attributes of zipfile.ZipInfo objects"""
     format: Format
+    prefetch: bool = False
+
+    random_access: ClassVar[bool] = True
 
     def __post_init__(self) -> None:
-        self._compiled_filters = {
-            # ruff hint
-            k: re.compile(v) if isinstance(v, str) else v
-            for k, v in self.filters.items()
-        }
+        self._compiled_filters = compile_filters(self.filters)
 
     def get_values(
         self,
@@ -174,52 +299,209 @@ class ZipMember(Format):
     ) -> dict[Key, Any]:
         """Get a list of values from a file"""
 
-        with zipfile.ZipFile(file, "r") as zf:
-            file = self._get_file_from_archive(zf)
-            return self.format.get_values(file, keys)
+        with ZipIndex.open_archive(file, prefetch=self.prefetch) as index:
+            return self.get_archive_values(index, keys)
 
     def get_value(self, file: IO[bytes], key: Key) -> Any:
         """Convenience function for getting a single value"""
 
-        with zipfile.ZipFile(file, "r") as zf:
-            file = self._get_file_from_archive(zf)
-            return self.format.get_value(file, key)
+        with ZipIndex.open_archive(file, prefetch=self.prefetch) as index:
+            with self._get_file_from_archive(index) as file:
+                with open_for_format(file, self.format) as file:
+                    return self.format.get_value(file, key)
 
-    def _get_file_from_archive(self, zf: zipfile.ZipFile) -> IO[bytes]:
-        """Return the member from the archive which matches all filters."""
+    def get_archive_values(
+        self,
+        index: "ZipIndex",
+        keys: Iterable[Key],
+    ) -> dict[Key, Any]:
+        """Get a list of values from the member of an archive that is
+        already open.
+        """
 
-        zipinfo_list = zf.infolist()
+        with self._get_file_from_archive(index) as file:
+            with open_for_format(file, self.format) as file:
+                return self.format.get_values(file, keys)
+
+    def _get_file_from_archive(self, index: "ZipIndex") -> IO[bytes]:
+        """Return the member from the archive which matches all filters."""
 
         # Special error message to make debugging empty archive easier
-        if not zipinfo_list:
+        if not index.infolist:
             raise FormatError("no members in archive")
 
-        for zipinfo in zipinfo_list:
-            if self._matches_filters(zipinfo):
-                return zf.open(zipinfo, "r")
+        zipinfo = index.find(self._compiled_filters, self._matches_filters)
+        if zipinfo is not None:
+            return index.open_member(zipinfo)
 
         raise FormatError(f"no archive members matched filters {self.filters}")
 
     def _matches_filters(self, zipinfo: zipfile.ZipInfo) -> bool:
-        for key, pattern in self._compiled_filters.items():
-            try:
-                value = getattr(zipinfo, key)
-            except AttributeError:
-                return False
+        # The is_dir method can't be accessed because we don't include a
+        # mechanism for calling it. We could add a special case, or a
+        # feature to call member functions automatically, but as there is
+        # no use case for matching a directory inside the archive, we just
+        # leave it unimplemented.
+        return matches_filters(self._compiled_filters, zipinfo)
+
+
+def compile_filters(filters: dict[str, Any]) -> dict[str, Any]:
+    """Compile the string values of archive member filters to regexes."""
+
+    return {
+        # ruff hint
+        k: re.compile(v) if isinstance(v, str) else v
+        for k, v in filters.items()
+    }
 
-            # The is_dir method can't be accessed because we don't include a
-            # mechanism for calling it. We could add a special case, or a
-            # feature to call member functions automatically, but as there is
-            # no use case for matching a directory inside the archive, we just
-            # leave it unimplemented.
 
-            if isinstance(pattern, re.Pattern):
-                if not pattern.fullmatch(value):
-                    return False
-            elif value != pattern:
+def matches_filters(filters: Mapping[str, Any], member: Any) -> bool:
+    """Check whether the attributes of an archive member match all filters.
+
+    :param filters: Filters returned by `compile_filters`
+    :param member: The archive member, such as a `zipfile.ZipInfo`
+    """
+    for key, pattern in filters.items():
+        try:
+            value = getattr(member, key)
+        except AttributeError:
+            return False
+
+        if isinstance(pattern, re.Pattern):
+            if not pattern.fullmatch(value):
                 return False
+        elif value != pattern:
+            return False
+
+    return True
+
+
+class ZipIndex:
+    """An index of the members of an open zip archive.
+
+    The central directory is only read once when the archive is opened, and
+    members are looked up by name instead of checking every member whenever
+    a `filename` filter has no special regex syntax. This makes it cheap to
+    find many members of an archive with thousands of entries.
+    """
+
+    def __init__(self, zf: zipfile.ZipFile, prefetch_file: Optional["_PrefetchFile"] = None):
+        self.zf = zf
+        self.infolist = zf.infolist()
+        self._prefetch_file = prefetch_file
+        self._by_name: dict[str, list[zipfile.ZipInfo]] = {}
+        for zipinfo in self.infolist:
+            self._by_name.setdefault(zipinfo.filename, []).append(zipinfo)
+
+    @classmethod
+    @contextlib.contextmanager
+    def open_archive(cls, file: IO[bytes], prefetch: bool = False) -> Generator["ZipIndex"]:
+        """Open a zip archive and index its members.
+
+        :param prefetch: Read the end of the archive, and later each member
+            that is opened, with a single read
+        """
+        prefetch_file = None
+        if prefetch:
+            prefetch_file = _PrefetchFile(file)
+            prefetch_file.prefetch(prefetch_file.size - ZIP_TAIL_SIZE, prefetch_file.size)
+            file = cast(IO[bytes], prefetch_file)
+
+        with zipfile.ZipFile(file, "r") as zf:
+            yield cls(zf, prefetch_file)
+
+    def open_member(self, zipinfo: zipfile.ZipInfo) -> IO[bytes]:
+        if self._prefetch_file is not None:
+            # The local header has the same fields as the central directory
+            # entry, but may have a different extra field.
+            size = (
+                ZIP_LOCAL_HEADER_SIZE
+                + len(zipinfo.orig_filename.encode())
+                + len(zipinfo.extra)
+                + ZIP_LOCAL_HEADER_SLACK
+                + zipinfo.compress_size
+            )
+            self._prefetch_file.prefetch(zipinfo.header_offset, zipinfo.header_offset + size)
+
+        return self.zf.open(zipinfo, "r")
+
+    def find(
+        self,
+        filters: Mapping[str, Any],
+        matches: Callable[[zipfile.ZipInfo], bool],
+    ) -> Optional[zipfile.ZipInfo]:
+        """Return the first member which matches the filters.
+
+        :param filters: The compiled filters, used to look up the member name
+        :param matches: Checks whether a member matches all filters
+        """
+        name = filters.get("filename")
+        if isinstance(name, re.Pattern):
+            name = literal_value(name)
+
+        candidates: Iterable[zipfile.ZipInfo]
+        if isinstance(name, str):
+            candidates = self._by_name.get(name, [])
+        else:
+            candidates = self.infolist
+
+        for zipinfo in candidates:
+            if matches(zipinfo):
+                return zipinfo
+
+        return None
+
+
+class _PrefetchFile(RangeFile):
+    """A file which serves reads from ranges that were read ahead of time.
+
+    Reads which aren't entirely inside a prefetched range are passed through
+    to the underlying file.
+    """
 
-        return True
+    def __init__(self, file: IO[bytes]):
+        super().__init__(file.seek(0, io.SEEK_END))
+        self._file = file
+        self._ranges: list[tuple[int, bytes]] = []
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def prefetch(self, start: int, end: int) -> None:
+        start = max(start, 0)
+        end = min(end, self._size)
+        if start >= end or self._find_range(start, end) is not None:
+            return
+
+        self._file.seek(start)
+        self._ranges.append((start, self._file.read(end - start)))
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        cached = self._find_range(start, end)
+        if cached is not None:
+            range_start, data = cached
+            return data[start - range_start : end - range_start]
+
+        # Only read the part before a prefetched range that the read ends in,
+        # for example the start of a central directory that didn't fit in the
+        # prefetched end of the archive.
+        suffix = b""
+        for range_start, data in self._ranges:
+            if start < range_start < end <= range_start + len(data):
+                suffix = data[: end - range_start]
+                end = range_start
+                break
+
+        self._file.seek(start)
+        return self._file.read(end - start) + suffix
+
+    def _find_range(self, start: int, end: int) -> Optional[tuple[int, bytes]]:
+        for range_start, data in self._ranges:
+            if range_start <= start and end <= range_start + len(data):
+                return range_start, data
+
+        return None
 
 
 ZIP_INFO_ATTRS = [
@@ -231,36 +513,321 @@ ZIP_INFO_ATTRS = [
 
 
 @dataclass
-class ZipInfo(FileFormat[dict]):
-    """Query Zip headers and directory information."""
+class ZipInfo(FileFormat[Any]):
+    """Query Zip headers and directory information.
+
+    Keys are evaluated against a view of the archive in which the attributes
+    of each member are only read when a key refers to them. Besides the
+    `infolist`, `filename` and `comment` of the archive, the view provides
+    the aggregate values `member_count`, `total_file_size` and
+    `total_compress_size`, which are computed directly from the central
+    directory. The aggregate values are only available by name, and aren't
+    part of the results of paths such as `$` or `$.*`.
+
+    Paths that use `jsonpath_ng` features such as wildcards or recursive
+    descent are evaluated against a plain dict copy of the archive instead.
+    """
+
+    random_access: ClassVar[bool] = True
 
     @staticmethod
     @contextlib.contextmanager
-    def parse_data(file: IO[bytes]) -> Generator[dict]:
+    def parse_data(file: IO[bytes]) -> Generator[Any]:
         with zipfile.ZipFile(file, "r") as zf:
-            yield {
-                "infolist": [
-                    {
-                        # ruff hint
-                        k: getattr(info, k)
-                        for k in ZIP_INFO_ATTRS
-                    }
-                    for info in zf.infolist()
-                ],
-                "filename": zf.filename,
-                "comment": zf.comment,
-            }
+            yield _ZipArchiveView(zf)
 
     @staticmethod
-    def eval_key(data: dict, key: Key) -> Any:
-        values = jsonpath.get(data, key.key)
+    def eval_key(data: Any, key: Key) -> Any:
+        path = jsonpath.compile(key.key)
+        # jsonpath_ng only descends into dicts
+        if not path.is_simple:
+            data = _materialize(data)
+        values = path.get(data)
 
-        return key.resolve_list_match(values)
+        return key.resolve_list_match([_materialize(value) for value in values])
+
+
+class _ZipArchiveView(Mapping[str, Any]):
+    """The directory information of a zip archive. Values are computed the
+    first time they are looked up.
+    """
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self._zf = zf
+        self._values: dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._values:
+            get_value = _ZIP_ARCHIVE_KEYS.get(key) or _ZIP_ARCHIVE_AGGREGATES[key]
+            self._values[key] = get_value(self._zf)
+
+        return self._values[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_ZIP_ARCHIVE_KEYS)
+
+    def __len__(self) -> int:
+        return len(_ZIP_ARCHIVE_KEYS)
+
+
+class _ZipInfoView(Mapping[str, Any]):
+    """The attributes of a `zipfile.ZipInfo`, read when they are looked up."""
+
+    __slots__ = ("_info",)
+
+    def __init__(self, info: zipfile.ZipInfo):
+        self._info = info
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in _ZIP_INFO_ATTRS_SET:
+            raise KeyError(key)
+
+        return getattr(self._info, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(ZIP_INFO_ATTRS)
+
+    def __len__(self) -> int:
+        return len(ZIP_INFO_ATTRS)
+
+
+_ZIP_INFO_ATTRS_SET = frozenset(ZIP_INFO_ATTRS)
+_ZIP_ARCHIVE_KEYS: dict[str, Callable[[zipfile.ZipFile], Any]] = {
+    "infolist": lambda zf: [_ZipInfoView(info) for info in zf.infolist()],
+    "filename": lambda zf: zf.filename,
+    "comment": lambda zf: zf.comment,
+}
+# Only looked up by name, so they aren't included when the whole archive is
+# queried
+_ZIP_ARCHIVE_AGGREGATES: dict[str, Callable[[zipfile.ZipFile], Any]] = {
+    "member_count": lambda zf: len(zf.infolist()),
+    "total_file_size": lambda zf: sum(info.file_size for info in zf.infolist()),
+    "total_compress_size": lambda zf: sum(info.compress_size for info in zf.infolist()),
+}
+
+
+def _materialize(value: Any) -> Any:
+    """Convert the views in a query result to plain dicts."""
+
+    if isinstance(value, (_ZipArchiveView, _ZipInfoView)):
+        return {k: _materialize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_materialize(v) for v in value]
+
+    return value
 
 
 @dataclass
-class Bzip2File(Format):
-    """A Bzip2 compressed file
+class TarMember(Format):
+    """A member from a tar archive.
+
+    Archives compressed with gzip, bzip2 or xz are decompressed
+    transparently. The archive is read as a stream which stops at the first
+    member that matches the filters, so the rest of the archive is never
+    read.
+
+    The members of uncompressed archives read from seekable storages are
+    also indexed in memory by the identity of the file, see
+    `get_file_identity`. Later reads of the same archive, for example by
+    other sources, seek straight to members that were already passed over
+    and continue scanning where the last scan stopped for the others.
+
+    :param filters: A set of filters used to select the desired archive
+        member. Only regular files are matched.
+    :param format: The `Format` of the archive member
+    """
+
+    filters: dict[str, Any]
+    """Filter against any attributes of tarfile.TarInfo objects"""
+    format: Format
+
+    def __post_init__(self) -> None:
+        self._compiled_filters = compile_filters(self.filters)
+
+    def get_values(
+        self,
+        file: IO[bytes],
+        keys: Iterable[Key],
+    ) -> dict[Key, Any]:
+        """Get a list of values from a file"""
+
+        with self._open_member(file) as member:
+            return self.format.get_values(member, keys)
+
+    def get_value(self, file: IO[bytes], key: Key) -> Any:
+        """Convenience function for getting a single value"""
+
+        with self._open_member(file) as member:
+            return self.format.get_value(member, key)
+
+    @contextlib.contextmanager
+    def _open_member(self, file: IO[bytes]) -> Generator[IO[bytes]]:
+        identity = get_file_identity(file) if file.seekable() else None
+        index = TarIndex.get_cached(identity) if identity is not None else None
+        start = 0
+        if index is not None:
+            tarinfo = index.find(self._compiled_filters, self._matches_filters)
+            if tarinfo is not None:
+                yield cast(IO[bytes], _MemberFile(file, tarinfo.offset_data, tarinfo.size))
+                return
+
+            # Archives don't have to end with empty blocks
+            if index.next_offset is None or index.next_offset >= file.seek(0, io.SEEK_END):
+                self._raise_no_match(index.members)
+            start = index.next_offset
+            file.seek(start)
+        else:
+            index = TarIndex()
+
+        # Copy the index so that concurrent scans don't modify it
+        index = TarIndex(index.members)
+        with tarfile.open(fileobj=file, mode="r|*") as tf:
+            # Offsets in compressed archives refer to the decompressed data,
+            # and global headers apply to every member after them, so
+            # neither can be resumed part way through. Sparse members aren't
+            # stored contiguously, so indexing stops before the first one and
+            # later scans read it from the stream again.
+            indexable = identity is not None and getattr(tf.fileobj, "comptype", None) == "tar"
+            for tarinfo in tf:
+                indexable = indexable and not tf.pax_headers and tarinfo.sparse is None
+                if indexable:
+                    index.add(tarinfo, start)
+                if not self._matches_filters(tarinfo):
+                    continue
+
+                if indexable:
+                    assert identity is not None
+                    index.next_offset = start + tf.offset
+                    index.save(identity)
+
+                member = tf.extractfile(tarinfo)
+                assert member is not None
+                with member, open_for_format(member, self.format) as member:
+                    yield member
+                return
+
+            if indexable:
+                assert identity is not None
+                index.next_offset = None
+                index.save(identity)
+
+        self._raise_no_match(index.members if indexable else None)
+
+    def _raise_no_match(self, members: Optional[list[tarfile.TarInfo]]) -> NoReturn:
+        # Special error message to make debugging empty archive easier
+        if members is not None and not members:
+            raise FormatError("no members in archive")
+
+        raise FormatError(f"no archive members matched filters {self.filters}")
+
+    def _matches_filters(self, tarinfo: tarfile.TarInfo) -> bool:
+        return tarinfo.isreg() and matches_filters(self._compiled_filters, tarinfo)
+
+
+class TarIndex:
+    """The members of an uncompressed tar archive that have been read so far.
+
+    :param members: Members in archive order, with absolute data offsets
+    """
+
+    def __init__(self, members: Iterable[tarfile.TarInfo] = ()):
+        self.members: list[tarfile.TarInfo] = []
+        # Offset of the header after the last member, or None once the whole
+        # archive has been read
+        self.next_offset: Optional[int] = 0
+        self._by_name: dict[str, list[tarfile.TarInfo]] = {}
+        for tarinfo in members:
+            self._append(tarinfo)
+
+    @classmethod
+    def get_cached(cls, identity: str) -> Optional["TarIndex"]:
+        """Return the index of the archive with this identity, if any."""
+
+        with _TAR_INDEX_LOCK:
+            index = _TAR_INDEX_CACHE.get(identity)
+            if index is not None:
+                _TAR_INDEX_CACHE.move_to_end(identity)
+
+        return index
+
+    def save(self, identity: str) -> None:
+        """Cache the index unless it knows of fewer members than the cached
+        one.
+        """
+        with _TAR_INDEX_LOCK:
+            cached = _TAR_INDEX_CACHE.get(identity)
+            if cached is not None and cached.next_offset is None and self.next_offset is not None:
+                return
+            if cached is not None and len(cached.members) > len(self.members):
+                return
+
+            _TAR_INDEX_CACHE[identity] = self
+            _TAR_INDEX_CACHE.move_to_end(identity)
+            while len(_TAR_INDEX_CACHE) > TAR_INDEX_CACHE_SIZE:
+                _TAR_INDEX_CACHE.popitem(last=False)
+
+    def add(self, tarinfo: tarfile.TarInfo, start: int) -> None:
+        """Add a member which was read from a stream starting at `start`."""
+
+        tarinfo = copy.copy(tarinfo)
+        tarinfo.offset += start
+        tarinfo.offset_data += start
+        self._append(tarinfo)
+
+    def _append(self, tarinfo: tarfile.TarInfo) -> None:
+        self.members.append(tarinfo)
+        self._by_name.setdefault(tarinfo.name, []).append(tarinfo)
+
+    def find(
+        self,
+        filters: Mapping[str, Any],
+        matches: Callable[[tarfile.TarInfo], bool],
+    ) -> Optional[tarfile.TarInfo]:
+        """Return the first member which matches the filters.
+
+        :param filters: The compiled filters, used to look up the member name
+        :param matches: Checks whether a member matches all filters
+        """
+        name = filters.get("name")
+        if isinstance(name, re.Pattern):
+            name = literal_value(name)
+
+        candidates: Iterable[tarfile.TarInfo]
+        if isinstance(name, str):
+            candidates = self._by_name.get(name, [])
+        else:
+            candidates = self.members
+
+        for tarinfo in candidates:
+            if matches(tarinfo):
+                return tarinfo
+
+        return None
+
+
+_TAR_INDEX_CACHE: OrderedDict[str, TarIndex] = OrderedDict()
+_TAR_INDEX_LOCK = threading.Lock()
+
+
+class _MemberFile(RangeFile):
+    """The data of an archive member which is stored contiguously."""
+
+    def __init__(self, file: IO[bytes], offset: int, size: int):
+        super().__init__(size)
+        self._file = file
+        self._offset = offset
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        self._file.seek(self._offset + start)
+        return self._file.read(end - start)
+
+
+@dataclass
+class CompressedFile(Format, ABC, register=False):
+    """A Format for querying files inside a compressed stream.
+
+    The stream is decompressed as the inner format reads it, so no
+    temporary copy is made unless the inner format needs random access.
 
     :param format: The `Format` of the compressed file
     """
@@ -274,11 +841,140 @@ class Bzip2File(Format):
     ) -> dict[Key, Any]:
         """Get a list of values from a file"""
 
-        with bz2.BZ2File(file, mode="rb") as bz2f:
-            return self.format.get_values(bz2f, keys)
+        with self.open_decompressed(file) as decompressed:
+            with open_for_format(decompressed, self.format) as file:
+                return self.format.get_values(file, keys)
 
     def get_value(self, file: IO[bytes], key: Key) -> Any:
         """Convenience function for getting a single value"""
 
-        with bz2.BZ2File(file, mode="rb") as bz2f:
-            return self.format.get_value(bz2f, key)
+        with self.open_decompressed(file) as decompressed:
+            with open_for_format(decompressed, self.format) as file:
+                return self.format.get_value(file, key)
+
+    @abstractmethod
+    def open_decompressed(self, file: IO[bytes]) -> IO[bytes]:
+        """Wrap the compressed stream in a decompressing file object.
+
+        :param file: The compressed stream
+        :returns: A readable file which is closed once the format is done
+        """
+        pass
+
+
+@dataclass
+class Bzip2File(CompressedFile):
+    """A Bzip2 compressed file
+
+    :param format: The `Format` of the compressed file
+    :param parallel: Decompress the blocks of the file concurrently using a
+        thread pool. The output is still passed to `format` in order, and only
+        a few blocks per thread are kept in memory at a time.
+    :param max_workers: Number of threads to use when `parallel` is set,
+        defaults to the number of CPUs
+    """
+
+    parallel: bool = False
+    max_workers: Optional[int] = None
+
+    def open_decompressed(self, file: IO[bytes]) -> IO[bytes]:
+        if self.parallel:
+            return io.BufferedReader(ParallelBZ2Reader(file, max_workers=self.max_workers))
+
+        return bz2.BZ2File(file, mode="rb")
+
+
+@dataclass
+class GzipFile(CompressedFile):
+    """A Gzip compressed file
+
+    :param format: The `Format` of the compressed file
+    """
+
+    def open_decompressed(self, file: IO[bytes]) -> IO[bytes]:
+        return gzip.GzipFile(fileobj=file, mode="rb")  # type: ignore[return-value]
+
+
+@dataclass
+class XzFile(CompressedFile):
+    """An XZ or legacy LZMA compressed file
+
+    :param format: The `Format` of the compressed file
+    """
+
+    def open_decompressed(self, file: IO[bytes]) -> IO[bytes]:
+        return lzma.LZMAFile(file, mode="rb")
+
+
+@contextlib.contextmanager
+def open_for_format(file: IO[bytes], format: Format) -> Generator[IO[bytes]]:
+    """Give formats that need random access a seekable copy of a stream.
+
+    :param file: A decompressed stream, which is slow to seek
+    :param format: The format that will read the stream
+    """
+    if not format.random_access:
+        yield file
+        return
+
+    with spool_file(file) as spooled:
+        yield spooled
+
+
+def spool_file(
+    file: IO[bytes],
+    max_memory_size: int = SPOOL_MAX_MEMORY_SIZE,
+) -> IO[bytes]:
+    """Copy the rest of a stream into a new seekable file.
+
+    Streams of up to `max_memory_size` bytes are kept in memory, larger ones
+    are written to a temporary file.
+    """
+    data = file.read(max_memory_size + 1)
+    if len(data) <= max_memory_size:
+        return io.BytesIO(data)
+
+    spooled = tempfile.TemporaryFile()
+    try:
+        spooled.write(data)
+        del data
+        shutil.copyfileobj(file, spooled)
+        spooled.seek(0)
+    except BaseException:
+        spooled.close()
+        raise
+
+    return spooled
+
+
+def get_file_identity(file: IO[bytes]) -> Optional[str]:
+    """Return a string which changes whenever the contents of the file do.
+
+    S3 objects opened with s3fs are identified by their path, ETag and size,
+    and local files by their path, modification time and size.
+
+    Other files, including wrappers such as `gzip.GzipFile` which expose the
+    name of the file they wrap, aren't identified, as their contents differ
+    from the underlying file.
+
+    :returns: the identity, or None if the file can't be identified
+    """
+    # Unwrap buffered and block cached files
+    while isinstance(file, (io.BufferedReader, CountingFile)):
+        file = file.raw
+
+    if S3FSFile is not None and isinstance(file, S3FSFile):
+        details = file.details
+        etag = details.get("ETag") or details.get("LastModified")
+        if etag is None:
+            return None
+        return f"s3://{file.path.removeprefix('s3://')}:{etag}:{details.get('size')}"
+
+    if isinstance(file, io.FileIO) and isinstance(file.name, str):
+        try:
+            stat = os.fstat(file.fileno())
+        except (OSError, ValueError):
+            return None
+        return f"{os.path.abspath(file.name)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    return None
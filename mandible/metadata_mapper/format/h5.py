@@ -1,27 +1,182 @@
 import contextlib
+import functools
+import itertools
+import re
+from collections.abc import Callable, Generator, Iterable
 from dataclasses import dataclass
-from typing import IO, Any, Optional
+from types import EllipsisType
+from typing import IO, Any, ClassVar, Optional, Union
 
 import h5py
 import numpy as np
 
 from mandible.metadata_mapper.key import Key
 
-from .format import FileFormat
+from . import h5_index
+from .format import FileFormat, get_file_identity
+
+SELECTION_PATTERN = re.compile(r"(?P<name>.*)\[(?P<selection>[^\[\]]*)\]", re.DOTALL)
+INDEX_PATTERN = re.compile(r"-?[0-9]+")
+SLICE_PATTERN = re.compile(r"(?P<start>-?[0-9]+)?:(?P<stop>-?[0-9]+)?(?::(?P<step>-?[0-9]+)?)?")
+FIELD_PATTERN = re.compile(r"[A-Za-z_][\w.\-]*|'(?P<single>[^']*)'|\"(?P<double>[^\"]*)\"")
+# Commas which are not inside a selection
+ARGUMENT_SEPARATOR = re.compile(r",(?![^\[]*\])")
+REDUCTION_PATTERN = re.compile(r"(?P<function>[a-z_]+)\((?P<args>[^()]*)\)", re.DOTALL)
+# Maximum number of bytes to read at once from datasets that aren't chunked
+BLOCK_SIZE = 16 * 1024 * 1024
+
+Selection = tuple[Union[int, slice, str, EllipsisType], ...]
 
 
 @dataclass
 class H5(FileFormat[Any]):
+    """A Format for querying HDF5 files.
+
+    Keys are paths to a dataset or group, optionally followed by `@` and an
+    attribute name. Dataset paths may end with a numpy style selection so
+    that only part of the dataset is read, for example `/lat[0,0]`,
+    `/data[::100]` or `/table[field]` to select a field of a compound type.
+
+    Summary values of large numeric datasets can be computed without reading
+    the whole dataset into memory using the reduction keys `min(/path)`,
+    `max(/path)`, `mean(/path)`, `count_valid(/path)` and
+    `bounding_box(/lat, /lon)`. Datasets are read one HDF5 chunk at a time,
+    or in blocks of at most 16 MiB if they aren't chunked or only part of
+    them is selected. NaN values as well as values equal to the `_FillValue`
+    attribute are ignored.
+
+    :param numpy_arrays: Return dataset and attribute arrays as the numpy
+        arrays read from the file instead of converting them to lists
+    :param page_buf_size: Size in bytes of the HDF5 page buffer. Files that
+        were written with the paged file space strategy are then read one
+        page at a time, which greatly reduces the number of reads needed
+        for the file metadata. Ignored for files that aren't paged.
+    :param rdcc_nbytes: Size in bytes of the HDF5 chunk cache for each
+        dataset
+    :param index_dir: Directory for sidecar indexes. The first time a file is
+        read, all of its attributes and small datasets are saved to a sidecar
+        keyed by the identity of the file (S3 ETag or local modification
+        time and size). Later reads of the same file answer those keys from
+        the sidecar and only open the file for keys it doesn't cover. Not
+        used together with `numpy_arrays`, or for files which can't be
+        identified such as compressed archive members.
+    :param index_max_dataset_size: Maximum size in bytes of the datasets to
+        store in sidecar indexes
+    """
+
+    numpy_arrays: bool = False
+    page_buf_size: Optional[int] = None
+    rdcc_nbytes: Optional[int] = None
+    index_dir: Optional[str] = None
+    index_max_dataset_size: int = h5_index.DEFAULT_MAX_DATASET_SIZE
+
+    random_access: ClassVar[bool] = True
+
+    def get_values(
+        self,
+        file: IO[bytes],
+        keys: Iterable[Key],
+    ) -> dict[Key, Any]:
+        """Get a list of values from a file"""
+
+        identity = None
+        if self.index_dir is not None and not self.numpy_arrays:
+            identity = get_file_identity(file)
+        if identity is None:
+            return self._get_values(file, keys)
+
+        assert self.index_dir is not None
+        keys = list(keys)
+        index = h5_index.load_index(self.index_dir, identity)
+        if index is None:
+            with self._open(file) as data:
+                index = h5_index.build_index(data, identity, self.index_max_dataset_size)
+                h5_index.save_index(self.index_dir, index)
+                return self.eval_keys(data, keys)
+
+        values = {}
+        missing_keys = []
+        for key in keys:
+            value = self._eval_key_wrapper(index, key, _eval_index_key)
+            if value is h5_index.MISSING:
+                missing_keys.append(key)
+            else:
+                values[key] = value
+
+        if missing_keys:
+            values.update(self._get_values(file, missing_keys))
+
+        return values
+
+    def get_value(self, file: IO[bytes], key: Key) -> Any:
+        """Convenience function for getting a single value"""
+
+        return self.get_values(file, [key])[key]
+
+    def _get_values(self, file: IO[bytes], keys: Iterable[Key]) -> dict[Key, Any]:
+        with self._open(file) as data:
+            return self.eval_keys(data, keys)
+
     @staticmethod
     def parse_data(file: IO[bytes]) -> contextlib.AbstractContextManager[Any]:
         return h5py.File(file, "r")
 
+    def _open(self, file: IO[bytes]) -> contextlib.AbstractContextManager[Any]:
+        """Open a file with the configured HDF5 caches."""
+
+        kwargs = {}
+        if self.rdcc_nbytes is not None:
+            kwargs["rdcc_nbytes"] = self.rdcc_nbytes
+        if self.page_buf_size is None:
+            return h5py.File(file, "r", **kwargs)
+
+        try:
+            return h5py.File(file, "r", page_buf_size=self.page_buf_size, **kwargs)
+        except OSError:
+            # Some versions of HDF5 refuse to open files that aren't paged
+            # when a page buffer is requested
+            file.seek(0)
+            return h5py.File(file, "r", **kwargs)
+
     @staticmethod
     def eval_key(data: Any, key: Key) -> Any:
-        group_key, attribute_key = parse_key(key.key)
-        if attribute_key is not None:
-            return normalize(data[group_key].attrs.get(attribute_key))
-        return normalize(data[group_key][()])
+        return _eval_key(data, key)
+
+    def eval_keys(self, data: Any, keys: Iterable[Key]) -> dict[Key, Any]:
+        eval_key = functools.partial(_eval_key, numpy_arrays=self.numpy_arrays)
+
+        return {
+            # ruff hint
+            key: self._eval_key_wrapper(data, key, eval_key)
+            for key in keys
+        }
+
+
+def _eval_key(data: Any, key: Key, numpy_arrays: bool = False) -> Any:
+    reduction = parse_reduction(key.key)
+    if reduction is not None and key.key not in data:
+        function, args = reduction
+        num_args, reduce = REDUCTIONS[function]
+        if len(args) != num_args:
+            raise ValueError(f"{function} takes {num_args} dataset(s) but {len(args)} were given")
+
+        return reduce(*(get_dataset_stats(data, arg) for arg in args))
+
+    group_key, attribute_key = parse_key(key.key)
+    if attribute_key is not None:
+        value = data[group_key].attrs.get(attribute_key)
+    else:
+        name, selection = parse_selection(group_key)
+        if selection is None or group_key in data:
+            value = data[group_key][()]
+        else:
+            value = data[name][selection]
+
+    return normalize(value, numpy_arrays=numpy_arrays)
+
+
+def _eval_index_key(index: "h5_index.H5Index", key: Key) -> Any:
+    return index.get(key.key)
 
 
 def parse_key(key: str) -> tuple[str, Optional[str]]:
@@ -47,7 +202,207 @@ def parse_key(key: str) -> tuple[str, Optional[str]]:
     return left.replace(placeholder, "@"), right.replace(placeholder, "@")
 
 
-def normalize(node_val: Any) -> Any:
+def parse_selection(group_key: str) -> tuple[str, Optional[Selection]]:
+    """Parse a numpy style selection from the end of a dataset path.
+
+    Selections are made up of comma separated indices (`0`), slices
+    (`1:10:2`), ellipsis (`...`) and compound field names (`field` or
+    `'field name'`).
+    :returns: (str, tuple | None) -- the dataset name and the selection (if any)
+    """
+
+    m = SELECTION_PATTERN.fullmatch(group_key)
+    if m is None:
+        return group_key, None
+
+    selection: list[Union[int, slice, str, EllipsisType]] = []
+    for item in m.group("selection").split(","):
+        item = item.strip()
+        if INDEX_PATTERN.fullmatch(item):
+            selection.append(int(item))
+        elif slice_match := SLICE_PATTERN.fullmatch(item):
+            start, stop, step = (
+                # ruff hint
+                int(value) if value is not None else None
+                for value in slice_match.group("start", "stop", "step")
+            )
+            selection.append(slice(start, stop, step))
+        elif item == "...":
+            selection.append(Ellipsis)
+        elif field_match := FIELD_PATTERN.fullmatch(item):
+            quoted = field_match.group("single", "double")
+            selection.append(next((value for value in quoted if value is not None), item))
+        else:
+            # Not a selection, just a name containing brackets
+            return group_key, None
+
+    return m.group("name"), tuple(selection)
+
+
+class DatasetStats:
+    """Summary statistics of the valid values in a dataset."""
+
+    def __init__(self) -> None:
+        self.min: Any = None
+        self.max: Any = None
+        self.sum = 0.0
+        self.count = 0
+
+    def update(self, values: np.ndarray, fill_value: Any = None) -> None:
+        values = np.asarray(values).reshape(-1)
+        if values.dtype.kind == "f":
+            values = values[~np.isnan(values)]
+        if fill_value is not None:
+            values = values[values != fill_value]
+        if values.size == 0:
+            return
+
+        block_min = values.min()
+        block_max = values.max()
+        self.min = block_min if self.min is None else min(self.min, block_min)
+        self.max = block_max if self.max is None else max(self.max, block_max)
+        self.sum += float(values.sum(dtype=np.float64))
+        self.count += values.size
+
+    @property
+    def mean(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+
+        return self.sum / self.count
+
+
+# Reduction functions and the number of datasets they take
+REDUCTIONS: dict[str, tuple[int, Callable[..., Any]]] = {
+    "min": (1, lambda stats: normalize(stats.min)),
+    "max": (1, lambda stats: normalize(stats.max)),
+    "mean": (1, lambda stats: stats.mean),
+    "count_valid": (1, lambda stats: stats.count),
+    "bounding_box": (
+        2,
+        lambda lat, lon: {
+            "WestBoundingCoordinate": normalize(lon.min),
+            "NorthBoundingCoordinate": normalize(lat.max),
+            "EastBoundingCoordinate": normalize(lon.max),
+            "SouthBoundingCoordinate": normalize(lat.min),
+        },
+    ),
+}
+
+
+def parse_reduction(key: str) -> Optional[tuple[str, list[str]]]:
+    """Parse a reduction key such as `min(/path)`.
+
+    :returns: (str, list[str]) | None -- the name of the reduction and its
+        dataset paths, or None if the key is not a reduction
+    """
+
+    m = REDUCTION_PATTERN.fullmatch(key.strip())
+    if m is None or m.group("function") not in REDUCTIONS:
+        return None
+
+    return m.group("function"), [arg.strip() for arg in ARGUMENT_SEPARATOR.split(m.group("args"))]
+
+
+def get_dataset_stats(data: Any, path: str) -> DatasetStats:
+    """Compute statistics for a numeric dataset one block at a time."""
+
+    name, selection = parse_selection(path)
+    if selection is not None and path in data:
+        name, selection = path, None
+
+    dset = data[name]
+    if not isinstance(dset, h5py.Dataset):
+        raise TypeError(f"{repr(name)} is not a dataset")
+    if dset.dtype.kind not in "biuf":
+        raise TypeError(f"cannot reduce dataset {repr(name)} with dtype {dset.dtype}")
+
+    fill_value = dset.attrs.get("_FillValue")
+    if fill_value is not None:
+        fill_value = np.asarray(fill_value).reshape(-1)[0]
+
+    stats = DatasetStats()
+    for block in iter_blocks(dset, selection):
+        stats.update(block, fill_value)
+
+    return stats
+
+
+def iter_blocks(dset: h5py.Dataset, selection: Optional[Selection] = None) -> Generator[np.ndarray]:
+    """Read a dataset, or a selection of one, in blocks of at most
+    `BLOCK_SIZE` bytes. Whole chunked datasets are read one chunk at a time.
+    """
+
+    if dset.shape is None or dset.size == 0:
+        return
+    if dset.ndim == 0:
+        yield dset[selection if selection is not None else ()]
+        return
+    if selection is None and dset.chunks is not None:
+        for chunk_slice in dset.iter_chunks():
+            yield dset[chunk_slice]
+        return
+
+    ranges = expand_selection(dset.shape, selection or ())
+    block_shape = get_block_shape([len(r) for r in ranges], dset.dtype.itemsize)
+    for starts in itertools.product(
+        *(range(0, len(r), size) for r, size in zip(ranges, block_shape)),
+    ):
+        block_selection = []
+        for r, size, start in zip(ranges, block_shape, starts):
+            block_range = r[start : start + size]
+            block_selection.append(slice(block_range[0], block_range[-1] + 1, block_range.step))
+        yield dset[tuple(block_selection)]
+
+
+def expand_selection(shape: tuple[int, ...], selection: Selection) -> list[range]:
+    """Convert a selection to the range of indices it selects along every
+    axis of a dataset. Integer indices become ranges of length one.
+    """
+
+    items = list(selection)
+    for i, item in enumerate(items):
+        if item is Ellipsis:
+            items[i : i + 1] = [slice(None)] * (len(shape) - len(items) + 1)
+            break
+    if len(items) > len(shape):
+        raise IndexError(f"too many indices for dataset with {len(shape)} dimension(s)")
+    items += [slice(None)] * (len(shape) - len(items))
+
+    ranges = []
+    for item, size in zip(items, shape):
+        if isinstance(item, int):
+            index = item + size if item < 0 else item
+            if not 0 <= index < size:
+                raise IndexError(f"Index ({item}) out of range for (0-{size - 1})")
+            ranges.append(range(index, index + 1))
+        elif isinstance(item, slice):
+            r = range(*item.indices(size))
+            if r.step < 1:
+                raise ValueError(f"Step must be >= 1 (got {r.step})")
+            ranges.append(r)
+        else:
+            raise ValueError(f"cannot reduce selection {repr(item)}")
+
+    return ranges
+
+
+def get_block_shape(shape: list[int], itemsize: int) -> list[int]:
+    """Get the largest block shape of at most `BLOCK_SIZE` bytes, which is
+    filled along the last axes first so that blocks are contiguous.
+    """
+
+    budget = max(1, BLOCK_SIZE // max(1, itemsize))
+    block_shape = []
+    for size in reversed(shape):
+        block_size = max(1, min(size, budget))
+        block_shape.append(block_size)
+        budget //= block_size
+
+    return block_shape[::-1]
+
+
+def normalize(node_val: Any, numpy_arrays: bool = False) -> Any:
     if isinstance(node_val, np.bool_):
         return bool(node_val)
     if isinstance(node_val, np.integer):
@@ -55,13 +410,38 @@ def normalize(node_val: Any) -> Any:
     if isinstance(node_val, np.floating):
         return float(node_val)
     if isinstance(node_val, np.ndarray):
-        value = [
-            # ruff hint
-            x.decode("utf-8") if isinstance(x, bytes) else x
-            for x in node_val.tolist()
-        ]
-        return value
+        if numpy_arrays:
+            return node_val
+        return normalize_array(node_val)
     if isinstance(node_val, bytes):
         return node_val.decode("utf-8")
 
     return node_val
+
+
+def normalize_array(array: np.ndarray) -> Any:
+    """Convert an array to (nested) lists of python values.
+
+    Only arrays which may contain bytes are converted element by element,
+    everything else is converted by numpy in one go.
+    """
+
+    if array.dtype.kind not in "SO":
+        return array.tolist()
+
+    values = [
+        # ruff hint
+        x.decode("utf-8") if isinstance(x, bytes) else x
+        for x in array.ravel().tolist()
+    ]
+    if array.ndim == 0:
+        return values[0]
+    if array.ndim == 1:
+        return values
+
+    # Restore the shape without letting numpy interpret the values
+    nested = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        nested[i] = value
+
+    return nested.reshape(array.shape).tolist()
@@ -0,0 +1,232 @@
+"""Sidecar indexes of the attributes and small datasets in HDF5 files.
+
+Opening a large remote HDF5 file just to read a few attributes can be slow,
+so the values that are cheap to store are extracted once and saved as a
+small JSON file next to other sidecars in an index directory. Sidecars are
+named after the identity of the file they were built from, which includes
+the S3 ETag or local modification time, so a changed file gets a new index.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import tempfile
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import h5py
+
+from . import h5
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+# Datasets larger than this many bytes are not stored in the index
+DEFAULT_MAX_DATASET_SIZE = 64 * 1024
+
+
+class _Missing:
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+# Returned when a value can't be answered from the index
+MISSING: Any = _Missing()
+
+
+@dataclass
+class H5Index:
+    identity: str
+    # Normalized values of small datasets by absolute path
+    datasets: dict[str, Any] = field(default_factory=dict)
+    # Normalized attribute values by absolute path of the object they belong
+    # to. Objects with attributes that couldn't be stored are left out.
+    attributes: dict[str, dict[str, Any]] = field(default_factory=dict)
+    # Absolute paths of every object in the file
+    objects: set[str] = field(default_factory=set)
+    # Paths of soft links, external links and additional hard links to an
+    # object. Nothing is known about the paths below them.
+    links: set[str] = field(default_factory=set)
+
+    def get(self, key: str) -> Any:
+        """Get the value of a H5 key from the index.
+
+        :returns: the value, or MISSING if the file needs to be read
+        :raises: KeyError if the key refers to an object that doesn't exist
+        """
+        group_key, attribute_key = h5.parse_key(key)
+        path = _normalize_path(group_key)
+        if path is None:
+            return MISSING
+
+        if attribute_key is not None:
+            attributes = self.attributes.get(path)
+            if attributes is None:
+                return MISSING
+            return attributes.get(attribute_key)
+
+        if path in self.datasets:
+            return self.datasets[path]
+
+        if (
+            path not in self.objects
+            and not self._is_linked(path)
+            and h5.parse_selection(group_key)[1] is None
+            and h5.parse_reduction(key) is None
+        ):
+            raise KeyError(key)
+
+        return MISSING
+
+    def _is_linked(self, path: str) -> bool:
+        while path != "/":
+            if path in self.links:
+                return True
+            path = posixpath.dirname(path)
+
+        return False
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "version": INDEX_VERSION,
+            "identity": self.identity,
+            "datasets": self.datasets,
+            "attributes": self.attributes,
+            "objects": sorted(self.objects),
+            "links": sorted(self.links),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "H5Index":
+        return cls(
+            identity=data["identity"],
+            datasets=data["datasets"],
+            attributes=data["attributes"],
+            objects=set(data["objects"]),
+            links=set(data["links"]),
+        )
+
+
+def _normalize_path(group_key: str) -> Optional[str]:
+    """Convert a key to the absolute path of the object HDF5 resolves it to.
+
+    HDF5 ignores repeated slashes and `.` parts, but doesn't resolve `..`.
+    :returns: the path, or None if it should be resolved by reading the file
+    """
+    if not group_key or ".." in group_key.split("/"):
+        return None
+
+    return posixpath.normpath("/" + group_key.lstrip("/"))
+
+
+def build_index(
+    data: h5py.File,
+    identity: str,
+    max_dataset_size: int = DEFAULT_MAX_DATASET_SIZE,
+) -> H5Index:
+    """Extract all attributes and small datasets from an open HDF5 file."""
+
+    index = H5Index(identity=identity)
+    index.objects.add("/")
+    _add_attributes(index, "/", data)
+
+    groups: list[tuple[str, h5py.Group]] = [("/", data)]
+    seen = {data["/"].id}
+    while groups:
+        path, group = groups.pop()
+        for name in group:
+            child_path = posixpath.join(path, name)
+            if not isinstance(group.get(name, getlink=True), h5py.HardLink):
+                index.links.add(child_path)
+                continue
+
+            child = group[name]
+            index.objects.add(child_path)
+            if child.id in seen:
+                index.links.add(child_path)
+                continue
+            seen.add(child.id)
+
+            _add_attributes(index, child_path, child)
+            if isinstance(child, h5py.Group):
+                groups.append((child_path, child))
+            elif isinstance(child, h5py.Dataset) and child.nbytes <= max_dataset_size:
+                _add_dataset(index, child_path, child)
+
+    return index
+
+
+def load_index(index_dir: str, identity: str) -> Optional[H5Index]:
+    """Load the sidecar for a file if it exists and is up to date."""
+
+    try:
+        with open(get_index_path(index_dir, identity), "rb") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning("Ignoring unreadable H5 index for %s: %s", identity, e)
+        return None
+
+    if data.get("version") != INDEX_VERSION or data.get("identity") != identity:
+        return None
+
+    return H5Index.from_dict(data)
+
+
+def save_index(index_dir: str, index: H5Index) -> None:
+    """Write the sidecar for a file, replacing any existing one atomically."""
+
+    path = get_index_path(index_dir, index.identity)
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(index.to_dict(), f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        log.warning("Failed to write H5 index for %s: %s", index.identity, e)
+
+
+def get_index_path(index_dir: str, identity: str) -> str:
+    digest = hashlib.sha256(identity.encode()).hexdigest()
+    return os.path.join(index_dir, f"{digest}.json")
+
+
+def _add_attributes(index: H5Index, path: str, obj: Any) -> None:
+    attributes = {}
+    try:
+        for name, value in obj.attrs.items():
+            value = h5.normalize(value)
+            if not _is_json_value(value):
+                return
+            attributes[name] = value
+    except Exception:
+        return
+
+    index.attributes[path] = attributes
+
+
+def _add_dataset(index: H5Index, path: str, dset: h5py.Dataset) -> None:
+    try:
+        value = h5.normalize(dset[()])
+    except Exception:
+        return
+
+    if _is_json_value(value):
+        index.datasets[path] = value
+
+
+def _is_json_value(value: Any) -> bool:
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return True
+    if isinstance(value, list):
+        return all(_is_json_value(item) for item in value)
+
+    return False
@@ -0,0 +1,89 @@
+"""Interchangeable backends for decoding JSON documents."""
+
+import io
+import json
+from collections.abc import Callable
+from typing import IO, Union
+
+from mandible.jsonpath import JsonValue
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+
+Buffer = Union[bytes, bytearray, memoryview]
+Decoder = Callable[[Buffer], JsonValue]
+
+
+def _decode_json(data: Buffer) -> JsonValue:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+
+    return json.loads(data)
+
+
+def _decode_orjson(data: Buffer) -> JsonValue:
+    return orjson.loads(data)
+
+
+DECODERS: dict[str, tuple[Decoder, bool]] = {
+    "json": (_decode_json, True),
+    "orjson": (_decode_orjson, orjson is not None),
+}
+
+
+def get_decoder(name: str) -> Decoder:
+    """Get a function for decoding JSON from a bytes like buffer.
+
+    The name "auto" selects `orjson` if it is installed. As `orjson` is
+    stricter than the standard library (for instance it rejects `NaN` and
+    integers larger than 64 bits) any document which it fails to decode is
+    decoded again with the standard library, so "auto" always gives the same
+    results as "json".
+    """
+    if name == "auto":
+        if orjson is not None:
+            return _with_fallback(_decode_orjson, orjson.JSONDecodeError)
+
+        return _decode_json
+
+    if name not in DECODERS:
+        raise ValueError(
+            f"invalid json decoder {repr(name)}, must be one of "
+            f"{', '.join(repr(name) for name in ('auto', *DECODERS))}",
+        )
+
+    decoder, available = DECODERS[name]
+    if not available:
+        raise ValueError(f"{name} must be installed to use the {repr(name)} json decoder")
+
+    return decoder
+
+
+def decode_file(file: IO[bytes], decoder: Decoder) -> JsonValue:
+    """Decode the rest of a file.
+
+    In memory files are decoded straight from their buffer without copying
+    it first.
+    """
+    if isinstance(file, io.BytesIO):
+        with file.getbuffer() as buf:
+            with buf[file.tell() :] as view:
+                value = decoder(view)
+        file.seek(0, io.SEEK_END)
+
+        return value
+
+    return decoder(file.read())
+
+
+def _with_fallback(decoder: Decoder, error: type[Exception]) -> Decoder:
+    def decode(data: Buffer) -> JsonValue:
+        try:
+            return decoder(data)
+        except error:
+            return _decode_json(data)
+
+    return decode
@@ -0,0 +1,405 @@
+"""Incremental extraction of values from a JSON byte stream.
+
+Rather than decoding the whole document, the stream is scanned a chunk at a
+time and only the parts of the document that lie on one of the requested
+paths are decoded. Everything else is skipped over without creating any
+Python objects, and reading stops as soon as every path has been resolved.
+"""
+
+import functools
+import json
+import re
+from collections.abc import Callable, Iterable
+from typing import IO, Optional, Union
+
+from mandible import jsonpath
+from mandible.jsonpath import JsonValue
+
+from .json_decoder import Decoder, decode_file, get_decoder
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_BOM = b"\xef\xbb\xbf"
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_STRUCTURAL = re.compile(rb'["\[\]{}]')
+_SCALAR = re.compile(rb"[^,:\]}\[{\s\"]*")
+
+_QUOTE = ord('"')
+_OBJECT_START = ord("{")
+_OBJECT_END = ord("}")
+_ARRAY_START = ord("[")
+_ARRAY_END = ord("]")
+_COMMA = ord(",")
+_COLON = ord(":")
+
+
+def load_paths(
+    file: IO[bytes],
+    paths: Iterable[str],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    decoder: Optional[Decoder] = None,
+) -> JsonValue:
+    """Read the parts of a UTF-8 JSON document needed to evaluate `paths`.
+
+    The result is a pruned copy of the document which gives the same results
+    as the full document for every one of the requested paths. If any of the
+    paths can't be evaluated incrementally, the whole document is loaded
+    instead.
+
+    If an object contains duplicate keys, the last occurrence is used, as
+    with `json.load`. Objects are therefore always read to the end, but
+    values which aren't needed are skipped without being decoded. Once every
+    path has been resolved outside of any object, the rest of the stream is
+    not read, so it is also not validated.
+
+    :param decoder: Used to decode the parts of the document that are kept,
+        defaults to the standard library decoder
+    """
+    if decoder is None:
+        decoder = get_decoder("json")
+
+    root = _PathNode()
+    for path in paths:
+        steps = jsonpath.get_steps(path)
+        if steps is None:
+            return decode_file(file, decoder)
+
+        node = root
+        for step in steps:
+            node = node.children.setdefault(step, _PathNode())
+        node.is_path = True
+
+    if root.count_paths() == 0:
+        return None
+
+    holder: list[JsonValue] = [None]
+    extractor = _Extractor(_Reader(file, chunk_size, decoder), root.num_paths)
+    try:
+        extractor.extract(root, lambda val: holder.__setitem__(0, val))
+    except _Done:
+        pass
+
+    return holder[0]
+
+
+def _match_end(pattern: re.Pattern[bytes], buf: bytes, pos: int) -> int:
+    """Return the end of a match of a pattern which matches empty strings."""
+    m = pattern.match(buf, pos)
+    assert m is not None
+    return m.end()
+
+
+class _Done(Exception):
+    """Raised to stop reading once all paths are resolved."""
+
+
+class _PathNode:
+    __slots__ = ("children", "is_path", "num_paths")
+
+    def __init__(self) -> None:
+        self.children: dict[Union[str, int], _PathNode] = {}
+        self.is_path = False
+        self.num_paths = 0
+
+    def count_paths(self) -> int:
+        self.num_paths = int(self.is_path)
+        for child in self.children.values():
+            self.num_paths += child.count_paths()
+        return self.num_paths
+
+    def get_indices(self) -> Optional[dict[int, "_PathNode"]]:
+        """Return the children which can index an array.
+
+        :returns: the children by index, or None if any of the steps can't
+            index an array, in which case the array is decoded in full.
+        """
+        indices = {}
+        for step, child in self.children.items():
+            if isinstance(step, str):
+                if jsonpath.jsonpath_ng is not None:
+                    return None
+                # The dot path fallback allows indexing lists with any
+                # integer, including negative ones
+                try:
+                    step = int(step)
+                except ValueError:
+                    return None
+                if step < 0:
+                    return None
+            indices[step] = child
+
+        return indices
+
+
+class _Reader:
+    """A buffered view of a byte stream which keeps only unread data."""
+
+    def __init__(self, file: IO[bytes], chunk_size: int, decoder: Decoder):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = decoder
+        self.buf = b""
+        self.pos = 0
+        self._capture: Optional[bytearray] = None
+        self._capture_pos = 0
+        self._started = False
+
+    def fill(self) -> bool:
+        """Read the next chunk from the stream.
+
+        :returns: False if the end of the stream was reached
+        """
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            return False
+
+        if not self._started:
+            self._started = True
+            if chunk.startswith(_BOM):
+                chunk = chunk[len(_BOM) :]
+
+        if self._capture is not None:
+            self._capture += self.buf[self._capture_pos : self.pos]
+            self._capture_pos = 0
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+
+        return True
+
+    def peek(self) -> int:
+        """Skip whitespace and return the next byte without consuming it."""
+        while True:
+            self.pos = _match_end(_WHITESPACE, self.buf, self.pos)
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise json.JSONDecodeError(
+                    "Expecting value",
+                    self.buf.decode(errors="replace"),
+                    self.pos,
+                )
+
+    def expect(self, char: int) -> None:
+        if self.peek() != char:
+            raise self.error(f"Expecting {repr(chr(char))}")
+        self.pos += 1
+
+    def start_capture(self) -> None:
+        self._capture = bytearray()
+        self._capture_pos = self.pos
+
+    def end_capture(self) -> bytes:
+        assert self._capture is not None
+        self._capture += self.buf[self._capture_pos : self.pos]
+        data = bytes(self._capture)
+        self._capture = None
+
+        return data
+
+    def skip_value(self) -> None:
+        char = self.peek()
+        if char == _QUOTE:
+            self.skip_string()
+        elif char in (_OBJECT_START, _ARRAY_START):
+            self._skip_container()
+        else:
+            self._skip_scalar()
+
+    def read_value(self) -> JsonValue:
+        self.peek()
+        self.start_capture()
+        self.skip_value()
+
+        return self.decode(self.end_capture())
+
+    def skip_string(self) -> None:
+        self.pos += 1
+        while True:
+            m = _STRING_SPECIAL.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+            elif self.buf[m.start()] == _QUOTE:
+                self.pos = m.end()
+                return
+            elif m.end() < len(self.buf):
+                # Skip the escaped character
+                self.pos = m.end() + 1
+                continue
+            else:
+                self.pos = m.start()
+
+            if not self.fill():
+                raise self.error("Unterminated string")
+
+    def _skip_container(self) -> None:
+        depth = 0
+        while True:
+            m = _STRUCTURAL.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                if not self.fill():
+                    raise self.error("Unterminated container")
+                continue
+
+            char = self.buf[m.start()]
+            if char == _QUOTE:
+                self.pos = m.start()
+                self.skip_string()
+                continue
+
+            self.pos = m.end()
+            if char in (_OBJECT_START, _ARRAY_START):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _skip_scalar(self) -> None:
+        while True:
+            self.pos = _match_end(_SCALAR, self.buf, self.pos)
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def decode(self, data: bytes) -> JsonValue:
+        try:
+            return self.decoder(data)
+        except Exception as e:
+            raise self.error(getattr(e, "msg", str(e))) from e
+
+    def error(self, msg: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(
+            msg,
+            self.buf.decode(errors="replace"),
+            self.pos,
+        )
+
+
+class _Extractor:
+    def __init__(self, reader: _Reader, num_paths: int):
+        self.reader = reader
+        self.remaining = num_paths
+        # A later duplicate key can replace any value inside an open object
+        self.open_objects = 0
+
+    def extract(
+        self,
+        node: _PathNode,
+        assign: Callable[[JsonValue], None],
+    ) -> None:
+        """Read the next value from the stream, keeping only the parts that
+        lie on a path below `node`.
+
+        Containers are assigned before their contents are read, so that any
+        partially read values are kept if reading stops early.
+        """
+        char = self.reader.peek()
+        if not node.is_path:
+            if char == _OBJECT_START and all(
+                # ruff hint
+                isinstance(step, str)
+                for step in node.children
+            ):
+                obj: dict[str, JsonValue] = {}
+                assign(obj)
+                self._extract_object(node, obj)
+                return
+
+            if char == _ARRAY_START:
+                indices = node.get_indices()
+                if indices is not None:
+                    arr: list[JsonValue] = []
+                    assign(arr)
+                    self._extract_array(indices, arr)
+                    return
+
+        # Either the value was requested, or it can't be descended into.
+        # Either way it needs to be decoded in full.
+        assign(self.reader.read_value())
+        self._resolve(node.num_paths)
+
+    def _extract_object(
+        self,
+        node: _PathNode,
+        obj: dict[str, JsonValue],
+    ) -> None:
+        reader = self.reader
+        pending = dict(node.children)
+
+        reader.expect(_OBJECT_START)
+        self.open_objects += 1
+        if reader.peek() == _OBJECT_END:
+            reader.pos += 1
+        else:
+            while True:
+                if reader.peek() != _QUOTE:
+                    raise reader.error("Expecting property name enclosed in double quotes")
+                reader.start_capture()
+                reader.skip_string()
+                key = reader.decode(reader.end_capture())
+                assert isinstance(key, str)
+                reader.expect(_COLON)
+
+                child = node.children.get(key)
+                if child is None:
+                    reader.skip_value()
+                elif pending.pop(key, None) is not None:
+                    self.extract(child, functools.partial(obj.__setitem__, key))
+                else:
+                    # The paths below a duplicate key were already counted
+                    remaining = self.remaining
+                    self.extract(child, functools.partial(obj.__setitem__, key))
+                    self.remaining = remaining
+
+                char = reader.peek()
+                reader.pos += 1
+                if char == _OBJECT_END:
+                    break
+                if char != _COMMA:
+                    raise reader.error("Expecting ',' delimiter")
+
+        # Any fields that weren't found are now known to be missing
+        self.open_objects -= 1
+        self._resolve(sum(child.num_paths for child in pending.values()))
+
+    def _extract_array(
+        self,
+        indices: dict[int, _PathNode],
+        arr: list[JsonValue],
+    ) -> None:
+        reader = self.reader
+        # Elements after the last requested index don't need to be kept
+        size = max(indices, default=-1) + 1
+
+        reader.expect(_ARRAY_START)
+        if reader.peek() == _ARRAY_END:
+            reader.pos += 1
+        else:
+            i = 0
+            while True:
+                child = indices.pop(i, None)
+                if child is not None:
+                    arr.append(None)
+                    self.extract(child, functools.partial(arr.__setitem__, i))
+                else:
+                    if i < size:
+                        # Placeholder to keep the indices of later elements
+                        arr.append(None)
+                    reader.skip_value()
+
+                i += 1
+                char = reader.peek()
+                reader.pos += 1
+                if char == _ARRAY_END:
+                    break
+                if char != _COMMA:
+                    raise reader.error("Expecting ',' delimiter")
+
+        # Any indices that weren't found are now known to be out of range
+        self._resolve(sum(child.num_paths for child in indices.values()))
+
+    def _resolve(self, num_paths: int) -> None:
+        self.remaining -= num_paths
+        if self.remaining <= 0 and self.open_objects == 0:
+            raise _Done()
@@ -4,7 +4,7 @@ from typing import IO, Any
 
 from mandible.metadata_mapper.key import Key
 
-from .format import FileFormat
+from .format import FORMAT_REGISTRY, FileFormat
 
 
 @dataclass
@@ -13,6 +13,11 @@ class _PlaceholderBase(FileFormat[None], register=False):
     require extra dependencies to be installed.
     """
 
+    def __init_subclass__(cls, register: bool = True, **kwargs: Any) -> None:
+        # Never replace a real implementation which was already imported
+        register = register and cls.__name__ not in FORMAT_REGISTRY
+        super().__init_subclass__(register=register, **kwargs)
+
     def __init__(self, dep: str):
         raise Exception(
             f"{dep} must be installed to use the {self.__class__.__name__} format class",
@@ -39,3 +44,9 @@ class H5(_PlaceholderBase):
 class Xml(_PlaceholderBase):
     def __init__(self) -> None:
         super().__init__("lxml")
+
+
+@dataclass
+class ZstdFile(_PlaceholderBase):
+    def __init__(self, format: Any = None) -> None:
+        super().__init__("zstandard")
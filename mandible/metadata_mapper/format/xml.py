@@ -1,17 +1,76 @@
 import contextlib
+import functools
 from collections.abc import Generator, Iterable
 from dataclasses import dataclass
-from typing import IO, Any, Union
+from typing import IO, Any, Optional, Union, cast
 
 from lxml import etree
 
 from mandible.metadata_mapper.key import Key
 
+from . import xml_stream
 from .format import FileFormat
 
+# Maximum number of compiled XPath expressions to keep in the cache
+XPATH_CACHE_SIZE = 1024
+
+Namespaces = frozenset[tuple[Optional[str], str]]
+
 
 @dataclass
 class Xml(FileFormat[etree._ElementTree]):
+    """A Format for querying Xml files with XPath.
+
+    :param streaming: Evaluate keys while the file is being parsed, keeping
+        only the currently open elements in memory, and stop reading once the
+        value of every key is known. Only paths made up of child steps, such
+        as `/root/list/v[2]`, `./foo:bar` or `./foo/@id`, can be streamed. If
+        any key uses other syntax, the whole file is parsed as usual. Keys
+        which don't set `return_list` or `return_first` can only be resolved
+        early if their path includes positions.
+    """
+
+    streaming: bool = False
+
+    def get_values(
+        self,
+        file: IO[bytes],
+        keys: Iterable[Key],
+    ) -> dict[Key, Any]:
+        """Get a list of values from a file"""
+
+        keys = list(keys)
+        paths = xml_stream.parse_paths(keys) if self.streaming else None
+        if paths is None:
+            return super().get_values(file, keys)
+
+        results = xml_stream.get_values(file, paths, xml_stream.get_limits(keys))
+
+        def eval_key(data: etree._ElementTree, key: Key) -> Any:
+            values = results[key.key]
+            if isinstance(values, Exception):
+                raise values
+
+            return key.resolve_list_match(values)
+
+        # The values were found while streaming, so there is no tree to
+        # evaluate keys against
+        tree = cast(etree._ElementTree, None)
+
+        return {
+            # ruff hint
+            key: self._eval_key_wrapper(tree, key, eval_key)
+            for key in keys
+        }
+
+    def get_value(self, file: IO[bytes], key: Key) -> Any:
+        """Convenience function for getting a single value"""
+
+        if not self.streaming:
+            return super().get_value(file, key)
+
+        return self.get_values(file, [key])[key]
+
     @staticmethod
     @contextlib.contextmanager
     def parse_data(file: IO[bytes]) -> Generator[etree._ElementTree]:
@@ -19,20 +78,59 @@ class Xml(FileFormat[etree._ElementTree]):
 
     @staticmethod
     def eval_key(data: etree._ElementTree, key: Key) -> Any:
-        nsmap = data.getroot().nsmap
-        xpath_result = data.xpath(
-            key.key,
-            # Lxml type stubs don't handle None key for default namespaces
-            namespaces=nsmap,  # type: ignore
-        )
-        if isinstance(xpath_result, Iterable):
-            values = [convert_result(item) for item in xpath_result]
+        return _eval_xpath(data, _get_namespaces(data), key)
 
-            return key.resolve_list_match(values)
+    def eval_keys(
+        self,
+        data: etree._ElementTree,
+        keys: Iterable[Key],
+    ) -> dict[Key, Any]:
+        # The namespaces are the same for every key
+        namespaces = _get_namespaces(data)
+
+        def eval_key(data: etree._ElementTree, key: Key) -> Any:
+            return _eval_xpath(data, namespaces, key)
+
+        return {
+            # ruff hint
+            key: self._eval_key_wrapper(data, key, eval_key)
+            for key in keys
+        }
+
+
+@functools.lru_cache(maxsize=XPATH_CACHE_SIZE)
+def compile_xpath(path: str, namespaces: Namespaces) -> etree.XPath:
+    """Compile an XPath expression so it can be evaluated many times.
+
+    Compiled expressions are kept in a bounded LRU cache. As namespace
+    prefixes are resolved when the expression is compiled, the same path is
+    cached separately for each set of namespaces it is used with.
+    """
+    return etree.XPath(
+        path,
+        # Lxml type stubs don't handle None key for default namespaces
+        namespaces=dict(namespaces),  # type: ignore
+    )
+
+
+def _get_namespaces(data: etree._ElementTree) -> Namespaces:
+    return frozenset(data.getroot().nsmap.items())
+
+
+def _eval_xpath(
+    data: etree._ElementTree,
+    namespaces: Namespaces,
+    key: Key,
+) -> Any:
+    xpath_result = compile_xpath(key.key, namespaces)(data)
+    if isinstance(xpath_result, Iterable):
+        values = [convert_result(item) for item in xpath_result]
+
+        return key.resolve_list_match(values)
 
-        # Xpath supports functions such as `count` that can result in
-        # `data.xpath` returning something other than a list of matches.
-        return xpath_result
+    # Xpath supports functions such as `count` that can result in
+    # `data.xpath` returning something other than a list of matches.
+    return xpath_result
 
 
 def convert_result(
@@ -0,0 +1,341 @@
+"""Incremental evaluation of simple XPath expressions over an XML stream.
+
+Only location paths made up of child steps are supported, for example
+`/root/list/v[2]`, `./foo:nested/*/qux` or `./foo/@id`. These can be
+evaluated with `etree.iterparse` while only keeping the currently open
+elements in memory, and reading can stop as soon as the result of every
+expression is known.
+"""
+
+import re
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import IO, Optional, Union
+
+from lxml import etree
+
+from mandible.metadata_mapper.key import Key
+
+_NCNAME = r"[A-Za-z_][\w.\-]*"
+_STEP_PATTERN = re.compile(
+    rf"(?:(?:(?P<prefix>{_NCNAME}):)?(?P<name>{_NCNAME})|(?P<any>\*))"
+    r"(?:\[(?P<position>[1-9][0-9]*)\])?",
+)
+_ATTRIBUTE_PATTERN = re.compile(rf"@(?:(?P<prefix>{_NCNAME}):)?(?P<name>{_NCNAME})")
+
+Values = list[Optional[str]]
+
+
+@dataclass(frozen=True)
+class Step:
+    prefix: Optional[str]
+    # None matches any element
+    name: Optional[str]
+    position: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class StreamPath:
+    """A location path which can be evaluated incrementally."""
+
+    steps: tuple[Step, ...]
+    attribute: Optional[tuple[Optional[str], str]] = None
+
+
+def parse_path(path: str) -> Optional[StreamPath]:
+    """Parse an XPath expression made up of only child steps.
+
+    :returns: the parsed path, or None if it uses any other syntax
+    """
+    if path.startswith("/"):
+        steps: list[Step] = []
+        parts = path[1:].split("/")
+    else:
+        # Relative paths are evaluated from the root element
+        steps = [Step(prefix=None, name=None)]
+        if path == ".":
+            parts = []
+        else:
+            parts = (path[2:] if path.startswith("./") else path).split("/")
+
+    attribute = None
+    if parts and (m := _ATTRIBUTE_PATTERN.fullmatch(parts[-1])):
+        attribute = (m.group("prefix"), m.group("name"))
+        parts = parts[:-1]
+
+    for part in parts:
+        m = _STEP_PATTERN.fullmatch(part)
+        if m is None:
+            return None
+
+        position = m.group("position")
+        steps.append(
+            Step(
+                prefix=m.group("prefix"),
+                name=m.group("name"),
+                position=int(position) if position else None,
+            ),
+        )
+
+    if not steps:
+        return None
+
+    return StreamPath(steps=tuple(steps), attribute=attribute)
+
+
+def parse_paths(keys: Iterable[Key]) -> Optional[dict[str, StreamPath]]:
+    """Parse the paths of all keys.
+
+    :returns: the parsed paths, or None if any of them can't be streamed
+    """
+    paths = {}
+    for key in keys:
+        path = parse_path(key.key)
+        if path is None:
+            return None
+        paths[key.key] = path
+
+    return paths
+
+
+def get_values(
+    file: IO[bytes],
+    paths: dict[str, StreamPath],
+    limits: dict[str, Optional[int]],
+) -> dict[str, Union[Values, Exception]]:
+    """Evaluate many paths in a single pass over an XML stream.
+
+    :param paths: The parsed paths to evaluate
+    :param limits: Number of matches after which the result of each path is
+        known, or None if all matches are needed
+    :returns: a mapping of path to the text or attribute value of every
+        match, or the exception raised when evaluating the path
+    """
+    evaluator = _Evaluator(paths, limits)
+    evaluator.run(file)
+
+    return evaluator.results
+
+
+def get_limits(keys: Iterable[Key]) -> dict[str, Optional[int]]:
+    """Return the number of matches needed to resolve the keys for each path.
+
+    None means that every match is needed.
+    """
+    limits: dict[str, Optional[int]] = {}
+    for key in keys:
+        limit = _get_limit(key)
+        if key.key in limits:
+            other_limit = limits[key.key]
+            if limit is None or other_limit is None:
+                limit = None
+            else:
+                limit = max(limit, other_limit)
+        limits[key.key] = limit
+
+    return limits
+
+
+def _get_limit(key: Key) -> Optional[int]:
+    if key.return_list:
+        return None
+    if key.return_first:
+        return 1
+
+    # Finding a second match is enough to know that the key is an error
+    return 2
+
+
+@dataclass
+class _Frame:
+    # Paths which could still match a descendant of the element
+    extend: list[int] = field(default_factory=list)
+    # Paths which match the element itself
+    matches: list[int] = field(default_factory=list)
+    child_counts: dict[str, int] = field(default_factory=dict)
+    num_children: int = 0
+
+
+@dataclass
+class _ResolvedStep:
+    tag: Optional[str]
+    position: Optional[int]
+
+
+class _Evaluator:
+    def __init__(
+        self,
+        paths: dict[str, StreamPath],
+        limits: dict[str, Optional[int]],
+    ):
+        self.names = list(paths)
+        self.paths = [paths[name] for name in self.names]
+        self.limits = [limits[name] for name in self.names]
+        self.values: list[Values] = [[] for _ in self.names]
+        self.errors: dict[int, Exception] = {}
+        # Number of open nodes that may still produce a match, starting with
+        # the document node
+        self.open = [1] * len(self.names)
+        self.done = [False] * len(self.names)
+        self.remaining = len(self.names)
+        self.steps: list[list[_ResolvedStep]] = []
+        self.attributes: list[Optional[str]] = []
+
+    @property
+    def results(self) -> dict[str, Union[Values, Exception]]:
+        return {
+            # ruff hint
+            name: self.errors.get(i, self.values[i])
+            for i, name in enumerate(self.names)
+        }
+
+    def run(self, file: IO[bytes]) -> None:
+        if not self.names:
+            return
+
+        # A frame for the document node, which has the root element as its
+        # only child.
+        stack: list[Optional[_Frame]] = [_Frame(extend=list(range(len(self.names))))]
+
+        for event, elem in etree.iterparse(file, events=("start", "end")):
+            if event == "start":
+                if len(stack) == 1:
+                    self._resolve_paths(elem.nsmap)
+                stack.append(self._start(elem, stack[-1], len(stack) - 1))
+            else:
+                frame = stack.pop()
+                if frame is not None:
+                    self._end(elem, frame)
+
+                # Free everything that has been read so far
+                elem.clear(keep_tail=True)
+                parent = elem.getparent()
+                if parent is not None:
+                    while elem.getprevious() is not None:
+                        del parent[0]
+
+            if self.remaining == 0:
+                return
+
+    def _resolve_paths(self, nsmap: dict[Optional[str], str]) -> None:
+        """Resolve namespace prefixes using the namespaces of the root
+        element, in the same way as a full parse.
+        """
+        for i, path in enumerate(self.paths):
+            steps: list[_ResolvedStep] = []
+            attribute = None
+            try:
+                if None in nsmap:
+                    raise TypeError("empty namespace prefix is not supported in XPath")
+                steps = [
+                    _ResolvedStep(
+                        tag=_resolve_name(step.prefix, step.name, nsmap),
+                        position=step.position,
+                    )
+                    for step in path.steps
+                ]
+                if path.attribute:
+                    attribute = _resolve_name(*path.attribute, nsmap)
+            except Exception as e:
+                self.errors[i] = e
+                self._finish(i)
+
+            self.steps.append(steps)
+            self.attributes.append(attribute)
+
+    def _start(
+        self,
+        elem: etree._Element,
+        parent: Optional[_Frame],
+        depth: int,
+    ) -> Optional[_Frame]:
+        if parent is None or not parent.extend:
+            return None
+
+        tag = elem.tag
+        parent.num_children += 1
+        count = parent.child_counts[tag] = parent.child_counts.get(tag, 0) + 1
+
+        frame = None
+        exhausted = []
+        for i in parent.extend:
+            if self.done[i]:
+                continue
+
+            step = self.steps[i][depth]
+            if step.tag is not None and step.tag != tag:
+                continue
+            if step.position is not None:
+                position = count if step.tag is not None else parent.num_children
+                if position != step.position:
+                    continue
+                # No later sibling can match the same position
+                exhausted.append(i)
+
+            if frame is None:
+                frame = _Frame()
+
+            if depth < len(self.steps[i]) - 1:
+                frame.extend.append(i)
+                self.open[i] += 1
+            elif (attribute := self.attributes[i]) is not None:
+                value = elem.get(attribute)
+                if value is not None:
+                    self._add_value(i, value)
+            else:
+                frame.matches.append(i)
+                self.open[i] += 1
+
+        if exhausted:
+            parent.extend = [i for i in parent.extend if i not in exhausted]
+            for i in exhausted:
+                self._close(i)
+
+        if depth == 0:
+            # The document node has no other children
+            for i in parent.extend:
+                self._close(i)
+            parent.extend = []
+
+        return frame
+
+    def _end(self, elem: etree._Element, frame: _Frame) -> None:
+        for i in frame.matches:
+            self._add_value(i, elem.text)
+            self._close(i)
+        for i in frame.extend:
+            self._close(i)
+
+    def _add_value(self, i: int, value: Optional[str]) -> None:
+        if self.done[i]:
+            return
+
+        self.values[i].append(value)
+        limit = self.limits[i]
+        if limit is not None and len(self.values[i]) >= limit:
+            self._finish(i)
+
+    def _close(self, i: int) -> None:
+        self.open[i] -= 1
+        if self.open[i] <= 0:
+            self._finish(i)
+
+    def _finish(self, i: int) -> None:
+        if not self.done[i]:
+            self.done[i] = True
+            self.remaining -= 1
+
+
+def _resolve_name(
+    prefix: Optional[str],
+    name: Optional[str],
+    nsmap: dict[Optional[str], str],
+) -> Optional[str]:
+    if name is None:
+        return None
+    if prefix is None:
+        return name
+    if prefix not in nsmap:
+        raise etree.XPathEvalError("Undefined namespace prefix")
+
+    return f"{{{nsmap[prefix]}}}{name}"
@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from typing import IO
+
+import zstandard
+
+from .format import CompressedFile
+
+
+@dataclass
+class ZstdFile(CompressedFile):
+    """A Zstandard compressed file
+
+    Files made up of multiple frames are read as one stream.
+
+    :param format: The `Format` of the compressed file
+    """
+
+    def open_decompressed(self, file: IO[bytes]) -> IO[bytes]:
+        return zstandard.ZstdDecompressor().stream_reader(
+            file,
+            read_across_frames=True,
+            closefd=False,
+        )
@@ -1,39 +1,181 @@
-import inspect
+import asyncio
+import contextlib
+import dataclasses
+import itertools
 import logging
-from collections.abc import Generator
-from typing import Any, Optional
+import os
+import threading
+import weakref
+from collections.abc import Generator, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Optional, TypeVar, Union
 
 from .context import Context, replace_context_values
-from .directive import DIRECTIVE_REGISTRY, TemplateDirective
+from .directive import DIRECTIVE_REGISTRY
 from .exception import ContextValueError, MetadataMapperError, TemplateError
+from .plan import (
+    ConstantNode,
+    DictNode,
+    DirectiveNode,
+    DirectiveSpec,
+    ListNode,
+    PlanNode,
+    PreparedDirective,
+    TemplatePlan,
+    get_directive_spec,
+)
 from .source import Source
 from .source_provider import SourceProvider
 from .types import Template
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 class MetadataMapper:
+    """Extract metadata from sources into a template.
+
+    :param template: the metadata template containing directives
+    :param source_provider: provider for the sources used by the template
+    :param directive_marker: marker used to identify directives
+    :param max_workers: when set, sources are queried concurrently using a
+        thread pool with this many workers
+    :param storage_concurrency: limit the number of sources of a given storage
+        type (e.g. `{"S3File": 4}`) that may be queried at the same time
+    """
+
     def __init__(
         self,
         template: Template,
         source_provider: Optional[SourceProvider] = None,
         *,
         directive_marker: str = "@",
+        max_workers: Optional[int] = None,
+        storage_concurrency: Optional[dict[str, int]] = None,
     ):
         self.template = template
         self.source_provider = source_provider
         self.directive_marker = directive_marker
+        self.max_workers = max_workers
+        self.storage_concurrency = storage_concurrency or {}
+
+        self._plan: Optional[TemplatePlan] = None
+        self._storage_semaphores = {
+            # ruff hint
+            name: threading.BoundedSemaphore(limit)
+            for name, limit in self.storage_concurrency.items()
+        }
+        # Asyncio primitives are bound to a single event loop
+        self._async_storage_semaphores: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop,
+            dict[str, asyncio.Semaphore],
+        ] = weakref.WeakKeyDictionary()
 
     def get_metadata(self, context: Context) -> Template:
-        if self.source_provider is not None:
-            sources = self.source_provider.get_sources()
-        else:
-            sources = {}
+        return self._get_metadata(context, self._get_base_sources())
 
-        for name, source in sources.items():
+    async def get_metadata_async(self, context: Context) -> Template:
+        """Async version of `get_metadata`.
+
+        Sources are queried concurrently on the running event loop, but the
+        I/O is still blocking. Files are opened and parsed in the event loop's
+        default executor, so its number of worker threads limits how many
+        sources are read at once. Only storages that implement
+        `AsyncStorage` are opened on the event loop itself.
+        """
+        sources = self._get_sources(context, self._get_base_sources())
+        plan = self._prepare_plan(context, sources)
+        self._prepare_sources(context, sources)
+        await self._query_sources_async(context, sources)
+
+        return self._evaluate_plan(plan, context, sources)
+
+    def get_metadata_many(
+        self,
+        contexts: Iterable[Context],
+        max_workers: Optional[int] = None,
+    ) -> Generator[tuple[Context, Union[Template, Exception]]]:
+        """Get the metadata for many contexts.
+
+        The template is compiled and the sources are created only once for the
+        whole batch. Each context is processed in a thread pool, so storage
+        I/O for one context overlaps with parsing for another, and results are
+        yielded as soon as they are finished.
+
+        Errors for a single context are yielded in place of the result rather
+        than raised, so that one failing context does not stop the batch.
+
+        :param contexts: the contexts to get metadata for
+        :param max_workers: the number of contexts to process at once
+        :returns: Generator - (context, result or error) pairs in completion
+            order
+        """
+        # Errors that would affect every context are raised immediately
+        self.compile()
+        base_sources = self._get_base_sources()
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        contexts_iter = iter(contexts)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending: dict[Future[Template], Context] = {}
+            try:
+                while True:
+                    # Only pull contexts from the iterable as workers become
+                    # available, in case it is very large or lazily generated.
+                    for context in itertools.islice(
+                        contexts_iter,
+                        max_workers * 2 - len(pending),
+                    ):
+                        future = executor.submit(
+                            self._get_metadata,
+                            context,
+                            base_sources,
+                        )
+                        pending[future] = context
+
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        context = pending.pop(future)
+                        try:
+                            result: Union[Template, Exception] = future.result()
+                        except Exception as e:
+                            result = e
+                        yield context, result
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _get_metadata(
+        self,
+        context: Context,
+        base_sources: dict[str, Source],
+    ) -> Template:
+        sources = self._get_sources(context, base_sources)
+        plan = self._prepare_plan(context, sources)
+        self._prepare_sources(context, sources)
+        self._query_sources(context, sources)
+
+        return self._evaluate_plan(plan, context, sources)
+
+    def _get_base_sources(self) -> dict[str, Source]:
+        if self.source_provider is None:
+            return {}
+
+        return self.source_provider.get_sources()
+
+    def _get_sources(
+        self,
+        context: Context,
+        base_sources: dict[str, Source],
+    ) -> dict[str, Source]:
+        sources = {}
+        for name, base_source in base_sources.items():
             try:
-                sources[name] = replace_context_values(source, context)
+                source = replace_context_values(base_source, context)
             except ContextValueError as e:
                 e.source_name = name
                 raise
@@ -42,8 +184,23 @@ class MetadataMapper:
                     f"failed to inject context values into source {repr(name)}: {e}",
                 ) from e
 
+            # Sources hold per context state so the same instance must never be
+            # reused, even if it didn't contain any context values.
+            if source is base_source:
+                source = dataclasses.replace(source)
+
+            sources[name] = source
+
+        return sources
+
+    def _prepare_plan(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> TemplatePlan:
         try:
-            self._prepare_directives(context, sources)
+            plan = self.compile()
+            plan.prepare(context, sources)
         except TemplateError:
             raise
         except Exception as e:
@@ -51,17 +208,29 @@ class MetadataMapper:
                 f"failed to cache source keys: {e}",
             ) from e
 
+        return plan
+
+    def _prepare_sources(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> None:
         for name, source in sources.items():
-            log.info("Querying source %r: %s", name, source)
             try:
-                source.query_all_values(context)
+                source.prepare(context)
             except Exception as e:
                 raise MetadataMapperError(
-                    f"failed to query source {repr(name)}: {e}",
+                    f"failed to prepare source {repr(name)}: {e}",
                 ) from e
 
+    def _evaluate_plan(
+        self,
+        plan: TemplatePlan,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> Template:
         try:
-            return self._replace_template(context, self.template, sources)
+            return plan.evaluate(context, sources)
         except TemplateError:
             raise
         except Exception as e:
@@ -69,86 +238,210 @@ class MetadataMapper:
                 f"failed to evaluate template: {e}",
             ) from e
 
-    def _prepare_directives(
+    def _query_sources(
         self,
         context: Context,
         sources: dict[str, Source],
     ) -> None:
-        for value, debug_path in _walk_values(self.template):
-            if isinstance(value, dict):
-                directive_config = self._get_directive_name(value, debug_path)
-                if directive_config is None:
-                    continue
-
-                directive_name, directive_body = directive_config
-                directive = self._get_directive(
-                    directive_name,
-                    context,
-                    sources,
-                    directive_body,
-                    f"{debug_path}.{directive_name}",
-                )
-                directive.prepare()
+        if self.max_workers is None:
+            for name, source in sources.items():
+                self._query_source(context, name, source)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                # ruff hint
+                executor.submit(self._query_source, context, name, source)
+                for name, source in sources.items()
+            ]
+            try:
+                # Errors are raised in source order, the same as when querying
+                # serially.
+                for future in futures:
+                    future.result()
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
 
-    def _replace_template(
+    def _query_source(
+        self,
+        context: Context,
+        name: str,
+        source: Source,
+    ) -> None:
+        semaphore = _get_storage_semaphore(self._storage_semaphores, source)
+
+        with semaphore or contextlib.nullcontext():
+            log.info("Querying source %r: %s", name, source)
+            try:
+                source.query_all_values(context)
+            except Exception as e:
+                raise MetadataMapperError(
+                    f"failed to query source {repr(name)}: {e}",
+                ) from e
+
+    async def _query_sources_async(
         self,
         context: Context,
-        template: Template,
         sources: dict[str, Source],
-        debug_path: str = "$",
-    ) -> Template:
+    ) -> None:
+        tasks = [
+            # ruff hint
+            asyncio.ensure_future(self._query_source_async(context, name, source))
+            for name, source in sources.items()
+        ]
+        try:
+            # Errors are raised in source order, the same as when querying
+            # serially.
+            for task in tasks:
+                await task
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _query_source_async(
+        self,
+        context: Context,
+        name: str,
+        source: Source,
+    ) -> None:
+        semaphore = _get_storage_semaphore(
+            self._get_async_storage_semaphores(),
+            source,
+        )
+
+        async with semaphore or contextlib.nullcontext():
+            log.info("Querying source %r: %s", name, source)
+            try:
+                await source.query_all_values_async(context)
+            except Exception as e:
+                raise MetadataMapperError(
+                    f"failed to query source {repr(name)}: {e}",
+                ) from e
+
+    def _get_async_storage_semaphores(self) -> dict[str, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        semaphores = self._async_storage_semaphores.get(loop)
+        if semaphores is None:
+            semaphores = {
+                # ruff hint
+                name: asyncio.Semaphore(limit)
+                for name, limit in self.storage_concurrency.items()
+            }
+            self._async_storage_semaphores[loop] = semaphores
+
+        return semaphores
+
+    def compile(self) -> TemplatePlan:
+        """Compile the template into a reusable execution plan.
+
+        Directive classes and their argument specs are resolved once, and any
+        subtrees of the template that contain no directives are flagged as
+        static. The plan is cached on the mapper and reused by `get_metadata`.
+
+        :returns: TemplatePlan - the compiled plan
+        :raises: TemplateError
+        """
+        if self._plan is None:
+            directives: list[PreparedDirective] = []
+            root = self._compile_node(self.template, "$", directives)
+            self._plan = TemplatePlan(
+                root=root,
+                directives=tuple(directives),
+            )
+
+        return self._plan
+
+    def _compile_node(
+        self,
+        template: Template,
+        debug_path: str,
+        directives: list[PreparedDirective],
+    ) -> PlanNode:
         if isinstance(template, dict):
             directive_config = self._get_directive_name(
                 template,
                 debug_path,
             )
             if directive_config is not None:
-                directive_name, directive_body = directive_config
-                debug_path = f"{debug_path}.{directive_name}"
-                directive = self._get_directive(
-                    directive_name,
-                    context,
-                    sources,
-                    {
-                        k: self._replace_template(
-                            context,
-                            v,
-                            sources,
-                            debug_path=f"{debug_path}.{k}",
-                        )
-                        for k, v in directive_body.items()
-                    },
+                return self._compile_directive(
+                    template,
+                    directive_config,
                     debug_path,
+                    directives,
                 )
-                try:
-                    return directive.call()
-                except Exception as e:
-                    raise MetadataMapperError(
-                        f"failed to call directive at {debug_path}: {e}",
-                    ) from e
-
-            return {
-                k: self._replace_template(
-                    context,
-                    v,
-                    sources,
-                    debug_path=f"{debug_path}.{k}",
-                )
+
+            items = tuple(
+                # ruff hint
+                (k, self._compile_node(v, f"{debug_path}.{k}", directives))
                 for k, v in template.items()
-            }
+            )
+            if all(isinstance(node, ConstantNode) for _, node in items):
+                return ConstantNode(template)
+
+            return DictNode(items)
 
         if isinstance(template, list):
-            return [
-                self._replace_template(
-                    context,
-                    v,
-                    sources,
-                    debug_path=f"{debug_path}[{i}]",
-                )
+            nodes = tuple(
+                # ruff hint
+                self._compile_node(v, f"{debug_path}[{i}]", directives)
                 for i, v in enumerate(template)
-            ]
+            )
+            if all(isinstance(node, ConstantNode) for node in nodes):
+                return ConstantNode(template)
+
+            return ListNode(nodes)
+
+        if isinstance(template, (tuple, set)):
+            # Directives nested inside of tuples and sets are prepared, but
+            # the values themselves are passed through unchanged.
+            for i, v in enumerate(template):
+                self._compile_node(v, f"{debug_path}[{i}]", directives)
 
-        return template
+        return ConstantNode(template)
+
+    def _compile_directive(
+        self,
+        template: dict[str, Template],
+        directive_config: tuple[str, dict[str, Template]],
+        debug_path: str,
+        directives: list[PreparedDirective],
+    ) -> DirectiveNode:
+        directive_name, directive_body = directive_config
+        directive_path = f"{debug_path}.{directive_name}"
+        spec = self._get_directive_spec(
+            directive_name,
+            directive_body,
+            directive_path,
+        )
+        directives.append(
+            PreparedDirective(
+                spec=spec,
+                config=directive_body,
+                debug_path=directive_path,
+            ),
+        )
+
+        body = tuple(
+            # ruff hint
+            (k, self._compile_node(v, f"{directive_path}.{k}", directives))
+            for k, v in directive_body.items()
+        )
+
+        # Any other keys next to the directive are not part of the output, but
+        # may still contain directives that need to be prepared.
+        for k, v in template.items():
+            if k != directive_name:
+                self._compile_node(v, f"{debug_path}.{k}", directives)
+
+        return DirectiveNode(
+            spec=spec,
+            body=body,
+            debug_path=directive_path,
+        )
 
     def _get_directive_name(
         self,
@@ -181,14 +474,12 @@ class MetadataMapper:
 
         return directive_name, directive_config
 
-    def _get_directive(
+    def _get_directive_spec(
         self,
         directive_name: str,
-        context: Context,
-        sources: dict[str, Source],
         config: dict[str, Template],
         debug_path: str,
-    ) -> TemplateDirective:
+    ) -> DirectiveSpec:
         cls = DIRECTIVE_REGISTRY.get(directive_name[len(self.directive_marker) :])
         if cls is None:
             raise TemplateError(
@@ -196,14 +487,8 @@ class MetadataMapper:
                 debug_path,
             )
 
-        argspec = inspect.getfullargspec(cls.__init__)
-
-        # Ignore the `self`, `context`, and `sources` parameters
-        required_keys = set(
-            argspec.args[3 : -len(argspec.defaults)] if argspec.defaults else argspec.args[3:],
-        )
-        config_keys = set(config.keys())
-        diff = required_keys - config_keys
+        spec = get_directive_spec(cls)
+        diff = spec.required_keys - set(config.keys())
 
         if diff:
             s = ""
@@ -214,26 +499,12 @@ class MetadataMapper:
                 debug_path,
             )
 
-        # For forward compatibility, ignore any unexpected keys
-        all_keys = set(argspec.args[2:])
-        kwargs = {
-            # ruff hint
-            k: v
-            for k, v in config.items()
-            if k in all_keys
-        }
+        return spec
 
-        try:
-            return cls(context, sources, **kwargs)
-        except Exception as e:
-            raise TemplateError(str(e), debug_path) from e
 
+def _get_storage_semaphore(semaphores: dict[str, T], source: Source) -> Optional[T]:
+    storage = getattr(source, "storage", None)
+    if storage is None:
+        return None
 
-def _walk_values(obj: Any, debug_path: str = "$") -> Generator[tuple[Any, str]]:
-    yield obj, debug_path
-    if isinstance(obj, dict):
-        for key, val in obj.items():
-            yield from _walk_values(val, f"{debug_path}.{key}")
-    elif isinstance(obj, (list, tuple, set)):
-        for i, val in enumerate(obj):
-            yield from _walk_values(val, f"{debug_path}[{i}]")
+    return semaphores.get(type(storage).__name__)
@@ -0,0 +1,19 @@
+import re
+from typing import Optional
+
+# Regex syntax characters which are allowed in a literal pattern when escaped
+_ESCAPED_PUNCTUATION = re.compile(r"\\([^\w\s])")
+_REGEX_SPECIAL_CHARS = frozenset(".^$*+?{}[]\\|()")
+
+
+def literal_value(pattern: re.Pattern) -> Optional[str]:
+    """Return the string matched by a pattern with no special regex syntax."""
+    if not isinstance(pattern.pattern, str) or pattern.flags != re.UNICODE:
+        return None
+
+    literal = _ESCAPED_PUNCTUATION.sub(r"\1", pattern.pattern)
+    unescaped = _ESCAPED_PUNCTUATION.sub("", pattern.pattern)
+    if any(c in _REGEX_SPECIAL_CHARS for c in unescaped):
+        return None
+
+    return literal
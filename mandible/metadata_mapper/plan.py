@@ -0,0 +1,207 @@
+import functools
+import inspect
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from dataclasses import dataclass
+
+from .context import Context
+from .directive import TemplateDirective
+from .exception import MetadataMapperError, TemplateError
+from .source import Source
+from .types import Template
+
+
+@dataclass(frozen=True)
+class DirectiveSpec:
+    """The constructor arguments accepted by a directive class."""
+
+    cls: type[TemplateDirective]
+    required_keys: frozenset[str]
+    all_keys: frozenset[str]
+
+
+@functools.cache
+def get_directive_spec(cls: type[TemplateDirective]) -> DirectiveSpec:
+    argspec = inspect.getfullargspec(cls.__init__)
+
+    # Ignore the `self`, `context`, and `sources` parameters
+    required_keys = frozenset(
+        argspec.args[3 : -len(argspec.defaults)] if argspec.defaults else argspec.args[3:],
+    )
+
+    return DirectiveSpec(
+        cls=cls,
+        required_keys=required_keys,
+        all_keys=frozenset(argspec.args[2:]),
+    )
+
+
+def instantiate_directive(
+    spec: DirectiveSpec,
+    context: Context,
+    sources: dict[str, Source],
+    config: Mapping[str, Template],
+    debug_path: str,
+) -> TemplateDirective:
+    # For forward compatibility, ignore any unexpected keys
+    kwargs = {
+        # ruff hint
+        k: v
+        for k, v in config.items()
+        if k in spec.all_keys
+    }
+
+    try:
+        return spec.cls(context, sources, **kwargs)
+    except Exception as e:
+        raise TemplateError(str(e), debug_path) from e
+
+
+def copy_template(template: Template) -> Template:
+    """Copy the dicts and lists of a template, like evaluating it would."""
+
+    if isinstance(template, dict):
+        return {
+            # ruff hint
+            k: copy_template(v)
+            for k, v in template.items()
+        }
+    if isinstance(template, list):
+        return [copy_template(v) for v in template]
+
+    return template
+
+
+class PlanNode(ABC):
+    @abstractmethod
+    def evaluate(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> Template:
+        pass
+
+
+@dataclass(frozen=True)
+class ConstantNode(PlanNode):
+    """A subtree of the template which contains no directives.
+
+    Dicts and lists are copied on every evaluation so that results never
+    share mutable objects with the template.
+    """
+
+    value: Template
+
+    def evaluate(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> Template:
+        return copy_template(self.value)
+
+
+@dataclass(frozen=True)
+class DictNode(PlanNode):
+    items: tuple[tuple[str, PlanNode], ...]
+
+    def evaluate(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> Template:
+        return {
+            # ruff hint
+            k: node.evaluate(context, sources)
+            for k, node in self.items
+        }
+
+
+@dataclass(frozen=True)
+class ListNode(PlanNode):
+    items: tuple[PlanNode, ...]
+
+    def evaluate(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> Template:
+        return [node.evaluate(context, sources) for node in self.items]
+
+
+@dataclass(frozen=True)
+class DirectiveNode(PlanNode):
+    spec: DirectiveSpec
+    body: tuple[tuple[str, PlanNode], ...]
+    debug_path: str
+
+    def evaluate(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> Template:
+        directive = instantiate_directive(
+            self.spec,
+            context,
+            sources,
+            {
+                # ruff hint
+                k: node.evaluate(context, sources)
+                for k, node in self.body
+            },
+            self.debug_path,
+        )
+        try:
+            return directive.call()
+        except Exception as e:
+            raise MetadataMapperError(
+                f"failed to call directive at {self.debug_path}: {e}",
+            ) from e
+
+
+@dataclass(frozen=True)
+class PreparedDirective:
+    """A directive which needs to be prepared before the sources are queried.
+
+    The config is the raw directive body from the template.
+    """
+
+    spec: DirectiveSpec
+    config: Mapping[str, Template]
+    debug_path: str
+
+    def prepare(self, context: Context, sources: dict[str, Source]) -> None:
+        directive = instantiate_directive(
+            self.spec,
+            context,
+            sources,
+            self.config,
+            self.debug_path,
+        )
+        directive.prepare()
+
+
+@dataclass(frozen=True)
+class TemplatePlan:
+    """A compiled, reusable execution plan for a metadata template.
+
+    Created by `MetadataMapper.compile`. The plan holds no per context state
+    so it can be executed any number of times.
+    """
+
+    root: PlanNode
+    directives: tuple[PreparedDirective, ...]
+
+    @property
+    def is_static(self) -> bool:
+        return isinstance(self.root, ConstantNode)
+
+    def prepare(self, context: Context, sources: dict[str, Source]) -> None:
+        for directive in self.directives:
+            directive.prepare(context, sources)
+
+    def evaluate(
+        self,
+        context: Context,
+        sources: dict[str, Source],
+    ) -> Template:
+        return self.root.evaluate(context, sources)
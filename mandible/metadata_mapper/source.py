@@ -1,12 +1,14 @@
+import asyncio
+import dataclasses
 import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any
+from typing import IO, Any
 
 from .context import Context
-from .format import Format
+from .format import Format, ZipIndex, ZipMember
 from .key import Key
-from .storage import Storage
+from .storage import AsyncStorage, RangeFile, Storage
 
 log = logging.getLogger(__name__)
 
@@ -31,19 +33,42 @@ class Source(ABC):
     def add_key(self, key: Key) -> None:
         self._keys.add(key)
 
+    def prepare(self, context: Context) -> None:
+        """Called for every source before any of them are queried."""
+        pass
+
     @abstractmethod
     def query_all_values(self, context: Context) -> None:
         pass
 
+    async def query_all_values_async(self, context: Context) -> None:
+        """Async version of `query_all_values`.
+
+        By default, `query_all_values` is called from a worker thread.
+        """
+        await asyncio.to_thread(self.query_all_values, context)
+
     def get_value(self, key: Key) -> Any:
         return self._values[key]
 
+    def _update_values(self, keys: list[Key], new_values: dict[Key, Any]) -> None:
+        log.debug(
+            "%s: using keys %r, got new values %r",
+            self,
+            keys,
+            new_values,
+        )
+        self._values.update(new_values)
+
 
 @dataclass
 class FileSource(Source):
     storage: Storage
     format: Format
 
+    def prepare(self, context: Context) -> None:
+        self.storage.prepare(context)
+
     def query_all_values(self, context: Context) -> None:
         if not self._keys:
             return
@@ -51,10 +76,117 @@ class FileSource(Source):
         with self.storage.open_file(context) as file:
             keys = list(self._keys)
             new_values = self.format.get_values(file, keys)
-            log.debug(
-                "%s: using keys %r, got new values %r",
-                self,
+            self._update_values(keys, new_values)
+            _log_stats(self, file)
+
+    async def query_all_values_async(self, context: Context) -> None:
+        if not self._keys:
+            return
+
+        file = await _open_file_async(self.storage, context)
+        with file:
+            keys = list(self._keys)
+            # Parsing is CPU bound so it is kept off of the event loop
+            new_values = await asyncio.to_thread(
+                self.format.get_values,
+                file,
                 keys,
-                new_values,
             )
-            self._values.update(new_values)
+            self._update_values(keys, new_values)
+            _log_stats(self, file)
+
+
+@dataclass
+class ZipSource(Source):
+    """A source which reads many members of the same zip archive.
+
+    The archive is opened once for all members, and members are found using
+    an index of the archive's central directory instead of each member
+    reopening and scanning the archive.
+
+    Keys are the name of one of the `members` followed by `:` and the key to
+    get from that member, for example `manifest:./metadataSection`.
+
+    :param storage: The storage of the zip archive
+    :param members: The archive members to read values from, by name
+    :param prefetch: Read the central directory and each member with as few
+        reads as possible, see `ZipMember`
+    """
+
+    storage: Storage
+    members: dict[str, ZipMember]
+    prefetch: bool = False
+
+    def add_key(self, key: Key) -> None:
+        self._split_key(key)
+        super().add_key(key)
+
+    def prepare(self, context: Context) -> None:
+        self.storage.prepare(context)
+
+    def query_all_values(self, context: Context) -> None:
+        if not self._keys:
+            return
+
+        with self.storage.open_file(context) as file:
+            self._query_archive(file)
+            _log_stats(self, file)
+
+    async def query_all_values_async(self, context: Context) -> None:
+        if not self._keys:
+            return
+
+        file = await _open_file_async(self.storage, context)
+        with file:
+            # Parsing is CPU bound so it is kept off of the event loop
+            await asyncio.to_thread(self._query_archive, file)
+            _log_stats(self, file)
+
+    def _query_archive(self, file: IO[bytes]) -> None:
+        member_keys: dict[str, dict[Key, Key]] = {}
+        for key in self._keys:
+            name, member_key = self._split_key(key)
+            member_keys.setdefault(name, {})[key] = member_key
+
+        with ZipIndex.open_archive(file, prefetch=self.prefetch) as index:
+            for name, keys in member_keys.items():
+                member_values = self.members[name].get_archive_values(
+                    index,
+                    list(keys.values()),
+                )
+                self._update_values(
+                    list(keys),
+                    {
+                        # ruff hint
+                        key: member_values[member_key]
+                        for key, member_key in keys.items()
+                    },
+                )
+
+    def _split_key(self, key: Key) -> tuple[str, Key]:
+        name, sep, member_key = key.key.partition(":")
+        if not sep or name not in self.members:
+            raise ValueError(
+                f"key {repr(key.key)} must start with the name of a member followed by ':', "
+                f"one of {sorted(self.members)}",
+            )
+
+        return name, dataclasses.replace(key, key=member_key)
+
+
+async def _open_file_async(storage: Storage, context: Context) -> IO[bytes]:
+    if isinstance(storage, AsyncStorage):
+        return await storage.open_file_async(context)
+
+    return await asyncio.to_thread(storage.open_file, context)
+
+
+def _log_stats(source: Source, file: IO[bytes]) -> None:
+    # Only files which make a request for every range keep track of them
+    if isinstance(file, RangeFile):
+        log.debug(
+            "%s: read %d bytes in %d requests",
+            source,
+            file.stats.bytes_read,
+            file.stats.requests,
+        )
@@ -1,4 +1,6 @@
+import inspect
 import logging
+import typing
 from abc import ABC, abstractmethod
 from typing import Any, Optional, TypeVar
 
@@ -76,10 +78,17 @@ class ConfigSourceProvider(SourceProvider):
                 f"missing key 'class' in config {config}",
             )
 
-        # TODO(reweeden): As of python3.10, inspect.get_annotations(parent_cls)
-        # should be used instead here.
-        base_cls = parent_cls.__annotations__[key]
+        base_cls = _get_annotation(parent_cls, key)
 
+        return self._create_object_of_type(base_cls, key, cls_name, config)
+
+    def _create_object_of_type(
+        self,
+        base_cls: type[Any],
+        key: str,
+        cls_name: str,
+        config: dict,
+    ) -> Any:
         cls = self._get_class_from_registry(base_cls, cls_name)
         if cls is None:
             raise SourceProviderError(f"invalid {key} type {repr(cls_name)}")
@@ -124,6 +133,14 @@ class ConfigSourceProvider(SourceProvider):
             if "class" in arg:
                 return self._create_object(parent_cls, key, arg)
 
+            value_cls = _get_mapping_value_type(parent_cls, key)
+            if value_cls is not None:
+                return {
+                    # ruff hint
+                    k: self._convert_mapping_value(parent_cls, value_cls, k, v)
+                    for k, v in arg.items()
+                }
+
             return {
                 # ruff hint
                 k: self._convert_arg(parent_cls, k, v)
@@ -140,3 +157,47 @@ class ConfigSourceProvider(SourceProvider):
             return ContextValue(arg)
 
         return arg
+
+    def _convert_mapping_value(
+        self,
+        parent_cls: type[Any],
+        value_cls: type[Any],
+        key: str,
+        arg: Any,
+    ) -> Any:
+        if isinstance(arg, dict) and "class" in arg:
+            return self._create_object_of_type(value_cls, key, arg["class"], arg)
+
+        return self._convert_arg(parent_cls, key, arg)
+
+
+def _get_mapping_value_type(parent_cls: type[Any], key: str) -> Optional[type[Any]]:
+    """Return the value type of a field annotated as `dict[str, SomeClass]`."""
+
+    try:
+        annotation = _get_annotation(parent_cls, key)
+    except KeyError:
+        return None
+
+    if typing.get_origin(annotation) is not dict:
+        return None
+
+    args = typing.get_args(annotation)
+    if len(args) != 2 or not isinstance(args[1], type):
+        return None
+
+    return args[1]
+
+
+def _get_annotation(cls: type[Any], key: str) -> Any:
+    """Return the annotation of a field, which may be declared on a base
+    class.
+
+    :raises: KeyError if no class in the MRO annotates the field
+    """
+    for base_cls in cls.__mro__:
+        annotations = inspect.get_annotations(base_cls)
+        if key in annotations:
+            return annotations[key]
+
+    raise KeyError(key)
@@ -1,5 +1,7 @@
+from .block_cache import BlockCacheFile, CountingFile, RangeFile, ReadStats
 from .storage import (
     STORAGE_REGISTRY,
+    AsyncStorage,
     Dummy,
     FilteredStorage,
     LocalFile,
@@ -24,11 +26,16 @@ except ImportError:
 
 
 __all__ = (
+    "AsyncStorage",
+    "BlockCacheFile",
     "CmrQuery",
+    "CountingFile",
     "Dummy",
     "FilteredStorage",
     "HttpRequest",
     "LocalFile",
+    "RangeFile",
+    "ReadStats",
     "S3File",
     "STORAGE_REGISTRY",
     "Storage",
@@ -0,0 +1,214 @@
+import io
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import IO, Optional
+
+
+@dataclass
+class ReadStats:
+    """Counts of the reads made from an underlying (usually remote) file."""
+
+    requests: int = 0
+    bytes_read: int = 0
+
+    def add(self, num_bytes: int) -> None:
+        self.requests += 1
+        self.bytes_read += num_bytes
+
+
+class RangeFile(io.RawIOBase, ABC):
+    """A read only, seekable file which fetches the bytes of every read as a
+    single range.
+
+    :param size: The size of the file in bytes
+    :param stats: Updated by subclasses with every range they fetch
+    """
+
+    def __init__(self, size: int, stats: Optional[ReadStats] = None):
+        self._size = size
+        self._pos = 0
+        self.stats = stats if stats is not None else ReadStats()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+
+        if pos < 0:
+            raise ValueError(f"negative seek position {pos}")
+
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer: "bytearray | memoryview") -> int:  # type: ignore[override]
+        start = self._pos
+        end = min(start + len(buffer), self._size)
+        if end <= start:
+            return 0
+
+        data = self._read_range(start, end)
+        memoryview(buffer).cast("B")[: len(data)] = data
+        self._pos = start + len(data)
+
+        return len(data)
+
+    def readall(self) -> bytes:
+        # The default implementation reads in small pieces, each of which
+        # would be a separate range
+        chunks = []
+        while self._pos < self._size:
+            data = self._read_range(self._pos, self._size)
+            if not data:
+                break
+            chunks.append(data)
+            self._pos += len(data)
+
+        return b"".join(chunks)
+
+    @abstractmethod
+    def _read_range(self, start: int, end: int) -> bytes:
+        """Return the bytes from `start` up to, but not including, `end`."""
+        pass
+
+
+class CountingFile(RangeFile):
+    """A read only file which makes exactly one read of another file for
+    every read, counting them.
+
+    :param file: The file to read from, which must be seekable
+    :param stats: Updated with every read made from the underlying file
+    """
+
+    def __init__(self, file: IO[bytes], stats: Optional[ReadStats] = None):
+        super().__init__(file.seek(0, io.SEEK_END), stats)
+        self._file = file
+
+    @property
+    def raw(self) -> IO[bytes]:
+        """The underlying file."""
+        return self._file
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        self._file.seek(start)
+        data = self._file.read(end - start)
+        self.stats.add(len(data))
+
+        return data
+
+
+class BlockCacheFile(CountingFile):
+    """A read only file which reads another file in fixed size blocks.
+
+    Recently used blocks are kept in memory so that formats which make many
+    small, scattered reads, like HDF5 reading its metadata, only fetch each
+    block once. Runs of missing blocks are fetched with a single read, and
+    optionally a number of blocks after a miss are read ahead of time.
+
+    :param file: The file to read from, which must be seekable
+    :param block_size: Number of bytes in each block
+    :param max_blocks: Maximum number of blocks to keep in memory
+    :param readahead_blocks: Number of extra blocks to read after a miss
+    :param stats: Updated with every read made from the underlying file
+    """
+
+    def __init__(
+        self,
+        file: IO[bytes],
+        block_size: int,
+        max_blocks: int,
+        readahead_blocks: int = 0,
+        stats: Optional[ReadStats] = None,
+    ):
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        if max_blocks <= 0:
+            raise ValueError("max_blocks must be positive")
+
+        super().__init__(file, stats)
+        self._block_size = block_size
+        self._max_blocks = max_blocks
+        self._readahead_blocks = readahead_blocks
+        self._blocks: OrderedDict[int, bytes] = OrderedDict()
+
+    def close(self) -> None:
+        self._blocks.clear()
+        super().close()
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        first = start // self._block_size
+        last = (end - 1) // self._block_size
+
+        if last - first + 1 > self._max_blocks:
+            # Too large to cache without evicting the blocks being read
+            return self._fetch(start, end)
+
+        self._load_blocks(first, last)
+        data = b"".join(self._get_block(i) for i in range(first, last + 1))
+        offset = start - first * self._block_size
+
+        return data[offset : offset + end - start]
+
+    def _get_block(self, index: int) -> bytes:
+        self._blocks.move_to_end(index)
+        return self._blocks[index]
+
+    def _load_blocks(self, first: int, last: int) -> None:
+        missing = [i for i in range(first, last + 1) if i not in self._blocks]
+        if not missing:
+            return
+
+        # Group missing blocks into contiguous runs
+        runs: list[list[int]] = [[missing[0], missing[0]]]
+        for i in missing[1:]:
+            if i == runs[-1][1] + 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+
+        num_blocks = (self._size + self._block_size - 1) // self._block_size
+        readahead_end = min(
+            runs[-1][1] + self._readahead_blocks,
+            num_blocks - 1,
+            # Don't read ahead so far that the requested blocks are evicted
+            first + self._max_blocks - 1,
+        )
+        while runs[-1][1] < readahead_end and runs[-1][1] + 1 not in self._blocks:
+            runs[-1][1] += 1
+
+        for run_first, run_last in runs:
+            data = self._fetch(
+                run_first * self._block_size,
+                min((run_last + 1) * self._block_size, self._size),
+            )
+            for i in range(run_first, run_last + 1):
+                offset = (i - run_first) * self._block_size
+                self._blocks[i] = data[offset : offset + self._block_size]
+
+        # Make sure none of the requested blocks are evicted
+        for i in range(first, last + 1):
+            self._blocks.move_to_end(i)
+        while len(self._blocks) > self._max_blocks:
+            self._blocks.popitem(last=False)
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        return super()._read_range(start, end)
@@ -0,0 +1,188 @@
+import re
+from collections.abc import Hashable, Iterable, Mapping
+from collections.abc import Set as AbstractSet
+from typing import Any, Optional
+
+from mandible.metadata_mapper.context import Context
+from mandible.metadata_mapper.pattern import literal_value
+
+# Attribute used to cache the index on the Context object
+_CONTEXT_ATTR = "_mandible_file_index"
+_BACKREFERENCE = re.compile(r"\\\d|\(\?P=")
+_EMPTY: frozenset[int] = frozenset()
+
+
+class FileIndex:
+    """An index of the files in a context used to match storage filters.
+
+    The index is built once per context and shared between all storages so
+    that many storages can find their files without each one scanning the
+    whole file list:
+
+    - Filters which are literal values (including regexes with no special
+      characters) are answered from a hash of the file values for that key.
+    - Regex filters are matched for every registered pattern in a single
+      pass over the files, using one combined pattern to skip files that
+      can't match any of them.
+
+    The index is rebuilt if files are added, removed or replaced in the
+    context. Changes made to a file entry in place after the first lookup
+    aren't seen by the index, so entries should be replaced instead.
+    """
+
+    def __init__(self, files: list[dict[str, Any]]):
+        self.files = files
+        self._num_files = len(files)
+        # Entries are compared by identity first, so checking that the files
+        # haven't changed is cheap
+        self._snapshot = list(files)
+        self._exact: dict[str, dict[Hashable, set[int]]] = {}
+        self._registered_patterns: dict[str, set[re.Pattern]] = {}
+        self._pattern_matches: dict[tuple[str, re.Pattern], set[int]] = {}
+
+    @classmethod
+    def for_context(cls, context: Context) -> "FileIndex":
+        index = getattr(context, _CONTEXT_ATTR, None)
+        if index is None or not index._is_valid_for(context.files):
+            index = cls(context.files)
+            setattr(context, _CONTEXT_ATTR, index)
+
+        return index
+
+    def add_filters(self, filters: Mapping[str, Any]) -> None:
+        """Register filters that will be looked up later.
+
+        Registering the filters of every storage up front means the regex
+        filters for a key can all be matched in the same pass over the files.
+        """
+        for key, pattern in filters.items():
+            if isinstance(pattern, re.Pattern) and literal_value(pattern) is None:
+                if (key, pattern) not in self._pattern_matches:
+                    self._registered_patterns.setdefault(key, set()).add(pattern)
+
+    def find(self, filters: Mapping[str, Any]) -> Optional[dict[str, Any]]:
+        """Return the first file which matches all filters."""
+        if not filters:
+            return self.files[0] if self.files else None
+
+        candidates: list[AbstractSet[int]] = []
+        for key, pattern in filters.items():
+            positions = self._get_positions(key, pattern)
+            if positions is None:
+                # Filter can't be indexed
+                continue
+            if not positions:
+                return None
+            candidates.append(positions)
+
+        if not candidates:
+            positions_iter: Iterable[int] = range(self._num_files)
+            others = []
+        else:
+            candidates.sort(key=len)
+            positions_iter = sorted(candidates[0])
+            others = candidates[1:]
+
+        for i in positions_iter:
+            if all(i in positions for positions in others):
+                info = self.files[i]
+                # Guard against file entries that were modified after the
+                # index was built.
+                if matches_filters(info, filters):
+                    return info
+
+        return None
+
+    def _is_valid_for(self, files: list[dict[str, Any]]) -> bool:
+        return files is self.files and files == self._snapshot
+
+    def _get_positions(self, key: str, pattern: Any) -> Optional[AbstractSet[int]]:
+        if isinstance(pattern, re.Pattern):
+            literal = literal_value(pattern)
+            if literal is None:
+                return self._get_pattern_positions(key, pattern)
+            pattern = literal
+
+        if not isinstance(pattern, Hashable):
+            return None
+
+        return self._get_exact_positions(key, pattern)
+
+    def _get_exact_positions(self, key: str, value: Hashable) -> AbstractSet[int]:
+        values = self._exact.get(key)
+        if values is None:
+            values = {}
+            for i, info in enumerate(self.files):
+                if key not in info or not isinstance(info[key], Hashable):
+                    continue
+                values.setdefault(info[key], set()).add(i)
+            self._exact[key] = values
+
+        return values.get(value, _EMPTY)
+
+    def _get_pattern_positions(self, key: str, pattern: re.Pattern) -> set[int]:
+        positions = self._pattern_matches.get((key, pattern))
+        if positions is not None:
+            return positions
+
+        patterns = self._registered_patterns.pop(key, set())
+        patterns.add(pattern)
+        self._match_patterns(key, list(patterns))
+
+        return self._pattern_matches[(key, pattern)]
+
+    def _match_patterns(self, key: str, patterns: list[re.Pattern]) -> None:
+        matches: dict[re.Pattern, set[int]] = {pattern: set() for pattern in patterns}
+        combined = _combine_patterns(patterns)
+
+        for i, info in enumerate(self.files):
+            if key not in info:
+                continue
+
+            value = info[key]
+            if not isinstance(value, (str, bytes)):
+                continue
+            if combined is not None and isinstance(value, str) and not combined.fullmatch(value):
+                continue
+
+            for pattern in patterns:
+                if isinstance(value, type(pattern.pattern)) and pattern.fullmatch(value):
+                    matches[pattern].add(i)
+
+        for pattern, positions in matches.items():
+            self._pattern_matches[(key, pattern)] = positions
+
+
+def matches_filters(info: dict[str, Any], filters: Mapping[str, Any]) -> bool:
+    for key, pattern in filters.items():
+        if key not in info:
+            return False
+
+        value = info[key]
+        if isinstance(pattern, re.Pattern):
+            if not pattern.fullmatch(value):
+                return False
+        elif value != pattern:
+            return False
+
+    return True
+
+
+def _combine_patterns(patterns: list[re.Pattern]) -> Optional[re.Pattern]:
+    """Combine patterns into one pattern which matches if any of them do."""
+    if len(patterns) < 2:
+        return None
+
+    for pattern in patterns:
+        if not isinstance(pattern.pattern, str) or pattern.flags != re.UNICODE:
+            return None
+        # Group numbers change when patterns are combined
+        if _BACKREFERENCE.search(pattern.pattern):
+            return None
+
+    try:
+        return re.compile("|".join(f"(?:{p.pattern})" for p in patterns))
+    except re.error:
+        # Patterns may not be combinable, for instance if they use the same
+        # group names.
+        return None
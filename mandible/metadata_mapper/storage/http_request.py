@@ -1,17 +1,24 @@
 import io
 from dataclasses import dataclass
-from typing import IO, Any, Optional, Union
+from typing import IO, Any, Optional, Union, cast
 
 import requests
 
 from mandible.metadata_mapper.context import Context
 
-from .storage import Storage
+from .block_cache import RangeFile, ReadStats
+from .storage import Storage, StorageError
 
 
 @dataclass
 class HttpRequest(Storage):
-    """A storage which returns the body of an HTTP response"""
+    """A storage which returns the body of an HTTP response
+
+    :param range_reads: Instead of downloading the whole response, make an
+        HTTP range request for every read. The server must support range
+        requests and report the Content-Length of the resource. Only
+        supported for GET requests.
+    """
 
     # TODO(reweeden): python3.10 added support for KW_ONLY arguments which can
     # be used to clean up the inheritance here a bit.
@@ -24,6 +31,7 @@ class HttpRequest(Storage):
     cookies: Optional[dict] = None
     timeout: Optional[Union[float, tuple[float, float]]] = None
     allow_redirects: bool = True
+    range_reads: bool = False
 
     def open_file(self, context: Context) -> IO[bytes]:
         kwargs = {
@@ -40,6 +48,11 @@ class HttpRequest(Storage):
             # Allow subclasses to override these
             **self._get_override_request_args(context),
         }
+        if self.range_reads:
+            if kwargs["method"].upper() != "GET":
+                raise StorageError("range reads are only supported for GET requests")
+            return cast(IO[bytes], HttpRangeFile(kwargs))
+
         response = requests.request(**kwargs)
 
         # TODO(reweeden): Using response.content causes the entire response
@@ -52,3 +65,51 @@ class HttpRequest(Storage):
 
     def _get_override_request_args(self, context: Context) -> dict:
         return {}
+
+
+class HttpRangeFile(RangeFile):
+    """A read only file which fetches every read with an HTTP range request.
+
+    :param request_args: Arguments for `requests.request` which get the
+        whole resource
+    :param stats: Updated with every request made
+    """
+
+    def __init__(self, request_args: dict[str, Any], stats: Optional[ReadStats] = None):
+        self._session = requests.Session()
+        self._request_args = {
+            **request_args,
+            # Ranges refer to the bytes of the resource as is, so it must not
+            # be compressed for transfer
+            "headers": {**(request_args.get("headers") or {}), "Accept-Encoding": "identity"},
+            "stream": False,
+        }
+
+        response = self._session.request(**{**self._request_args, "method": "HEAD"})
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        if size is None:
+            self._session.close()
+            raise StorageError(f"no Content-Length for {repr(response.url)}")
+
+        super().__init__(int(size), stats)
+
+    def close(self) -> None:
+        self._session.close()
+        super().close()
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        headers = {
+            **self._request_args["headers"],
+            "Range": f"bytes={start}-{end - 1}",
+        }
+        response = self._session.request(**{**self._request_args, "headers": headers})
+        response.raise_for_status()
+        data = response.content
+        self.stats.add(len(data))
+
+        if response.status_code != 206:
+            # The server ignored the range and sent the whole resource
+            data = data[start:end]
+
+        return data
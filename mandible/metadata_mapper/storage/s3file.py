@@ -1,17 +1,53 @@
 from dataclasses import dataclass, field
-from typing import IO, Any
+from typing import IO, Any, Optional, cast
 
 import s3fs
 
+from .block_cache import BlockCacheFile, CountingFile
 from .storage import FilteredStorage
 
 
 @dataclass
 class S3File(FilteredStorage):
-    """A storage which reads from an AWS S3 object"""
+    """A storage which reads from an AWS S3 object
+
+    :param block_size: Read the object in blocks of this many bytes using
+        ranged requests, keeping recently used blocks in memory. This is
+        useful for formats such as HDF5 which make many small reads from
+        different parts of the file.
+    :param max_blocks: Maximum number of blocks to keep in memory
+    :param readahead_blocks: Number of extra blocks to request whenever a
+        block needs to be fetched
+    :param range_reads: Make exactly one ranged request for every read,
+        without any caching or read ahead. This is useful for formats which
+        know exactly which bytes they need, such as `ZipMember` with
+        `prefetch` enabled. Ignored if `block_size` is set.
+    """
 
     s3fs_kwargs: dict[str, Any] = field(default_factory=dict)
+    block_size: Optional[int] = None
+    max_blocks: int = 32
+    readahead_blocks: int = 0
+    range_reads: bool = False
 
     def _open_file(self, info: dict) -> IO[bytes]:
         s3 = s3fs.S3FileSystem(anon=False, **self.s3fs_kwargs)
-        return s3.open(f"s3://{info['bucket']}/{info['key']}")
+        path = f"s3://{info['bucket']}/{info['key']}"
+        if self.block_size is None:
+            if self.range_reads:
+                return cast(IO[bytes], CountingFile(s3.open(path, cache_type="none")))
+            return s3.open(path)
+
+        # Caching is handled by the block cache so that every request made
+        # to S3 can be counted.
+        file = s3.open(path, block_size=self.block_size, cache_type="none")
+        # Raw files are used directly so that every read reaches the cache
+        return cast(
+            IO[bytes],
+            BlockCacheFile(
+                file,
+                block_size=self.block_size,
+                max_blocks=self.max_blocks,
+                readahead_blocks=self.readahead_blocks,
+            ),
+        )
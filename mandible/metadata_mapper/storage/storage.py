@@ -6,6 +6,8 @@ from typing import IO, Any, Optional, Union
 
 from mandible.metadata_mapper.context import Context
 
+from .file_index import FileIndex, matches_filters
+
 
 class StorageError(Exception):
     pass
@@ -28,6 +30,23 @@ class Storage(ABC):
         """Get a filelike object to access the data."""
         pass
 
+    def prepare(self, context: Context) -> None:
+        """Called for every storage before any of them are opened."""
+        pass
+
+
+class AsyncStorage(ABC):
+    """A storage which can be opened without blocking the event loop.
+
+    Storages which do not implement this interface will be opened in a worker
+    thread when used from async code.
+    """
+
+    @abstractmethod
+    async def open_file_async(self, context: Context) -> IO[bytes]:
+        """Get a filelike object to access the data."""
+        pass
+
 
 # Define storages that don't require extra dependencies
 
@@ -77,6 +96,9 @@ class FilteredStorage(Storage, register=False):
         file = self.get_file_from_context(context)
         return self._open_file(file)
 
+    def prepare(self, context: Context) -> None:
+        FileIndex.for_context(context).add_filters(self._compiled_filters)
+
     def get_file_from_context(self, context: Context) -> dict[str, Any]:
         """Return the file from the context which matches all filters."""
 
@@ -84,25 +106,14 @@ class FilteredStorage(Storage, register=False):
         if not context.files:
             raise StorageError("no files in context")
 
-        for info in context.files:
-            if self._matches_filters(info):
-                return info
+        info = FileIndex.for_context(context).find(self._compiled_filters)
+        if info is not None:
+            return info
 
         raise StorageError(f"no files matched filters {self.filters}")
 
     def _matches_filters(self, info: dict[str, Any]) -> bool:
-        for key, pattern in self._compiled_filters.items():
-            if key not in info:
-                return False
-
-            value = info[key]
-            if isinstance(pattern, re.Pattern):
-                if not pattern.fullmatch(value):
-                    return False
-            elif value != pattern:
-                return False
-
-        return True
+        return matches_filters(info, self._compiled_filters)
 
     @abstractmethod
     def _open_file(self, info: dict) -> IO[bytes]:
@@ -1,4 +1,12 @@
+import asyncio
+import copy
+import io
+import logging
 import re
+import threading
+import zipfile
+from dataclasses import dataclass
+from unittest import mock
 
 import pytest
 
@@ -9,9 +17,18 @@ from mandible.metadata_mapper import (
     MetadataMapper,
     MetadataMapperError,
     PySourceProvider,
+    ZipSource,
 )
-from mandible.metadata_mapper.format import Json, Xml
-from mandible.metadata_mapper.storage import LocalFile
+from mandible.metadata_mapper.format import H5, Json, Xml, ZipMember
+from mandible.metadata_mapper.source import Source
+from mandible.metadata_mapper.storage import Dummy, LocalFile, ReadStats, S3File
+
+try:
+    import h5py
+    import numpy as np
+except ImportError:
+    h5py = None
+    np = None
 
 
 @pytest.fixture
@@ -213,6 +230,188 @@ def test_basic_s3_file(s3_resource, config, context):
     }
 
 
+def logged_read_stats(caplog):
+    """Get the read stats that sources logged for each file they opened."""
+
+    return [
+        ReadStats(requests=int(m.group("requests")), bytes_read=int(m.group("bytes_read")))
+        for record in caplog.records
+        if (m := re.search(r"read (?P<bytes_read>\d+) bytes in (?P<requests>\d+) requests$", record.getMessage()))
+    ]
+
+
+@pytest.mark.h5
+@pytest.mark.s3
+def test_h5_s3_file_block_cache(s3_resource, tmp_path, caplog):
+    caplog.set_level(logging.DEBUG, logger="mandible.metadata_mapper.source")
+
+    path = tmp_path / "granule.h5"
+    with h5py.File(path, "w", fs_strategy="page", fs_page_size=4096) as f:
+        f.attrs["ShortName"] = "TEST"
+        f["lat"] = np.linspace(-10.0, 10.0, 8)
+        f.create_dataset("data", data=np.random.default_rng(0).random((512, 512)), chunks=(64, 64))
+
+    s3_resource.create_bucket(Bucket="test")
+    s3_resource.Object("test", "granule.h5").upload_file(str(path))
+
+    storage = S3File(filters={"name": "granule"}, block_size=4096, readahead_blocks=1)
+    mapper = MetadataMapper(
+        template={
+            "ShortName": {
+                "@mapped": {
+                    "source": "granule",
+                    "key": "/@ShortName",
+                },
+            },
+            "Lat": {
+                "@mapped": {
+                    "source": "granule",
+                    "key": "lat[0]",
+                },
+            },
+        },
+        source_provider=PySourceProvider(
+            {
+                "granule": FileSource(
+                    storage=storage,
+                    format=H5(page_buf_size=64 * 1024, rdcc_nbytes=1024 * 1024),
+                ),
+            },
+        ),
+    )
+    context = Context(files=[{"name": "granule", "bucket": "test", "key": "granule.h5"}])
+
+    assert mapper.get_metadata(context) == {
+        "ShortName": "TEST",
+        "Lat": -10.0,
+    }
+    # Only the metadata is fetched, not the large dataset
+    [stats] = logged_read_stats(caplog)
+    assert 0 < stats.requests <= 5
+    assert 0 < stats.bytes_read < path.stat().st_size // 10
+
+    # The counts are kept separately for every file that is opened
+    results = list(mapper.get_metadata_many([context, context], max_workers=2))
+    assert [result for _, result in results] == [{"ShortName": "TEST", "Lat": -10.0}] * 2
+    assert logged_read_stats(caplog) == [stats] * 3
+
+
+@pytest.mark.h5
+@pytest.mark.s3
+def test_h5_s3_file_index(s3_resource, tmp_path, caplog):
+    caplog.set_level(logging.DEBUG, logger="mandible.metadata_mapper.source")
+    path = tmp_path / "granule.h5"
+    with h5py.File(path, "w") as f:
+        f.attrs["ShortName"] = "TEST"
+        f["data"] = np.zeros((512, 512))
+
+    s3_resource.create_bucket(Bucket="test")
+    s3_resource.Object("test", "granule.h5").upload_file(str(path))
+
+    def get_metadata():
+        storage = S3File(filters={"name": "granule"}, block_size=4096)
+        mapper = MetadataMapper(
+            template={
+                "ShortName": {
+                    "@mapped": {
+                        "source": "granule",
+                        "key": "/@ShortName",
+                    },
+                },
+            },
+            source_provider=PySourceProvider(
+                {
+                    "granule": FileSource(
+                        storage=storage,
+                        format=H5(index_dir=str(tmp_path / "index")),
+                    ),
+                },
+            ),
+        )
+        context = Context(files=[{"name": "granule", "bucket": "test", "key": "granule.h5"}])
+        caplog.clear()
+        metadata = mapper.get_metadata(context)
+        [stats] = logged_read_stats(caplog)
+
+        return metadata, stats
+
+    metadata, stats = get_metadata()
+    assert metadata == {"ShortName": "TEST"}
+    assert stats.requests > 0
+
+    # The second time the value comes from the index without reading the file
+    metadata, stats = get_metadata()
+    assert metadata == {"ShortName": "TEST"}
+    assert stats.requests == 0
+
+    # Replacing the object changes its ETag
+    with h5py.File(path, "a") as f:
+        f.attrs["ShortName"] = "CHANGED"
+    s3_resource.Object("test", "granule.h5").upload_file(str(path))
+
+    metadata, stats = get_metadata()
+    assert metadata == {"ShortName": "CHANGED"}
+    assert stats.requests > 0
+
+
+@pytest.mark.s3
+@pytest.mark.xml
+def test_zip_s3_file_prefetch(s3_resource, caplog):
+    caplog.set_level(logging.DEBUG, logger="mandible.metadata_mapper.source")
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("manifest.safe", "<manifest><name>S1A_TEST</name></manifest>")
+        for i in range(4):
+            zf.writestr(f"measurement/{i}.tiff", bytes(range(256)) * 4096, compress_type=zipfile.ZIP_STORED)
+        for i in range(2000):
+            zf.writestr(f"annotation/{i}.xml", f"<annotation><index>{i}</index></annotation>")
+
+    s3_resource.create_bucket(Bucket="test")
+    s3_resource.Object("test", "granule.zip").put(Body=file.getvalue())
+
+    storage = S3File(filters={"name": "granule"}, range_reads=True)
+    mapper = MetadataMapper(
+        template={
+            "name": {
+                "@mapped": {
+                    "source": "granule",
+                    "key": "manifest:./name",
+                },
+            },
+            "index": {
+                "@mapped": {
+                    "source": "granule",
+                    "key": "annotation:./index",
+                },
+            },
+        },
+        source_provider=PySourceProvider(
+            {
+                "granule": ZipSource(
+                    storage=storage,
+                    members={
+                        "manifest": ZipMember(filters={"filename": "manifest.safe"}, format=Xml()),
+                        "annotation": ZipMember(filters={"filename": "annotation/500.xml"}, format=Xml()),
+                    },
+                    prefetch=True,
+                ),
+            },
+        ),
+    )
+    context = Context(files=[{"name": "granule", "bucket": "test", "key": "granule.zip"}])
+
+    assert mapper.get_metadata(context) == {
+        "name": "S1A_TEST",
+        "index": "500",
+    }
+    # One request for the end of the archive, one for the rest of the central
+    # directory and one for each member
+    [stats] = logged_read_stats(caplog)
+    assert stats.requests == 4
+    assert stats.bytes_read < 150 * 1024
+    assert len(file.getvalue()) > 4 * 1024 * 1024
+
+
 def test_no_matching_files(context):
     mapper = MetadataMapper(
         template={
@@ -427,3 +626,434 @@ def test_context_values_invalid():
         ),
     ):
         mapper.get_metadata(context)
+
+
+def test_compile_reuses_plan(context, fixed_name_file_config):
+    mapper = MetadataMapper(
+        template={
+            "foo": {
+                "@mapped": {
+                    "source": "fixed_name_file",
+                    "key": "foo",
+                },
+            },
+        },
+        source_provider=ConfigSourceProvider(
+            {
+                "fixed_name_file": fixed_name_file_config,
+            },
+        ),
+    )
+
+    plan = mapper.compile()
+
+    assert mapper.compile() is plan
+    assert not plan.is_static
+    assert len(plan.directives) == 1
+    assert mapper.get_metadata(context) == {"foo": "value for foo"}
+    assert mapper.get_metadata(context) == {"foo": "value for foo"}
+    assert mapper.compile() is plan
+
+
+def test_compile_static_subtrees(context, fixed_name_file_config):
+    static = {
+        "list": [1, 2, {"nested": "value"}],
+        "string": "bar",
+    }
+    static_copy = copy.deepcopy(static)
+    mapper = MetadataMapper(
+        template={
+            "static": static,
+            "foo": [
+                "constant",
+                {
+                    "@mapped": {
+                        "source": "fixed_name_file",
+                        "key": "foo",
+                    },
+                },
+            ],
+        },
+        source_provider=ConfigSourceProvider(
+            {
+                "fixed_name_file": fixed_name_file_config,
+            },
+        ),
+    )
+
+    result = mapper.get_metadata(context)
+
+    assert result == {
+        "static": static,
+        "foo": ["constant", "value for foo"],
+    }
+
+    # Modifying a result doesn't affect the template or later results
+    result["static"]["list"].append(4)
+    result["static"]["list"][2]["nested"] = "modified"
+    result["foo"].append("extra")
+    assert mapper.template["static"] == static_copy
+    assert mapper.get_metadata(context) == {
+        "static": static_copy,
+        "foo": ["constant", "value for foo"],
+    }
+
+
+def test_compile_unexpected_error(context, mocker):
+    mapper = MetadataMapper(template={"foo": "bar"})
+    mocker.patch.object(mapper, "_compile_node", side_effect=ValueError("boom"))
+
+    with pytest.raises(MetadataMapperError, match="boom"):
+        mapper.get_metadata(context)
+
+
+def test_compile_static_template():
+    template = {"foo": "bar"}
+    mapper = MetadataMapper(template)
+
+    assert mapper.compile().is_static
+    assert mapper.compile().directives == ()
+
+
+def test_compile_invalid_directive():
+    mapper = MetadataMapper(
+        template={
+            "foo": [
+                {
+                    "@does_not_exist": {},
+                },
+            ],
+        },
+    )
+
+    with pytest.raises(
+        MetadataMapperError,
+        match=(
+            r"failed to process template at \$\.foo\[0\]\.@does_not_exist: "
+            "invalid directive '@does_not_exist'"
+        ),
+    ):
+        mapper.compile()
+
+
+@pytest.mark.xml
+def test_concurrent_sources(config, context):
+    mapper = MetadataMapper(
+        template=config["template"],
+        source_provider=ConfigSourceProvider(config["sources"]),
+        max_workers=4,
+    )
+
+    assert mapper.get_metadata(context) == {
+        "foo": "value for foo",
+        "outer": {
+            "nested": "value for nested",
+            "bar": "value for bar",
+        },
+        "namespace_xml_foobar_1": "testing_1",
+        "namespace_xml_foobar_2": "2",
+        "xml_foobar_1": "testing_1",
+        "xml_foobar_2": "2",
+    }
+
+
+class ConcurrencyTracker:
+    def __init__(self, barrier=None):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.barrier = barrier
+
+    def __enter__(self):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+        # Every source must be running at the same time for the barrier to
+        # release, otherwise the wait times out with a BrokenBarrierError
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+
+    def __exit__(self, *args):
+        with self.lock:
+            self.running -= 1
+
+
+@dataclass
+class TrackedSource(Source, register=False):
+    storage: Dummy
+    tracker: ConcurrencyTracker
+
+    def query_all_values(self, context: Context):
+        with self.tracker:
+            self._values.update({key: key.key for key in self._keys})
+
+
+def tracked_mapper(count, concurrent=False, **kwargs):
+    tracker = ConcurrencyTracker(threading.Barrier(count) if concurrent else None)
+    mapper = MetadataMapper(
+        template={
+            f"source_{i}": {
+                "@mapped": {
+                    "source": f"source_{i}",
+                    "key": "foo",
+                },
+            }
+            for i in range(count)
+        },
+        source_provider=PySourceProvider(
+            {
+                # ruff hint
+                f"source_{i}": TrackedSource(Dummy(""), tracker)
+                for i in range(count)
+            },
+        ),
+        **kwargs,
+    )
+
+    return mapper, tracker
+
+
+def test_concurrent_sources_serial_by_default():
+    mapper, tracker = tracked_mapper(4)
+
+    assert mapper.get_metadata(Context()) == {f"source_{i}": "foo" for i in range(4)}
+    assert tracker.max_running == 1
+
+
+def test_concurrent_sources_max_workers():
+    mapper, tracker = tracked_mapper(4, concurrent=True, max_workers=4)
+
+    assert mapper.get_metadata(Context()) == {f"source_{i}": "foo" for i in range(4)}
+    assert tracker.max_running == 4
+
+
+def test_concurrent_sources_storage_concurrency():
+    mapper, tracker = tracked_mapper(
+        4,
+        max_workers=4,
+        storage_concurrency={"Dummy": 1},
+    )
+
+    assert mapper.get_metadata(Context()) == {f"source_{i}": "foo" for i in range(4)}
+    assert tracker.max_running == 1
+
+
+def test_concurrent_sources_error(context):
+    mapper = MetadataMapper(
+        template={
+            "foo": {
+                "@mapped": {
+                    "source": "source_file",
+                    "key": "foo",
+                },
+            },
+        },
+        source_provider=ConfigSourceProvider(
+            {
+                "source_file": {
+                    "storage": {
+                        "class": "LocalFile",
+                        "filters": {
+                            "name": "does not exist",
+                        },
+                    },
+                    "format": {
+                        "class": "Json",
+                    },
+                },
+            },
+        ),
+        max_workers=2,
+    )
+
+    with pytest.raises(
+        MetadataMapperError,
+        match="failed to query source 'source_file': no files matched filters",
+    ):
+        mapper.get_metadata(context)
+
+
+def test_get_metadata_async(context, fixed_name_file_config):
+    mapper = MetadataMapper(
+        template={
+            "foo": {
+                "@mapped": {
+                    "source": "fixed_name_file",
+                    "key": "foo",
+                },
+            },
+            "bar": {
+                "@mapped": {
+                    "source": "name_match_file",
+                    "key": "bar",
+                },
+            },
+        },
+        source_provider=ConfigSourceProvider(
+            {
+                "fixed_name_file": fixed_name_file_config,
+                "name_match_file": {
+                    "storage": {
+                        "class": "LocalFile",
+                        "filters": {
+                            "name": r".*match_me\.json",
+                        },
+                    },
+                    "format": {
+                        "class": "Json",
+                    },
+                },
+            },
+        ),
+    )
+
+    assert asyncio.run(mapper.get_metadata_async(context)) == {
+        "foo": "value for foo",
+        "bar": "value for bar",
+    }
+
+
+def test_get_metadata_async_concurrent_sources():
+    mapper, tracker = tracked_mapper(4, concurrent=True)
+
+    assert asyncio.run(mapper.get_metadata_async(Context())) == {f"source_{i}": "foo" for i in range(4)}
+    assert tracker.max_running == 4
+
+
+def test_get_metadata_async_storage_concurrency():
+    mapper, tracker = tracked_mapper(4, storage_concurrency={"Dummy": 1})
+
+    # Each call uses a new event loop
+    for _ in range(2):
+        assert asyncio.run(mapper.get_metadata_async(Context())) == {f"source_{i}": "foo" for i in range(4)}
+        assert tracker.max_running == 1
+
+
+def test_get_metadata_async_error(context):
+    mapper = MetadataMapper(
+        template={
+            "foo": {
+                "@mapped": {
+                    "source": "source_file",
+                    "key": "foo",
+                },
+            },
+        },
+        source_provider=ConfigSourceProvider(
+            {
+                "source_file": {
+                    "storage": {
+                        "class": "LocalFile",
+                        "filters": {
+                            "name": "does not exist",
+                        },
+                    },
+                    "format": {
+                        "class": "Json",
+                    },
+                },
+            },
+        ),
+    )
+
+    with pytest.raises(
+        MetadataMapperError,
+        match="failed to query source 'source_file': no files matched filters",
+    ):
+        asyncio.run(mapper.get_metadata_async(context))
+
+
+def test_get_metadata_many(context, fixed_name_file_config):
+    mapper = MetadataMapper(
+        template={
+            "foo": {
+                "@mapped": {
+                    "source": "fixed_name_file",
+                    "key": "foo",
+                },
+            },
+        },
+        source_provider=ConfigSourceProvider(
+            {
+                "fixed_name_file": fixed_name_file_config,
+            },
+        ),
+    )
+    empty_context = Context()
+    contexts = [context, empty_context, context]
+
+    results = list(mapper.get_metadata_many(contexts, max_workers=2))
+
+    assert len(results) == 3
+    successes = [result for ctx, result in results if ctx is context]
+    assert successes == [{"foo": "value for foo"}, {"foo": "value for foo"}]
+
+    errors = [result for ctx, result in results if ctx is empty_context]
+    assert len(errors) == 1
+    assert isinstance(errors[0], MetadataMapperError)
+    assert str(errors[0]) == "failed to query source 'fixed_name_file': no files in context"
+
+
+def test_get_metadata_many_creates_sources_once():
+    mapper, _ = tracked_mapper(2)
+
+    with mock.patch.object(
+        mapper.source_provider,
+        "get_sources",
+        wraps=mapper.source_provider.get_sources,
+    ) as get_sources:
+        results = list(mapper.get_metadata_many(Context() for _ in range(10)))
+
+    assert len(results) == 10
+    for _, result in results:
+        assert result == {"source_0": "foo", "source_1": "foo"}
+    get_sources.assert_called_once()
+
+
+def test_get_metadata_many_completion_order():
+    release = threading.Event()
+
+    @dataclass
+    class BlockingSource(Source, register=False):
+        storage: Dummy
+
+        def query_all_values(self, context: Context):
+            if context.meta["block"]:
+                assert release.wait(timeout=5)
+            self._values.update({key: key.key for key in self._keys})
+
+    mapper = MetadataMapper(
+        template={
+            "foo": {
+                "@mapped": {
+                    "source": "source",
+                    "key": "foo",
+                },
+            },
+        },
+        source_provider=PySourceProvider({"source": BlockingSource(Dummy(""))}),
+    )
+    slow = Context(meta={"block": True})
+    fast = Context(meta={"block": False})
+
+    results = mapper.get_metadata_many([slow, fast], max_workers=2)
+
+    # The slow context can only finish once the fast one has been yielded
+    assert next(results) == (fast, {"foo": "foo"})
+    release.set()
+    assert next(results) == (slow, {"foo": "foo"})
+    assert next(results, None) is None
+
+
+def test_get_metadata_many_template_error():
+    mapper = MetadataMapper(
+        template={
+            "foo": {
+                "@does_not_exist": {},
+            },
+        },
+    )
+
+    with pytest.raises(MetadataMapperError, match="invalid directive"):
+        next(mapper.get_metadata_many([Context()]))
@@ -44,13 +44,14 @@ def test_replace_context_values_noop(context):
     ):
         assert replace_context_values(obj, context) is obj
 
-    # Nested structures will be copied, but should compare equal
+    # Nested structures without any context values are not rebuilt
     for obj in (
         [1, 2, 3],
         {"a": 1, "b": 2, "c": 3},
         Dummy(x=1),
+        Dummy(x=1, list_value=[1, 2], dict_value={"a": [1]}, recursive=Dummy(x=2)),
     ):
-        assert replace_context_values(obj, context) == obj
+        assert replace_context_values(obj, context) is obj
 
 
 def test_replace_context_values_direct(context):
@@ -242,6 +243,50 @@ def test_replace_context_values_nested(context):
     )
 
 
+def test_replace_context_values_partial(context):
+    unchanged_list = [1, 2, 3]
+    unchanged_dummy = Dummy(x=2)
+    obj = Dummy(
+        x=1,
+        list_value=unchanged_list,
+        dict_value={
+            "foo": ContextValue("$.meta.foo"),
+            "bar": unchanged_dummy,
+        },
+    )
+
+    replaced = replace_context_values(obj, context)
+
+    assert replaced == Dummy(
+        x=1,
+        list_value=[1, 2, 3],
+        dict_value={
+            "foo": "foo-value",
+            "bar": Dummy(x=2),
+        },
+    )
+    assert replaced is not obj
+    assert replaced.list_value is unchanged_list
+    assert replaced.dict_value["bar"] is unchanged_dummy
+    # The original object is not modified
+    assert obj.dict_value["foo"] == ContextValue("$.meta.foo")
+
+
+def test_replace_context_values_no_copy(context):
+    # Values are read from the context directly without copying
+    assert replace_context_values(ContextValue("$.meta.a-list"), context) is context.meta["a-list"]
+    assert replace_context_values(ContextValue("$.meta"), context) is context.meta
+
+
+def test_context_value_compiled_path(context):
+    context_value = ContextValue("$.meta.foo")
+
+    compiled_path = context_value._compiled_path
+
+    assert replace_context_values(context_value, context) == "foo-value"
+    assert context_value._compiled_path is compiled_path
+
+
 def test_replace_context_values_error(context):
     with pytest.raises(
         ContextValueError,
@@ -1,7 +1,10 @@
 import bz2
+import gzip
 import io
 import json
+import lzma
 import sys
+import tarfile
 import zipfile
 from unittest import mock
 
@@ -13,27 +16,47 @@ from mandible.metadata_mapper.format import (
     Bzip2File,
     Format,
     FormatError,
+    GzipFile,
     Json,
+    TarMember,
     Xml,
+    XzFile,
+    ZipIndex,
     ZipInfo,
     ZipMember,
+    ZstdFile,
+    bz2_parallel,
+    json_decoder,
 )
+from mandible.metadata_mapper.format.format import spool_file
 from mandible.metadata_mapper.key import Key
+from mandible.metadata_mapper.storage import CountingFile
 
 try:
     import h5py
+    import numpy as np
 except ImportError:
     h5py = None
+    np = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 def test_registry():
     assert FORMAT_REGISTRY == {
         "Bzip2File": Bzip2File,
+        "GzipFile": GzipFile,
         "H5": H5,
         "Json": Json,
+        "TarMember": TarMember,
         "Xml": Xml,
+        "XzFile": XzFile,
         "ZipInfo": ZipInfo,
         "ZipMember": ZipMember,
+        "ZstdFile": ZstdFile,
     }
 
 
@@ -140,6 +163,206 @@ def test_h5_attribute():
         format.get_values(file, [Key("test@test@test")])
 
 
+@pytest.mark.h5
+def test_h5_selection():
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        f["lat"] = [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+        f["lat"].attrs["units"] = "degrees"
+        f["table"] = np.array(
+            [(1, b"foo"), (2, b"bar")],
+            dtype=[("id", "i4"), ("name", "S3")],
+        )
+        f["literal[0]"] = "literal value"
+
+    format = H5()
+
+    assert format.get_values(
+        file,
+        [
+            Key("/lat[0,0]"),
+            Key("/lat[-1]"),
+            Key("/lat[:, ::2]"),
+            Key("/lat[..., 1]"),
+            Key("/lat@units"),
+            Key("/table[id]"),
+            Key("/table[name, 1]"),
+            Key("literal[0]"),
+        ],
+    ) == {
+        Key("/lat[0,0]"): 1.0,
+        Key("/lat[-1]"): [4.0, 5.0, 6.0],
+        Key("/lat[:, ::2]"): [[1.0, 3.0], [4.0, 6.0]],
+        Key("/lat[..., 1]"): [2.0, 5.0],
+        Key("/lat@units"): "degrees",
+        Key("/table[id]"): [1, 2],
+        Key("/table[name, 1]"): "bar",
+        Key("literal[0]"): "literal value",
+    }
+
+
+@pytest.mark.h5
+def test_h5_selection_error():
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        f["lat"] = [1.0, 2.0]
+
+    format = H5()
+
+    with pytest.raises(FormatError, match="'/lat\\[5\\]' Index \\(5\\) out of range"):
+        format.get_value(file, Key("/lat[5]"))
+    with pytest.raises(FormatError, match="key not found '/lon\\[0\\]'"):
+        format.get_value(file, Key("/lon[0]"))
+
+
+@pytest.mark.h5
+def test_h5_numpy_arrays():
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        f["foo"] = "foo value"
+        f["list"] = [1, 2, 3]
+        f["list"].attrs["attr"] = [4, 5]
+
+    format = H5(numpy_arrays=True)
+
+    values = format.get_values(file, [Key("foo"), Key("list"), Key("list@attr")])
+    assert values[Key("foo")] == "foo value"
+    assert isinstance(values[Key("list")], np.ndarray)
+    assert values[Key("list")].tolist() == [1, 2, 3]
+    assert isinstance(values[Key("list@attr")], np.ndarray)
+    assert values[Key("list@attr")].tolist() == [4, 5]
+    assert isinstance(format.get_value(file, Key("list")), np.ndarray)
+
+    # The static eval_key doesn't know about the option
+    with h5py.File(file, "r") as f:
+        assert H5.eval_key(f, Key("list")) == [1, 2, 3]
+
+
+@pytest.mark.h5
+def test_h5_file_options(mocker):
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        f["foo"] = "foo value"
+
+    format = H5(page_buf_size=4096, rdcc_nbytes=1024)
+    h5py_file = mocker.patch("h5py.File", wraps=h5py.File)
+
+    assert format.get_value(file, Key("foo")) == "foo value"
+    assert h5py_file.call_args_list[0].kwargs == {"page_buf_size": 4096, "rdcc_nbytes": 1024}
+    assert h5py_file.call_args.kwargs["rdcc_nbytes"] == 1024
+
+    # The static parse_data doesn't know about the options
+    h5py_file.reset_mock()
+    with H5.parse_data(file) as data:
+        assert data["foo"][()] == b"foo value"
+    h5py_file.assert_called_once_with(file, "r")
+
+
+@pytest.mark.h5
+def test_h5_reduction():
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        lat = np.array([[10.0, 20.0], [-9999.0, np.nan], [30.0, -5.0]])
+        f.create_dataset("lat", data=lat, chunks=(1, 2))
+        f["lat"].attrs["_FillValue"] = -9999.0
+        f["lon"] = [[100.0, 110.0], [120.0, 130.0], [140.0, 150.0]]
+        f["int"] = [1, 2, 3, 4]
+        f["empty"] = np.zeros((0,))
+        f["string"] = ["foo"]
+
+    format = H5()
+
+    assert format.get_values(
+        file,
+        [
+            Key("min(/lat)"),
+            Key("max(/lat)"),
+            Key("mean(/lat)"),
+            Key("count_valid(/lat)"),
+            Key("bounding_box(/lat, /lon)"),
+            Key("max(/lat[0])"),
+            Key("mean(/int)"),
+            Key("min(/empty)"),
+            Key("count_valid(/empty)"),
+        ],
+    ) == {
+        Key("min(/lat)"): -5.0,
+        Key("max(/lat)"): 30.0,
+        Key("mean(/lat)"): 13.75,
+        Key("count_valid(/lat)"): 4,
+        Key("bounding_box(/lat, /lon)"): {
+            "WestBoundingCoordinate": 100.0,
+            "NorthBoundingCoordinate": 30.0,
+            "EastBoundingCoordinate": 150.0,
+            "SouthBoundingCoordinate": -5.0,
+        },
+        Key("max(/lat[0])"): 20.0,
+        Key("mean(/int)"): 2.5,
+        Key("min(/empty)"): None,
+        Key("count_valid(/empty)"): 0,
+    }
+
+    with pytest.raises(FormatError, match="cannot reduce dataset '/string'"):
+        format.get_value(file, Key("min(/string)"))
+    with pytest.raises(FormatError, match="bounding_box takes 2 dataset\\(s\\) but 1 were given"):
+        format.get_value(file, Key("bounding_box(/lat)"))
+    with pytest.raises(FormatError, match="key not found 'min\\(/missing\\)'"):
+        format.get_value(file, Key("min(/missing)"))
+
+
+@pytest.mark.h5
+def test_h5_index(tmp_path):
+    path = tmp_path / "file.h5"
+    with h5py.File(path, "w") as f:
+        f.attrs["foo"] = "foo value"
+        f["list"] = [1, 2, 3]
+        f["large"] = np.arange(100)
+
+    index_dir = str(tmp_path / "index")
+    format = H5(index_dir=index_dir, index_max_dataset_size=100)
+    keys = [Key("/@foo"), Key("list"), Key("large[1:3]"), Key("missing", default=None)]
+    expected = {
+        Key("/@foo"): "foo value",
+        Key("list"): [1, 2, 3],
+        Key("large[1:3]"): [1, 2],
+        Key("missing", default=None): None,
+    }
+
+    with open(path, "rb") as f:
+        assert format.get_values(f, keys) == expected
+
+    with mock.patch("h5py.File", wraps=h5py.File) as mock_file:
+        with open(path, "rb") as f:
+            assert format.get_values(f, keys[:2] + keys[3:]) == {
+                Key("/@foo"): "foo value",
+                Key("list"): [1, 2, 3],
+                Key("missing", default=None): None,
+            }
+            assert format.get_value(f, Key("./list/")) == [1, 2, 3]
+        mock_file.assert_not_called()
+
+        with open(path, "rb") as f:
+            assert format.get_values(f, keys) == expected
+            assert format.get_value(f, Key("list")) == [1, 2, 3]
+        mock_file.assert_called_once()
+
+        with pytest.raises(FormatError, match="key not found 'missing'"):
+            with open(path, "rb") as f:
+                format.get_value(f, Key("missing"))
+        mock_file.assert_called_once()
+
+    # A modified file gets a new index
+    with h5py.File(path, "a") as f:
+        f.attrs["foo"] = "new value"
+    with open(path, "rb") as f:
+        assert format.get_value(f, Key("/@foo")) == "new value"
+
+    # Files that can't be identified are read directly
+    with mock.patch("h5py.File", wraps=h5py.File) as mock_file:
+        assert format.get_value(io.BytesIO(path.read_bytes()), Key("/@foo")) == "new value"
+        mock_file.assert_called_once()
+
+
 @pytest.mark.h5
 def test_h5_key_error():
     file = io.BytesIO()
@@ -176,6 +399,54 @@ def test_json():
     }
 
 
+def test_json_many_keys():
+    file = io.BytesIO(b"""
+    {
+        "properties": {
+            "foo": "foo value",
+            "list": [1, 2, 3],
+            "nested": {
+                "bar": "bar value"
+            }
+        }
+    }
+    """)
+    format = Json()
+
+    assert format.get_values(
+        file,
+        [
+            Key("$.properties.foo"),
+            Key("properties.foo"),
+            Key("$.properties.list", return_list=True),
+            Key("$.properties.list[0]"),
+            Key("$.properties.list[0]", return_list=True),
+            Key("$.properties.list[1]", return_first=True),
+            Key("$.properties.nested.bar"),
+            Key("$.properties.nested.baz", default="default"),
+            Key("$.properties.missing.baz", default=None),
+        ],
+    ) == {
+        Key("$.properties.foo"): "foo value",
+        Key("properties.foo"): "foo value",
+        Key("$.properties.list", return_list=True): [[1, 2, 3]],
+        Key("$.properties.list[0]"): 1,
+        Key("$.properties.list[0]", return_list=True): [1],
+        Key("$.properties.list[1]", return_first=True): 2,
+        Key("$.properties.nested.bar"): "bar value",
+        Key("$.properties.nested.baz", default="default"): "default",
+        Key("$.properties.missing.baz", default=None): None,
+    }
+
+
+def test_json_many_keys_error():
+    file = io.BytesIO(b'{"foo": {"bar": 1}}')
+    format = Json()
+
+    with pytest.raises(FormatError, match="key not found 'foo.baz'"):
+        format.get_values(file, [Key("foo.bar"), Key("foo.baz")])
+
+
 def test_json_dollar_key():
     file = io.BytesIO(b"""
     {
@@ -245,6 +516,214 @@ def test_json_key_error_primitive():
         format.get_values(file, [Key("foo.bar")])
 
 
+@pytest.mark.jsonpath
+@pytest.mark.parametrize("streaming", [False, True])
+def test_json_invalid_path_batch(streaming):
+    format = Json(streaming=streaming)
+
+    with pytest.raises(FormatError, match=r"'\$\[' "):
+        format.get_value(io.BytesIO(b'{"foo": 1}'), Key("$["))
+    with pytest.raises(FormatError, match=r"'\$\[' "):
+        format.get_values(io.BytesIO(b'{"foo": 1}'), [Key("foo"), Key("$[")])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_json_streaming(chunk_size):
+    data = b"""
+    {
+        "skipped": {"a": [1, {"b": "}]\\"{["}], "c": -1.5e3, "d": null},
+        "properties": {
+            "foo": "foo \\u00e9 value",
+            "list": [1, [2, 3], {"x": 3}, true, false],
+            "nested": {
+                "bar": "bar value",
+                "other": "other value"
+            }
+        },
+        "after": [1, 2, 3]
+    }
+    """
+    keys = [
+        Key("$.properties.foo"),
+        Key("properties.foo"),
+        Key("$.properties.list", return_list=True),
+        Key("$.properties.list[0]"),
+        Key("$.properties.list[1]", return_list=True),
+        Key("$.properties.list[2].x"),
+        Key("$.properties.nested.bar"),
+        Key("$.properties.nested.baz", default="default"),
+        Key("$.properties.missing.baz", default=None),
+        Key("$.skipped.c"),
+    ]
+
+    expected = Json().get_values(io.BytesIO(data), keys)
+    format = Json(streaming=True, chunk_size=chunk_size)
+    assert format.get_values(io.BytesIO(data), keys) == expected
+    assert expected[Key("$.properties.foo")] == "foo é value"
+    assert expected[Key("$.properties.list[1]", return_list=True)] == [[2, 3]]
+
+
+def test_json_streaming_stops_reading():
+    data = b'[{"foo": {"bar": 1, "baz": 2}}, ' + b"0, " * 10_000 + b"0]"
+    file = io.BytesIO(data)
+    format = Json(streaming=True, chunk_size=16)
+
+    assert format.get_value(file, Key("$[0].foo.bar")) == 1
+    assert file.tell() < 64
+
+
+def test_json_streaming_duplicate_keys():
+    data = b"""
+    {
+        "foo": {"bar": 1, "baz": 2, "bar": 3},
+        "list": [{"x": 1, "x": {"y": 2}}, {"x": 3}],
+        "foo": {"bar": 4},
+        "other": 5
+    }
+    """
+    keys = [
+        Key("foo.bar"),
+        Key("foo.baz", default=None),
+        Key("list[0].x.y"),
+        Key("list[1].x"),
+        Key("other"),
+    ]
+
+    expected = Json().get_values(io.BytesIO(data), keys)
+    assert expected == {
+        Key("foo.bar"): 4,
+        Key("foo.baz", default=None): None,
+        Key("list[0].x.y"): 2,
+        Key("list[1].x"): 3,
+        Key("other"): 5,
+    }
+    for chunk_size in (1, 7, 64 * 1024):
+        format = Json(streaming=True, chunk_size=chunk_size)
+        assert format.get_values(io.BytesIO(data), keys) == expected
+
+
+def test_json_streaming_dollar_key():
+    format = Json(streaming=True, chunk_size=2)
+
+    assert format.get_value(io.BytesIO(b'{"foo": [1, 2]}'), Key("$")) == {
+        "foo": [1, 2],
+    }
+    assert format.get_value(io.BytesIO(b"\xef\xbb\xbf10"), Key("$")) == 10
+
+
+def test_json_streaming_key_error():
+    format = Json(streaming=True)
+
+    with pytest.raises(FormatError, match="key not found 'foo.bar'"):
+        format.get_values(io.BytesIO(b'{"foo": 10}'), [Key("foo.bar")])
+    with pytest.raises(FormatError, match="key not found 'foo'"):
+        format.get_values(io.BytesIO(b'{"bar": {"foo": 1}}'), [Key("foo")])
+
+
+def test_json_streaming_invalid():
+    format = Json(streaming=True)
+
+    with pytest.raises(json.JSONDecodeError):
+        format.get_values(io.BytesIO(b'{"foo": '), [Key("foo")])
+    with pytest.raises(json.JSONDecodeError):
+        format.get_values(io.BytesIO(b'{"foo" 1}'), [Key("foo")])
+
+
+@pytest.mark.parametrize(
+    "decoder",
+    [
+        "auto",
+        "json",
+        pytest.param("orjson", marks=pytest.mark.orjson),
+    ],
+)
+@pytest.mark.parametrize("streaming", [False, True])
+def test_json_decoder(decoder, streaming):
+    file = io.BytesIO(b'{"foo": "foo value", "list": [1, 2.5, null, true]}')
+    format = Json(decoder=decoder, streaming=streaming)
+
+    assert format.get_values(file, [Key("foo"), Key("list")]) == {
+        Key("foo"): "foo value",
+        Key("list"): [1, 2.5, None, True],
+    }
+
+
+def test_json_decoder_default():
+    assert Json().decoder == "json"
+    assert Json()._decode is json_decoder.get_decoder("json")
+
+
+def test_json_parse_data_static():
+    # parse_data can't see the decoder option, so it uses the standard library
+    with Json.parse_data(io.BytesIO(b'{"foo": NaN}')) as data:
+        assert data["foo"] != data["foo"]
+
+
+def test_json_decoder_auto_fallback():
+    # Values which fast decoders reject are handled by the standard library
+    file = io.BytesIO(b'{"foo": NaN, "bar": 123456789012345678901234567890}')
+    format = Json(decoder="auto")
+
+    values = format.get_values(file, [Key("foo"), Key("bar")])
+    assert values[Key("foo")] != values[Key("foo")]
+    assert values[Key("bar")] == 123456789012345678901234567890
+
+
+def test_json_decoder_auto_invalid():
+    format = Json(decoder="auto")
+
+    with pytest.raises(json.JSONDecodeError):
+        format.get_value(io.BytesIO(b'{"foo": '), Key("foo"))
+
+
+@pytest.mark.orjson
+def test_json_decoder_auto_fallback_only_on_decode_error():
+    decoder = json_decoder.get_decoder("auto")
+
+    with mock.patch("orjson.loads", side_effect=MemoryError):
+        with pytest.raises(MemoryError):
+            decoder(b"{}")
+
+
+@pytest.mark.orjson
+def test_json_decoder_orjson_no_fallback():
+    format = Json(decoder="orjson")
+
+    with pytest.raises(json.JSONDecodeError):
+        format.get_value(io.BytesIO(b'{"foo": NaN}'), Key("foo"))
+
+
+def test_json_decoder_reads_rest_of_file():
+    file = io.BytesIO(b'garbage{"foo": "foo value"}')
+    file.seek(7)
+    format = Json()
+
+    assert format.get_value(file, Key("foo")) == "foo value"
+    assert file.read() == b""
+
+
+def test_json_decoder_invalid():
+    with pytest.raises(ValueError, match="invalid json decoder 'foo'"):
+        Json(decoder="foo")
+
+
+def test_json_decoder_not_installed():
+    with mock.patch.dict(
+        json_decoder.DECODERS,
+        {"orjson": (json_decoder.DECODERS["orjson"][0], False)},
+    ):
+        with pytest.raises(ValueError, match="orjson must be installed"):
+            Json(decoder="orjson")
+
+
+@pytest.mark.jsonpath
+def test_json_streaming_complex_key():
+    file = io.BytesIO(b'{"foo": [{"bar": 1}, {"bar": 2}]}')
+    format = Json(streaming=True)
+
+    assert format.get_value(file, Key("$.foo[*].bar", return_list=True)) == [1, 2]
+
+
 def test_zip():
     file = io.BytesIO()
     with zipfile.ZipFile(file, "w") as f:
@@ -317,6 +796,306 @@ def test_zip_filters_bad_attribute():
         format.get_value(file, Key("key"))
 
 
+def test_zip_index():
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w") as f:
+        f.writestr("foo.txt", "first foo")
+        f.writestr("bar.txt", "bar")
+        with pytest.warns(UserWarning, match="Duplicate name"):
+            f.writestr("foo.txt", "second foo")
+
+    with zipfile.ZipFile(file, "r") as zf:
+        index = ZipIndex(zf)
+
+        def find(filters):
+            member = ZipMember(filters=filters, format=Json())
+            with member._get_file_from_archive(index) as f:
+                return f.read()
+
+        assert find({"filename": "foo.txt"}) == b"first foo"
+        assert find({"filename": r"foo\.txt"}) == b"first foo"
+        assert find({"filename": "foo.txt", "file_size": 10}) == b"second foo"
+        assert find({"filename": "b.*"}) == b"bar"
+        assert find({"file_size": 3}) == b"bar"
+        with pytest.raises(FormatError, match="no archive members matched filters"):
+            find({"filename": "baz.txt"})
+
+
+@pytest.fixture
+def large_zip():
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w") as f:
+        f.writestr("manifest.json", b'{"name": "manifest"}')
+        for i in range(10):
+            f.writestr(f"data/{i}.bin", bytes(range(256)) * 1024)
+        f.writestr("trailer.json", b'{"name": "trailer"}', compress_type=zipfile.ZIP_DEFLATED)
+
+    return file.getvalue()
+
+
+@pytest.mark.parametrize("filename", ("manifest.json", "trailer.json"))
+def test_zip_prefetch(large_zip, filename):
+    format = ZipMember(filters={"filename": filename}, format=Json(), prefetch=True)
+    name = filename.split(".")[0]
+
+    file = CountingFile(io.BytesIO(large_zip))
+    assert format.get_value(file, Key("name")) == name
+    # The member at the end of the archive is included in the first read
+    assert file.stats.requests == (2 if name == "manifest" else 1)
+    assert file.stats.bytes_read < 70 * 1024
+
+    file = CountingFile(io.BytesIO(large_zip))
+    assert format.get_values(file, [Key("name")]) == {Key("name"): name}
+    assert file.stats.requests == (2 if name == "manifest" else 1)
+
+    # Without prefetching every read is passed through
+    file = CountingFile(io.BytesIO(large_zip))
+    format = ZipMember(filters={"filename": filename}, format=Json())
+    assert format.get_value(file, Key("name")) == name
+    assert file.stats.requests > 2
+
+
+def test_zip_prefetch_large_member(large_zip):
+    format = ZipMember(filters={"filename": "data/0.bin"}, format=Json(), prefetch=True)
+
+    file = CountingFile(io.BytesIO(large_zip))
+    with ZipIndex.open_archive(file, prefetch=True) as index:
+        with format._get_file_from_archive(index) as f:
+            assert f.read() == bytes(range(256)) * 1024
+
+    assert file.stats.requests == 2
+    assert file.stats.bytes_read < 64 * 1024 + 256 * 1024 + 1024
+
+
+def _make_tar(file, members, mode="w"):
+    with tarfile.open(fileobj=file, mode=mode) as tf:
+        dirinfo = tarfile.TarInfo("dir")
+        dirinfo.type = tarfile.DIRTYPE
+        tf.addfile(dirinfo)
+        for name, data in members.items():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tf.addfile(tarinfo, io.BytesIO(data))
+    file.seek(0)
+
+
+@pytest.mark.parametrize("mode", ("w", "w:gz", "w:bz2", "w:xz"))
+def test_tar(mode):
+    file = io.BytesIO()
+    _make_tar(
+        file,
+        {
+            "dir/unformatted.txt": b"This is just some text",
+            "dir/foo.json": b'{"foo": "foo value"}',
+            "dir/bar.json": b'{"bar": "bar value"}',
+        },
+        mode=mode,
+    )
+
+    format = TarMember(filters={"name": r".*/bar\.json"}, format=Json())
+
+    assert format.get_value(file, Key("$.bar")) == "bar value"
+    file.seek(0)
+    assert format.get_values(file, [Key("$.bar")]) == {Key("$.bar"): "bar value"}
+
+
+def test_tar_filters():
+    file = io.BytesIO()
+    _make_tar(
+        file,
+        {
+            "foo.json": b'{"foo": "first"}',
+            "other/foo.json": b'{"foo": "second value"}',
+        },
+    )
+
+    format = TarMember(filters={"name": ".*foo.json", "size": 23}, format=Json())
+    assert format.get_value(file, Key("$.foo")) == "second value"
+
+    # Directories are never matched
+    file.seek(0)
+    format = TarMember(filters={"name": "dir"}, format=Json())
+    with pytest.raises(FormatError, match="no archive members matched filters"):
+        format.get_value(file, Key("$"))
+
+    file.seek(0)
+    format = TarMember(filters={"name": "foo.json", "nonexistent_attr": True}, format=Json())
+    with pytest.raises(FormatError, match="no archive members matched filters"):
+        format.get_value(file, Key("$"))
+
+
+def test_tar_empty(tmp_path):
+    path = tmp_path / "empty.tar"
+    with tarfile.open(path, "w"):
+        pass
+
+    format = TarMember(filters={"name": "foo"}, format=Json())
+    with open(path, "rb") as f:
+        with pytest.raises(FormatError, match="no members in archive"):
+            format.get_value(f, Key("$"))
+
+
+def test_tar_stops_at_match():
+    file = io.BytesIO()
+    _make_tar(
+        file,
+        {
+            "foo.json": b'{"foo": "foo value"}',
+            "large.bin": bytes(1024 * 1024),
+        },
+    )
+
+    format = TarMember(filters={"name": "foo.json"}, format=Json())
+
+    assert format.get_value(file, Key("$.foo")) == "foo value"
+    assert file.tell() < 100 * 1024
+
+
+def test_tar_index(tmp_path, mocker):
+    path = tmp_path / "archive.tar"
+    with open(path, "wb") as f:
+        _make_tar(
+            f,
+            {
+                "first.json": b'{"value": 1}',
+                "second.json": b'{"value": 2}',
+                "third.json": b'{"value": 3}',
+            },
+        )
+    # Position of the archive whenever a scan starts
+    scans = []
+    tarfile_open = tarfile.open
+
+    def mock_open(*args, **kwargs):
+        if kwargs["mode"].startswith("r"):
+            scans.append(kwargs["fileobj"].tell())
+        return tarfile_open(*args, **kwargs)
+
+    mocker.patch("tarfile.open", side_effect=mock_open)
+
+    def get_value(name):
+        format = TarMember(filters={"name": name}, format=Json())
+        with open(path, "rb") as f:
+            return format.get_value(f, Key("$.value"))
+
+    assert get_value("second.json") == 2
+    assert scans == [0]
+
+    # Read from the index without scanning the archive
+    assert get_value("first.json") == 1
+    assert get_value("s.cond\\.json") == 2
+    assert scans == [0]
+
+    # Scanning continues after the last member in the index
+    assert get_value("third.json") == 3
+    assert len(scans) == 2
+    assert scans[1] > 0
+
+    with pytest.raises(FormatError, match="no archive members matched filters"):
+        get_value("missing.json")
+    assert len(scans) == 3
+
+    # The whole archive is in the index
+    with pytest.raises(FormatError, match="no archive members matched filters"):
+        get_value("missing.json")
+    assert len(scans) == 3
+
+    # Modifying the archive invalidates the index
+    with open(path, "wb") as f:
+        _make_tar(f, {"first.json": b'{"value": 10}'})
+    assert get_value("first.json") == 10
+    assert scans[3:] == [0]
+
+
+def test_tar_index_nested_gzip(tmp_path):
+    path = tmp_path / "archive.tar.gz"
+    with open(path, "wb") as f:
+        _make_tar(
+            f,
+            {
+                "first.json": b'{"value": 1}',
+                "second.json": b'{"value": 2}',
+            },
+            mode="w:gz",
+        )
+
+    nested = GzipFile(format=TarMember(filters={"name": "second.json"}, format=Json()))
+    format = TarMember(filters={"name": "second.json"}, format=Json())
+
+    # The decompressed stream isn't indexed under the identity of the file
+    with open(path, "rb") as f:
+        assert nested.get_value(f, Key("$.value")) == 2
+    with open(path, "rb") as f:
+        assert format.get_value(f, Key("$.value")) == 2
+
+
+def _tar_block(tarinfo, data):
+    tarinfo.size = len(data)
+    buf = bytearray(tarinfo.tobuf(format=tarfile.GNU_FORMAT))
+    if tarinfo.type == tarfile.GNUTYPE_SPARSE:
+        # A single data region covering the whole member
+        buf[386:398] = tarfile.itn(0, 12, tarfile.GNU_FORMAT)
+        buf[398:410] = tarfile.itn(len(data), 12, tarfile.GNU_FORMAT)
+        buf[483:495] = tarfile.itn(len(data), 12, tarfile.GNU_FORMAT)
+        buf[148:156] = b" " * 8
+        buf[148:156] = b"%06o\0 " % sum(buf[:512])
+
+    return bytes(buf) + data + bytes(-len(data) % tarfile.BLOCKSIZE)
+
+
+def test_tar_index_sparse(tmp_path):
+    sparse_info = tarfile.TarInfo("sparse.json")
+    sparse_info.type = tarfile.GNUTYPE_SPARSE
+    path = tmp_path / "archive.tar"
+    path.write_bytes(
+        _tar_block(tarfile.TarInfo("first.json"), b'{"value": 1}')
+        + _tar_block(sparse_info, b'{"value": 2}')
+        + _tar_block(tarfile.TarInfo("third.json"), b'{"value": 3}')
+        + bytes(tarfile.BLOCKSIZE * 2),
+    )
+
+    def get_value(name):
+        format = TarMember(filters={"name": name}, format=Json())
+        with open(path, "rb") as f:
+            return format.get_value(f, Key("$.value"))
+
+    assert get_value("first.json") == 1
+    # Scans don't index past the sparse member
+    assert get_value("third.json") == 3
+    assert get_value("sparse.json") == 2
+    assert get_value("sparse.json") == 2
+    assert get_value("third.json") == 3
+
+
+@pytest.mark.h5
+def test_tar_gz_h5py():
+    h5_buffer = io.BytesIO()
+    with h5py.File(h5_buffer, "w") as f:
+        f["foo"] = "foo value"
+
+    file = io.BytesIO()
+    _make_tar(file, {"file.h5": h5_buffer.getvalue()}, mode="w:gz")
+    format = TarMember(filters={"name": "file.h5"}, format=H5())
+
+    assert format.get_values(file, [Key("foo")]) == {Key("foo"): "foo value"}
+
+
+@pytest.mark.h5
+def test_tar_h5py_index(tmp_path):
+    h5_buffer = io.BytesIO()
+    with h5py.File(h5_buffer, "w") as f:
+        f["foo"] = "foo value"
+
+    path = tmp_path / "archive.tar"
+    with open(path, "wb") as f:
+        _make_tar(f, {"file.h5": h5_buffer.getvalue(), "other.h5": h5_buffer.getvalue()})
+    format = TarMember(filters={"name": "file.h5"}, format=H5())
+
+    for _ in range(2):
+        with open(path, "rb") as f:
+            assert format.get_values(f, [Key("foo")]) == {Key("foo"): "foo value"}
+
+
 def test_zipinfo():
     file = io.BytesIO()
     with zipfile.ZipFile(file, "w") as f:
@@ -329,6 +1108,61 @@ def test_zipinfo():
     assert format.get_value(file, Key("filename")) is None
 
 
+def test_zipinfo_lazy():
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_DEFLATED) as f:
+        f.writestr("unformatted.txt", "This is just some text")
+        f.writestr("empty.txt", "")
+        f.writestr("foo.json", '{"foo": "bar"}')
+
+    format = ZipInfo()
+
+    assert format.get_values(
+        file,
+        [
+            Key("member_count"),
+            Key("total_file_size"),
+            Key("total_compress_size"),
+            Key("infolist[2].filename"),
+            Key("infolist[2].not_an_attribute", default="default"),
+        ],
+    ) == {
+        Key("member_count"): 3,
+        Key("total_file_size"): 36,
+        Key("total_compress_size"): mock.ANY,
+        Key("infolist[2].filename"): "foo.json",
+        Key("infolist[2].not_an_attribute", default="default"): "default",
+    }
+
+    everything = format.get_value(file, Key("$"))
+    assert type(everything) is dict
+    assert everything.keys() == {"infolist", "filename", "comment"}
+    assert type(everything["infolist"][0]) is dict
+    assert everything["infolist"][0]["filename"] == "unformatted.txt"
+
+
+@pytest.mark.jsonpath
+def test_zipinfo_lazy_jsonpath():
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w") as f:
+        f.writestr("unformatted.txt", "This is just some text")
+        f.writestr("empty.txt", "")
+        f.writestr("foo.json", '{"foo": "bar"}')
+
+    format = ZipInfo()
+
+    assert format.get_value(file, Key("$..file_size", return_list=True)) == [22, 0, 14]
+    assert format.get_value(file, Key("$.infolist[*].filename", return_list=True)) == [
+        "unformatted.txt",
+        "empty.txt",
+        "foo.json",
+    ]
+    values = format.get_value(file, Key("$.*", return_list=True))
+    assert len(values) == 3
+    assert type(values[0][0]) is dict
+    assert values[1:] == [None, b""]
+
+
 @pytest.mark.jsonpath
 def test_zipinfo_jsonpath():
     file = io.BytesIO()
@@ -367,6 +1201,12 @@ def test_zipinfo_jsonpath():
         expected["compress_level"] = None
 
     assert infolist_item == expected
+    assert format.get_value(file, Key("$.infolist[?filename = 'foo.json'].file_size")) == 14
+    assert format.get_value(file, Key("$.infolist[*].filename", return_list=True)) == [
+        "unformatted.txt",
+        "foobar.txt",
+        "foo.json",
+    ]
 
 
 @pytest.mark.xml
@@ -485,6 +1325,117 @@ def test_xml_key_error():
         format.get_values(file, [Key("foo")])
 
 
+@pytest.mark.xml
+def test_xml_compiled_xpath_cache():
+    from mandible.metadata_mapper.format.xml import compile_xpath
+
+    format = Xml()
+    compile_xpath.cache_clear()
+
+    for value in ("first", "second"):
+        file = io.BytesIO(f"<root><foo>{value}</foo></root>".encode())
+        assert format.get_value(file, Key("./foo")) == value
+
+    info = compile_xpath.cache_info()
+    assert info.misses == 1
+    assert info.hits == 1
+
+
+@pytest.mark.xml
+def test_xml_compiled_xpath_namespaces():
+    # The same prefix may refer to different namespaces in each document
+    format = Xml()
+
+    file = io.BytesIO(b'<root xmlns:a="urn:a" xmlns:b="urn:b"><a:foo>a</a:foo><b:foo>b</b:foo></root>')
+    assert format.get_value(file, Key("./a:foo")) == "a"
+
+    file = io.BytesIO(b'<root xmlns:a="urn:b" xmlns:b="urn:a"><a:foo>b</a:foo><b:foo>a</b:foo></root>')
+    assert format.get_value(file, Key("./a:foo")) == "b"
+
+
+@pytest.mark.xml
+@pytest.mark.parametrize(
+    "key",
+    [
+        Key("/root/foo:foo"),
+        Key("/root/bar", default=None),
+        Key("./foo:bar"),
+        Key("foo:bar/@attr"),
+        Key("@id"),
+        Key("."),
+        Key("./list/v[2]"),
+        Key("./list/v", return_list=True),
+        Key("./list/v", return_first=True),
+        Key("./list/v"),
+        Key("./list/v[5]", default="default"),
+        Key("./list/*[3]"),
+        Key("./nested/qux", return_list=True),
+        Key("./nested[2]/qux"),
+        Key("./missing"),
+        Key("./undefined:foo"),
+    ],
+)
+def test_xml_streaming(key):
+    data = b"""
+    <root id="root id" xmlns:foo="http://bigtest.com/namespace/docs">
+        <foo:foo>foo value</foo:foo>
+        <foo:bar attr="attr value">bar value</foo:bar>
+        <list>
+            <v>list</v>
+            <v>value</v>
+            <other>other value</other>
+            <v>another value</v>
+        </list>
+        <nested><qux>first qux</qux></nested>
+        <nested><qux>second qux</qux></nested>
+    </root>
+    """
+
+    def get_value(format):
+        try:
+            return format.get_value(io.BytesIO(data), key)
+        except FormatError as e:
+            return str(e)
+
+    assert get_value(Xml(streaming=True)) == get_value(Xml())
+
+
+@pytest.mark.xml
+def test_xml_streaming_stops_reading():
+    data = b"<root><head><id>1</id></head><items>" + b"<item>x</item>" * 10_000 + b"</items></root>"
+    file = io.BytesIO(data)
+    format = Xml(streaming=True)
+
+    assert format.get_values(
+        file,
+        [Key("./head/id", return_first=True), Key("./head[1]/id")],
+    ) == {
+        Key("./head/id", return_first=True): "1",
+        Key("./head[1]/id"): "1",
+    }
+    assert file.tell() < len(data)
+
+
+@pytest.mark.xml
+def test_xml_streaming_complex_key():
+    file = io.BytesIO(b"<root><v>1</v><v>2</v></root>")
+    format = Xml(streaming=True)
+
+    assert format.get_values(file, [Key("./v[1]"), Key("count(./v)")]) == {
+        Key("./v[1]"): "1",
+        Key("count(./v)"): 2,
+    }
+
+
+@pytest.mark.xml
+def test_xml_streaming_default_namespace():
+    file = io.BytesIO(b'<root xmlns="urn:foo"><foo>foo value</foo></root>')
+    format = Xml(streaming=True)
+
+    with pytest.raises(FormatError, match="empty namespace prefix"):
+        format.get_value(file, Key("./foo"))
+
+
 @pytest.mark.h5
 def test_bzip2_h5py():
     h5_buffer = io.BytesIO()
@@ -508,6 +1459,206 @@ def test_bzip2_h5py():
     }
 
 
+@pytest.mark.h5
+def test_bzip2_h5py_spooled(mocker):
+    h5_buffer = io.BytesIO()
+    with h5py.File(h5_buffer, "w") as f:
+        f["foo"] = "foo value"
+
+    bz2_compressed_file = io.BytesIO(bz2.compress(h5_buffer.getvalue()))
+    format = Bzip2File(format=H5())
+    mock_seek = mocker.spy(bz2.BZ2File, "seek")
+
+    assert format.get_value(bz2_compressed_file, Key("foo")) == "foo value"
+    mock_seek.assert_not_called()
+
+
+@pytest.mark.h5
+def test_zip_h5py_spooled(mocker):
+    h5_buffer = io.BytesIO()
+    with h5py.File(h5_buffer, "w") as f:
+        f["foo"] = "foo value"
+
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("file.h5", h5_buffer.getvalue())
+
+    format = ZipMember(filters={"filename": "file.h5"}, format=H5())
+    mock_seek = mocker.spy(zipfile.ZipExtFile, "seek")
+
+    assert format.get_values(file, [Key("foo")]) == {Key("foo"): "foo value"}
+    mock_seek.assert_not_called()
+
+
+def test_bzip2_json_not_spooled(mocker):
+    bz2_compressed_file = io.BytesIO(bz2.compress(b'{"foo": "foo value"}'))
+    format = Bzip2File(format=Json())
+    mock_spool_file = mocker.patch("mandible.metadata_mapper.format.format.spool_file")
+
+    assert format.get_value(bz2_compressed_file, Key("$.foo")) == "foo value"
+    mock_spool_file.assert_not_called()
+
+
+def test_spool_file_memory():
+    file = io.BytesIO(b"0123456789")
+    file.seek(2)
+
+    with spool_file(file, max_memory_size=8) as spooled:
+        assert isinstance(spooled, io.BytesIO)
+        assert spooled.read() == b"23456789"
+
+
+def test_spool_file_temporary_file():
+    data = bytes(range(256)) * 100
+    file = bz2.BZ2File(io.BytesIO(bz2.compress(data)))
+
+    with spool_file(file, max_memory_size=1000) as spooled:
+        assert not isinstance(spooled, io.BytesIO)
+        assert spooled.read() == data
+        spooled.seek(-256, io.SEEK_END)
+        assert spooled.read() == bytes(range(256))
+
+
+@pytest.fixture
+def bz2_data():
+    # Spans several blocks, including incompressible ones
+    data = b"".join(i.to_bytes(4, "big") * (i % 7 + 1) for i in range(50_000))
+    return data + bytes(range(256)) * 4000
+
+
+@pytest.mark.parametrize("chunk_size", (1000, bz2_parallel.DEFAULT_CHUNK_SIZE))
+def test_parallel_bz2_reader(bz2_data, chunk_size):
+    file = io.BytesIO(bz2.compress(bz2_data, 1))
+
+    with io.BufferedReader(bz2_parallel.ParallelBZ2Reader(file, max_workers=2, chunk_size=chunk_size)) as f:
+        assert f.read() == bz2_data
+
+
+def test_parallel_bz2_reader_multiple_streams(bz2_data):
+    file = io.BytesIO(bz2.compress(bz2_data, 1) + bz2.compress(b"") + bz2.compress(b"end", 9))
+
+    with io.BufferedReader(bz2_parallel.ParallelBZ2Reader(file, chunk_size=1000)) as f:
+        assert f.read() == bz2_data + b"end"
+
+
+def test_parallel_bz2_reader_empty():
+    with io.BufferedReader(bz2_parallel.ParallelBZ2Reader(io.BytesIO(bz2.compress(b"")))) as f:
+        assert f.read() == b""
+
+
+def test_parallel_bz2_reader_fallback(bz2_data, mocker):
+    # Simulate a block magic number occurring by chance in the compressed data
+    decompress_block = bz2_parallel._decompress_block
+    calls = []
+
+    def mock_decompress_block(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise OSError("Invalid data stream")
+        return decompress_block(*args)
+
+    mocker.patch.object(bz2_parallel, "_decompress_block", side_effect=mock_decompress_block)
+    file = io.BytesIO(b"prefix" + bz2.compress(bz2_data, 1))
+    file.seek(6)
+
+    with bz2_parallel.ParallelBZ2Reader(file, max_workers=1) as f:
+        data = b"".join(iter(lambda: f.read(10_000), b""))
+
+    assert data == bz2_data
+    assert len(calls) >= 3
+
+
+def test_parallel_bz2_reader_invalid():
+    with io.BufferedReader(bz2_parallel.ParallelBZ2Reader(io.BytesIO(b"BZh9 not bzip2 data"))) as f:
+        with pytest.raises(OSError):
+            f.read()
+
+    with io.BufferedReader(bz2_parallel.ParallelBZ2Reader(io.BytesIO(bz2.compress(b"foo")[:-10]))) as f:
+        with pytest.raises(EOFError):
+            f.read()
+
+
+def not_seekable(data):
+    file = mock.create_autospec(io.RawIOBase, instance=True)
+    file.seekable.return_value = False
+    file.read.side_effect = io.BytesIO(data).read
+    return file
+
+
+def test_parallel_bz2_reader_not_seekable(bz2_data):
+    with io.BufferedReader(bz2_parallel.ParallelBZ2Reader(not_seekable(bz2.compress(bz2_data, 1)))) as f:
+        assert f.read() == bz2_data
+
+    with io.BufferedReader(bz2_parallel.ParallelBZ2Reader(not_seekable(b"not bzip2 data"))) as f:
+        with pytest.raises(OSError, match="Invalid data stream"):
+            f.read()
+
+
+def test_parallel_bz2_reader_not_seekable_fallback(bz2_data, mocker):
+    decompress_block = bz2_parallel._decompress_block
+    calls = []
+
+    def mock_decompress_block(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OSError("Invalid data stream")
+        return decompress_block(*args)
+
+    mocker.patch.object(bz2_parallel, "_decompress_block", side_effect=mock_decompress_block)
+
+    # Nothing was returned yet, so the data read so far is decompressed again
+    with bz2_parallel.ParallelBZ2Reader(not_seekable(bz2.compress(bz2_data, 1)), max_workers=1) as f:
+        data = b"".join(iter(lambda: f.read(10_000), b""))
+
+    assert data == bz2_data
+
+
+def test_parallel_bz2_reader_not_seekable_error(bz2_data, mocker):
+    decompress_block = bz2_parallel._decompress_block
+    calls = []
+
+    def mock_decompress_block(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise OSError("Invalid data stream")
+        return decompress_block(*args)
+
+    mocker.patch.object(bz2_parallel, "_decompress_block", side_effect=mock_decompress_block)
+
+    with bz2_parallel.ParallelBZ2Reader(not_seekable(bz2.compress(bz2_data, 1)), max_workers=1) as f:
+        assert f.read(10_000)
+        with pytest.raises(bz2_parallel.DecompressionError, match="isn't seekable: Invalid data stream"):
+            while f.read(10_000):
+                pass
+
+
+def test_bzip2_parallel_json(bz2_data):
+    json_bytes = json.dumps({"foo": "foo value", "data": bz2_data.hex()}).encode("utf-8")
+    bz2_compressed_file = io.BytesIO(bz2.compress(json_bytes, 1))
+    format = Bzip2File(format=Json(), parallel=True, max_workers=2)
+
+    assert format.get_values(bz2_compressed_file, [Key("$.foo"), Key("$.data")]) == {
+        Key("$.foo"): "foo value",
+        Key("$.data"): bz2_data.hex(),
+    }
+
+
+@pytest.mark.h5
+def test_bzip2_parallel_h5py():
+    h5_buffer = io.BytesIO()
+    with h5py.File(h5_buffer, "w") as f:
+        f["foo"] = "foo value"
+        f["data"] = np.arange(200_000)
+
+    bz2_compressed_file = io.BytesIO(bz2.compress(h5_buffer.getvalue(), 1))
+    format = Bzip2File(format=H5(), parallel=True)
+
+    assert format.get_values(bz2_compressed_file, [Key("foo"), Key("data[199999]")]) == {
+        Key("foo"): "foo value",
+        Key("data[199999]"): 199999,
+    }
+
+
 def test_bzip2_json():
     json_bytes = json.dumps(
         {
@@ -529,3 +1680,82 @@ def test_bzip2_json():
         "bar": "bar value",
         "foo": "foo value",
     }
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+@pytest.mark.parametrize(
+    ("format_cls", "compress"),
+    (
+        (GzipFile, gzip.compress),
+        (XzFile, lzma.compress),
+        pytest.param(ZstdFile, _zstd_compress, marks=pytest.mark.zstd),
+    ),
+)
+def test_compressed_json(format_cls, compress):
+    json_bytes = json.dumps(
+        {
+            "foo": "foo value",
+            "bar": "bar value",
+        },
+    ).encode("utf-8")
+
+    compressed_file = io.BytesIO(compress(json_bytes))
+    format = format_cls(format=Json())
+
+    assert format.get_value(compressed_file, Key("$.foo")) == "foo value"
+    compressed_file.seek(0)
+    assert format.get_values(compressed_file, [Key("$.foo"), Key("$.bar")]) == {
+        Key("$.foo"): "foo value",
+        Key("$.bar"): "bar value",
+    }
+
+
+@pytest.mark.h5
+@pytest.mark.parametrize(
+    ("format_cls", "compress"),
+    (
+        (GzipFile, gzip.compress),
+        (XzFile, lzma.compress),
+        pytest.param(ZstdFile, _zstd_compress, marks=pytest.mark.zstd),
+    ),
+)
+def test_compressed_h5py(format_cls, compress):
+    h5_buffer = io.BytesIO()
+    with h5py.File(h5_buffer, "w") as f:
+        f["foo"] = "foo value"
+        f["list"] = ["list", "value"]
+
+    compressed_file = io.BytesIO(compress(h5_buffer.getvalue()))
+    format = format_cls(format=H5())
+
+    assert format.get_values(compressed_file, [Key("foo"), Key("list")]) == {
+        Key("foo"): "foo value",
+        Key("list"): ["list", "value"],
+    }
+
+
+def test_gzip_multiple_members():
+    compressed_file = io.BytesIO(gzip.compress(b'{"foo": ') + gzip.compress(b'"foo value"}'))
+    format = GzipFile(format=Json())
+
+    assert format.get_value(compressed_file, Key("$.foo")) == "foo value"
+
+
+@pytest.mark.zstd
+def test_zstd_multiple_frames():
+    compressed_file = io.BytesIO(_zstd_compress(b'{"foo": ') + _zstd_compress(b'"foo value"}'))
+    format = ZstdFile(format=Json())
+
+    assert format.get_value(compressed_file, Key("$.foo")) == "foo value"
+    assert not compressed_file.closed
+
+
+@pytest.mark.parametrize("format_cls", (GzipFile, XzFile))
+def test_compressed_invalid(format_cls):
+    format = format_cls(format=Json())
+
+    with pytest.raises((OSError, lzma.LZMAError)):
+        format.get_value(io.BytesIO(b"not compressed"), Key("$.foo"))
@@ -23,6 +23,15 @@ def test_normalize():
     assert normalize(np.array(["A", "B"], dtype="|S1")) == ["A", "B"]
     assert normalize(np.array(["A", "B"], dtype="O")) == ["A", "B"]
     assert normalize(np.array([], dtype="|S1")) == []
+    assert normalize(np.array([[1, 2], [3, 4]])) == [[1, 2], [3, 4]]
+    assert normalize(np.array([[b"A", b"B"], [b"C", b"D"]])) == [["A", "B"], ["C", "D"]]
+    assert normalize(np.array([[b"A", "B"]], dtype="O")) == [["A", "B"]]
+    assert normalize(np.array(b"A", dtype="O")) == "A"
+    assert normalize(np.array(1.5)) == 1.5
+
+    array = np.array([1, 2], dtype=np.int64)
+    assert normalize(array, numpy_arrays=True) is array
+    assert normalize(np.int64(10), numpy_arrays=True) == 10
 
 
 def test_parse_key():
@@ -42,3 +51,197 @@ def test_parse_key():
         parse_key("a@b@c")
     with pytest.raises(ValueError):
         parse_key("@@a@b@c@@")
+
+
+def test_parse_selection():
+    from mandible.metadata_mapper.format.h5 import parse_selection
+
+    assert parse_selection("foo") == ("foo", None)
+    assert parse_selection("/foo/lat[0,0]") == ("/foo/lat", (0, 0))
+    assert parse_selection("lat[-1]") == ("lat", (-1,))
+    assert parse_selection("data[::100]") == ("data", (slice(None, None, 100),))
+    assert parse_selection("data[1:10:2, :]") == ("data", (slice(1, 10, 2), slice(None)))
+    assert parse_selection("data[..., 0]") == ("data", (Ellipsis, 0))
+    assert parse_selection("table[field]") == ("table", ("field",))
+    assert parse_selection("table['field name', 0]") == ("table", ("field name", 0))
+    assert parse_selection('table["field name"]') == ("table", ("field name",))
+    assert parse_selection("foo[]") == ("foo[]", None)
+    assert parse_selection("foo[not a field]") == ("foo[not a field]", None)
+    assert parse_selection("foo[0]bar") == ("foo[0]bar", None)
+
+
+def test_parse_reduction():
+    from mandible.metadata_mapper.format.h5 import parse_reduction
+
+    assert parse_reduction("/foo") is None
+    assert parse_reduction("min(/foo)") == ("min", ["/foo"])
+    assert parse_reduction("count_valid(/foo[0, :])") == ("count_valid", ["/foo[0, :]"])
+    assert parse_reduction("bounding_box(/lat, /lon)") == ("bounding_box", ["/lat", "/lon"])
+    assert parse_reduction("bounding_box(/lat[0, :], /lon[0, :])") == (
+        "bounding_box",
+        ["/lat[0, :]", "/lon[0, :]"],
+    )
+    assert parse_reduction("unknown(/foo)") is None
+
+
+def test_dataset_stats():
+    import numpy as np
+
+    from mandible.metadata_mapper.format.h5 import DatasetStats
+
+    stats = DatasetStats()
+    assert stats.min is None
+    assert stats.mean is None
+
+    stats.update(np.array([[1.0, np.nan], [-9999.0, 3.0]]), fill_value=-9999.0)
+    stats.update(np.array([5.0]), fill_value=-9999.0)
+    stats.update(np.array([], dtype=np.float64))
+
+    assert stats.min == 1.0
+    assert stats.max == 5.0
+    assert stats.count == 3
+    assert stats.mean == 3.0
+
+
+def test_iter_blocks():
+    import io
+
+    import h5py
+    import numpy as np
+
+    from mandible.metadata_mapper.format.h5 import iter_blocks
+
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        f.create_dataset("chunked", data=np.arange(100).reshape(10, 10), chunks=(5, 5))
+        f["contiguous"] = np.arange(10)
+        f["scalar"] = 1
+
+        assert [block.shape for block in iter_blocks(f["chunked"])] == [(5, 5)] * 4
+        assert sum(block.sum() for block in iter_blocks(f["chunked"])) == 4950
+        assert [block.tolist() for block in iter_blocks(f["contiguous"])] == [list(range(10))]
+        assert list(iter_blocks(f["scalar"])) == [1]
+
+
+def test_iter_blocks_bounded(mocker):
+    import io
+
+    import h5py
+    import numpy as np
+
+    from mandible.metadata_mapper.format.h5 import iter_blocks
+
+    # Blocks of 4 int64 values
+    mocker.patch("mandible.metadata_mapper.format.h5.BLOCK_SIZE", 32)
+
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        f["row"] = np.arange(10, dtype=np.int64).reshape(1, 10)
+        f["table"] = np.arange(24, dtype=np.int64).reshape(6, 2, 2)
+        f.create_dataset("chunked", data=np.arange(100, dtype=np.int64).reshape(10, 10), chunks=(10, 10))
+
+        blocks = list(iter_blocks(f["row"]))
+        assert [block.tolist() for block in blocks] == [[[0, 1, 2, 3]], [[4, 5, 6, 7]], [[8, 9]]]
+
+        blocks = list(iter_blocks(f["table"]))
+        assert [block.shape for block in blocks] == [(1, 2, 2)] * 6
+        assert np.concatenate(blocks).tolist() == f["table"][()].tolist()
+
+        # Selections are read in blocks even if the dataset is chunked
+        blocks = list(iter_blocks(f["chunked"], (slice(1, None, 3), Ellipsis, 5)))
+        assert [block.shape for block in blocks] == [(3, 1)]
+        assert np.concatenate(blocks).reshape(-1).tolist() == [15, 45, 75]
+
+        blocks = list(iter_blocks(f["chunked"], (-1, slice(None, None, 2))))
+        assert [block.reshape(-1).tolist() for block in blocks] == [[90, 92, 94, 96], [98]]
+
+        assert list(iter_blocks(f["chunked"], (slice(5, 5),))) == []
+
+        with pytest.raises(IndexError, match=r"Index \(10\) out of range"):
+            list(iter_blocks(f["chunked"], (10,)))
+        with pytest.raises(IndexError, match="too many indices"):
+            list(iter_blocks(f["chunked"], (0, 0, 0)))
+
+
+def test_build_index():
+    import io
+
+    import h5py
+    import numpy as np
+
+    from mandible.metadata_mapper.format.h5_index import MISSING, H5Index, build_index
+
+    file = io.BytesIO()
+    with h5py.File(file, "w") as f:
+        f.attrs["root"] = "root value"
+        f["group/small"] = [1, 2, 3]
+        f["group/small"].attrs["units"] = b"m"
+        f["group"].attrs["list"] = np.array([1.5, 2.5])
+        f["large"] = np.zeros(1000)
+        f["compound"] = np.array([(1, 2.0)], dtype=[("a", "i4"), ("b", "f8")])
+        f["soft"] = h5py.SoftLink("/group")
+        f["hard"] = f["group"]
+
+        index = build_index(f, "identity", max_dataset_size=100)
+
+    assert H5Index.from_dict(index.to_dict()) == index
+    assert index.get("/@root") == "root value"
+    assert index.get("group/small") == [1, 2, 3]
+    assert index.get("/group/small@units") == "m"
+    assert index.get("/group/small@missing") is None
+    assert index.get("/group@list") == [1.5, 2.5]
+    # Values which aren't stored need the file to be read
+    assert index.get("/large") is MISSING
+    assert index.get("/large[0]") is MISSING
+    assert index.get("/compound") is MISSING
+    assert index.get("/group") is MISSING
+    assert index.get("max(/large)") is MISSING
+    # Paths through links may refer to objects that weren't indexed
+    assert index.get("/soft/small") is MISSING
+    assert index.get("/hard/small") is MISSING
+    assert index.get("/hard/missing") is MISSING
+    # Paths are normalized the same way HDF5 resolves them
+    assert index.get("./group/small") == [1, 2, 3]
+    assert index.get("group//small") == [1, 2, 3]
+    assert index.get("group/small/") == [1, 2, 3]
+    assert index.get("/group/./small@units") == "m"
+    assert index.get("/group/../group/small") is MISSING
+
+    with pytest.raises(KeyError):
+        index.get("/missing")
+    with pytest.raises(KeyError):
+        index.get("/group/missing")
+
+
+def test_index_sidecar(tmp_path):
+    from mandible.metadata_mapper.format.format import get_file_identity
+    from mandible.metadata_mapper.format.h5_index import (
+        H5Index,
+        get_index_path,
+        load_index,
+        save_index,
+    )
+
+    path = tmp_path / "file.h5"
+    path.write_bytes(b"data")
+    index_dir = str(tmp_path / "index")
+
+    with open(path, "rb") as f:
+        identity = get_file_identity(f)
+    assert identity is not None
+    assert identity.startswith(f"{path}:")
+    assert load_index(index_dir, identity) is None
+
+    index = H5Index(identity=identity, datasets={"/foo": [1.0, float("inf")]}, objects={"/", "/foo"})
+    save_index(index_dir, index)
+    assert load_index(index_dir, identity) == index
+    assert load_index(index_dir, "other identity") is None
+
+    # Modifying the file changes its identity
+    path.write_bytes(b"other data")
+    with open(path, "rb") as f:
+        assert get_file_identity(f) != identity
+
+    with open(get_index_path(index_dir, identity), "w") as f:
+        f.write("{")
+    assert load_index(index_dir, identity) is None
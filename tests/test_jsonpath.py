@@ -1,3 +1,7 @@
+from types import MappingProxyType
+
+import pytest
+
 from mandible import jsonpath
 
 
@@ -16,3 +20,211 @@ def test_get_simple():
     assert jsonpath.get(data, "$.number") == [1]
     assert jsonpath.get(data, "foo.bar.baz") == ["string-value"]
     assert jsonpath.get(data, "$.foo.bar.baz") == ["string-value"]
+
+
+def test_get_mapping():
+    data = MappingProxyType(
+        {
+            "foo": [MappingProxyType({"bar": "bar-value"})],
+        },
+    )
+
+    assert jsonpath.get(data, "foo[0].bar") == ["bar-value"]
+    assert jsonpath.get(data, "$.foo[0].bar") == ["bar-value"]
+    assert jsonpath.batch_get(data, ["$.foo[0].bar"]) == {"$.foo[0].bar": ["bar-value"]}
+
+
+def test_compile():
+    data = {
+        "foo": {
+            "bar": [1, 2, 3],
+        },
+    }
+
+    path = jsonpath.compile("$.foo.bar[1]")
+
+    assert path.get(data) == [2]
+    assert path.get({"foo": {"bar": [4, 5]}}) == [5]
+
+
+def test_compile_cache():
+    jsonpath.cache_clear()
+
+    path = jsonpath.compile("$.foo.bar")
+
+    assert jsonpath.compile("$.foo.bar") is path
+    assert jsonpath.get({"foo": {"bar": 1}}, "$.foo.bar") == [1]
+
+    info = jsonpath.cache_info()
+    assert info.hits == 2
+    assert info.misses == 1
+    assert info.currsize == 1
+    assert info.maxsize == jsonpath.CACHE_SIZE
+
+    jsonpath.cache_clear()
+
+    assert jsonpath.cache_info().currsize == 0
+    assert jsonpath.compile("$.foo.bar") is not path
+
+
+@pytest.mark.jsonpath
+def test_parse_simple_path():
+    from mandible.jsonpath import _parse_simple_path
+
+    assert _parse_simple_path("$") == []
+    assert _parse_simple_path("foo") == ["foo"]
+    assert _parse_simple_path("$.foo") == ["foo"]
+    assert _parse_simple_path("foo.bar[3].baz") == ["foo", "bar", 3, "baz"]
+    assert _parse_simple_path("$[1]") == [1]
+    assert _parse_simple_path("$.foo[0][10]") == ["foo", 0, 10]
+
+    for path in (
+        "",
+        "$.",
+        "$.foo.",
+        "$..foo",
+        "$.foo[*]",
+        "$.foo.*",
+        "$.foo[-1]",
+        "$.foo[01]",
+        "$.foo[0:2]",
+        "$.foo[?bar = 1]",
+        "$.foo-bar",
+        "$['foo']",
+        "foo bar",
+    ):
+        assert _parse_simple_path(path) is None, path
+
+
+@pytest.mark.jsonpath
+@pytest.mark.parametrize(
+    "word",
+    ["where", "wherenot", "true", "false", "null", "in", "this", "sorted", "len"],
+)
+def test_get_keyword_field(word):
+    import jsonpath_ng.ext
+
+    data = {word: 1, "foo": {word: 2}}
+
+    for path in (f"$.{word}", f"foo.{word}", f"$.foo.{word}"):
+        try:
+            expected = [match.value for match in jsonpath_ng.ext.parse(path).find(data)]
+        except Exception as e:
+            with pytest.raises(type(e)):
+                jsonpath.get(data, path)
+        else:
+            assert jsonpath.get(data, path) == expected
+
+
+SIMPLE_ENGINE_DATA = {
+    "number": 1,
+    "null": None,
+    "string": "string-value",
+    "list": [1, [2, 3], {"foo": "list-dict-value"}, None],
+    "empty_list": [],
+    "foo": {
+        "bar": {
+            "baz": "string-value",
+        },
+        "list": [{"qux": 1}, {"qux": 2}],
+    },
+    "tuple": (1, 2),
+    "int_keys": {0: "zero"},
+}
+SIMPLE_ENGINE_PATHS = [
+    "$",
+    "number",
+    "$.number",
+    "$.null",
+    "$.string",
+    "$.list",
+    "$.list[0]",
+    "$.list[1][1]",
+    "$.list[2].foo",
+    "$.list[3]",
+    "$.list[4]",
+    "$.list[100]",
+    "$.empty_list[0]",
+    "foo.bar.baz",
+    "$.foo.bar.baz",
+    "$.foo.list[1].qux",
+    "$.foo.does_not_exist",
+    "$.foo.does_not_exist.bar",
+    "$.number.foo",
+    "$.null.foo",
+    "$.string.foo",
+    "$.string[0]",
+    "$.foo[0]",
+    "$.list.foo",
+    "$.tuple[0]",
+    "$.int_keys[0]",
+]
+
+
+@pytest.mark.jsonpath
+@pytest.mark.parametrize("path", SIMPLE_ENGINE_PATHS)
+def test_simple_engine_matches_jsonpath_ng(path):
+    import jsonpath_ng.ext
+
+    compiled = jsonpath.JsonPath(path)
+    assert compiled.is_simple
+
+    try:
+        expected = [match.value for match in jsonpath_ng.ext.parse(path).find(SIMPLE_ENGINE_DATA)]
+    except Exception as e:
+        with pytest.raises(type(e)):
+            compiled.get(SIMPLE_ENGINE_DATA)
+    else:
+        assert compiled.get(SIMPLE_ENGINE_DATA) == expected
+
+
+@pytest.mark.jsonpath
+def test_complex_paths_use_jsonpath_ng():
+    data = {
+        "inventory": [
+            {"name": "Apple", "price": 1},
+            {"name": "Banana", "price": 2},
+        ],
+    }
+
+    for path, expected in (
+        ("$.inventory[?name = 'Banana'].price", [2]),
+        ("$.inventory[*].name", ["Apple", "Banana"]),
+        ("$..price", [1, 2]),
+    ):
+        compiled = jsonpath.JsonPath(path)
+        assert not compiled.is_simple
+        assert compiled.get(data) == expected
+
+
+def test_batch_get():
+    data = {
+        "properties": {
+            "a": 1,
+            "b": [10, 20, {"c": "nested"}],
+        },
+        "other": None,
+    }
+    paths = [
+        "$",
+        "$.properties.a",
+        "properties.a",
+        "$.properties.b[1]",
+        "$.properties.b[2].c",
+        "$.other",
+        "$.properties.does_not_exist",
+        "$.properties.b[10]",
+    ]
+
+    results = jsonpath.batch_get(data, paths)
+
+    assert results == {
+        "$": [data],
+        "$.properties.a": [1],
+        "properties.a": [1],
+        "$.properties.b[1]": [20],
+        "$.properties.b[2].c": ["nested"],
+        "$.other": [None],
+    }
+    for path, values in results.items():
+        assert jsonpath.get(data, path) == values
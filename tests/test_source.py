@@ -1,14 +1,17 @@
+import asyncio
 import io
+import zipfile
 from dataclasses import dataclass
 from unittest import mock
 
 import pytest
 
-from mandible.metadata_mapper import FileSource, Format
+from mandible.metadata_mapper import FileSource, Format, ZipSource
 from mandible.metadata_mapper.context import Context
+from mandible.metadata_mapper.format import FormatError, Json, ZipMember
 from mandible.metadata_mapper.key import Key
 from mandible.metadata_mapper.source import Source
-from mandible.metadata_mapper.storage import Storage
+from mandible.metadata_mapper.storage import AsyncStorage, Dummy, Storage
 
 
 @pytest.fixture
@@ -78,3 +81,134 @@ def test_custom_source(mock_context):
     assert source._values == {
         Key("hello"): "hello",
     }
+
+
+def test_source_async(mock_context, mock_format, mock_storage):
+    mock_storage.open_file.return_value = io.BytesIO(b"mock data")
+    mock_format.get_values.return_value = {
+        Key("foo"): "foo value",
+    }
+
+    source = FileSource(
+        mock_storage,
+        mock_format,
+    )
+    source.add_key(Key("foo"))
+
+    asyncio.run(source.query_all_values_async(mock_context))
+
+    mock_storage.open_file.assert_called_once_with(mock_context)
+    assert source.get_value(Key("foo")) == "foo value"
+
+
+def test_source_async_storage(mock_context, mock_format):
+    class AsyncDummy(Storage, AsyncStorage, register=False):
+        def open_file(self, context: Context):
+            raise AssertionError("open_file should not be called")
+
+        async def open_file_async(self, context: Context):
+            return io.BytesIO(b"mock data")
+
+    mock_format.get_values.return_value = {
+        Key("foo"): "foo value",
+    }
+
+    source = FileSource(
+        AsyncDummy(),
+        mock_format,
+    )
+    source.add_key(Key("foo"))
+
+    asyncio.run(source.query_all_values_async(mock_context))
+
+    assert source.get_value(Key("foo")) == "foo value"
+
+
+def test_source_async_query_no_keys(mock_context, mock_format, mock_storage):
+    source = FileSource(
+        mock_storage,
+        mock_format,
+    )
+
+    asyncio.run(source.query_all_values_async(mock_context))
+
+    mock_storage.open_file.assert_not_called()
+    mock_format.get_values.assert_not_called()
+
+
+def test_custom_source_async(mock_context):
+    @dataclass
+    class CustomSource(Source):
+        def query_all_values(self, context: Context):
+            self._values.update({key: key.key for key in self._keys})
+
+    source = CustomSource()
+    source.add_key(Key("hello"))
+
+    asyncio.run(source.query_all_values_async(mock_context))
+
+    assert source._values == {
+        Key("hello"): "hello",
+    }
+
+
+@pytest.fixture
+def zip_data():
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w") as zf:
+        for i in range(100):
+            zf.writestr(f"annotation/{i}.json", f'{{"index": {i}}}')
+        zf.writestr("manifest.json", '{"name": "manifest"}')
+
+    return file.getvalue()
+
+
+def test_zip_source(mock_context, zip_data):
+    source = ZipSource(
+        Dummy(zip_data),
+        members={
+            "manifest": ZipMember(filters={"filename": "manifest.json"}, format=Json()),
+            "first": ZipMember(filters={"filename": "annotation/0.json"}, format=Json()),
+            "last": ZipMember(filters={"filename": r"annotation/9\d\.json"}, format=Json()),
+        },
+    )
+    keys = [Key("manifest:name"), Key("first:index"), Key("last:index", return_list=True)]
+    for key in keys:
+        source.add_key(key)
+
+    with mock.patch("zipfile.ZipFile", wraps=zipfile.ZipFile) as mock_zipfile:
+        source.query_all_values(mock_context)
+    mock_zipfile.assert_called_once()
+
+    assert source.get_value(Key("manifest:name")) == "manifest"
+    assert source.get_value(Key("first:index")) == 0
+    assert source.get_value(Key("last:index", return_list=True)) == [90]
+
+    source = ZipSource(Dummy(zip_data), members=source.members)
+    source.add_key(Key("manifest:name"))
+    asyncio.run(source.query_all_values_async(mock_context))
+
+    assert source.get_value(Key("manifest:name")) == "manifest"
+
+
+def test_zip_source_invalid_key(zip_data):
+    source = ZipSource(
+        Dummy(zip_data),
+        members={"manifest": ZipMember(filters={"filename": "manifest.json"}, format=Json())},
+    )
+
+    with pytest.raises(ValueError, match="key 'name' must start with the name of a member"):
+        source.add_key(Key("name"))
+    with pytest.raises(ValueError, match="key 'other:name' must start with the name of a member"):
+        source.add_key(Key("other:name"))
+
+
+def test_zip_source_missing_member(mock_context, zip_data):
+    source = ZipSource(
+        Dummy(zip_data),
+        members={"missing": ZipMember(filters={"filename": "missing.json"}, format=Json())},
+    )
+    source.add_key(Key("missing:name"))
+
+    with pytest.raises(FormatError, match="no archive members matched filters"):
+        source.query_all_values(mock_context)
@@ -2,9 +2,17 @@ from dataclasses import dataclass
 
 import pytest
 
-from mandible.metadata_mapper import Context, FileSource
+from mandible.metadata_mapper import Context, FileSource, ZipSource
 from mandible.metadata_mapper.context import ContextValue
-from mandible.metadata_mapper.format import FORMAT_REGISTRY, H5, Json, Xml, ZipMember
+from mandible.metadata_mapper.format import (
+    FORMAT_REGISTRY,
+    H5,
+    GzipFile,
+    Json,
+    Xml,
+    XzFile,
+    ZipMember,
+)
 from mandible.metadata_mapper.source import Source
 from mandible.metadata_mapper.source_provider import (
     ConfigSourceProvider,
@@ -140,6 +148,63 @@ def test_config_source_provider_wrong_base_class_type():
         provider.get_sources()
 
 
+def test_config_source_provider_zip_source():
+    provider = ConfigSourceProvider(
+        {
+            "foo": {
+                "class": "ZipSource",
+                "storage": {
+                    "class": "LocalFile",
+                },
+                "members": {
+                    "bar": {
+                        "class": "ZipMember",
+                        "filters": {
+                            "filename": "bar.json",
+                        },
+                        "format": {
+                            "class": "Json",
+                        },
+                    },
+                },
+            },
+        },
+    )
+
+    assert provider.get_sources() == {
+        "foo": ZipSource(
+            storage=LocalFile(),
+            members={
+                "bar": ZipMember(filters={"filename": "bar.json"}, format=Json()),
+            },
+        ),
+    }
+
+
+def test_config_source_provider_zip_source_wrong_member_type():
+    provider = ConfigSourceProvider(
+        {
+            "foo": {
+                "class": "ZipSource",
+                "storage": {
+                    "class": "LocalFile",
+                },
+                "members": {
+                    "bar": {
+                        "class": "Json",
+                    },
+                },
+            },
+        },
+    )
+
+    with pytest.raises(
+        SourceProviderError,
+        match="failed to create source 'foo': invalid bar type 'Json' must be a subclass of 'ZipMember'",
+    ):
+        provider.get_sources()
+
+
 @pytest.mark.h5
 @pytest.mark.xml
 def test_config_source_provider_all_formats():
@@ -188,6 +253,46 @@ def test_config_source_provider_all_formats():
     }
 
 
+def test_config_source_provider_compressed_formats():
+    provider = ConfigSourceProvider(
+        {
+            "gzip": {
+                "storage": {
+                    "class": "LocalFile",
+                    "filters": {
+                        "name": "foo",
+                    },
+                },
+                "format": {
+                    "class": "GzipFile",
+                    "format": {
+                        "class": "Json",
+                    },
+                },
+            },
+            "xz": {
+                "storage": {
+                    "class": "LocalFile",
+                    "filters": {
+                        "name": "bar",
+                    },
+                },
+                "format": {
+                    "class": "XzFile",
+                    "format": {
+                        "class": "Json",
+                    },
+                },
+            },
+        },
+    )
+
+    assert provider.get_sources() == {
+        "gzip": FileSource(LocalFile(filters={"name": "foo"}), GzipFile(format=Json())),
+        "xz": FileSource(LocalFile(filters={"name": "bar"}), XzFile(format=Json())),
+    }
+
+
 def test_config_source_provider_empty():
     provider = ConfigSourceProvider({})
 
@@ -1,19 +1,25 @@
 import io
+import re
 from hashlib import md5
+from unittest import mock
 
 import pytest
 
 from mandible.metadata_mapper.context import Context
 from mandible.metadata_mapper.storage import (
     STORAGE_REGISTRY,
+    BlockCacheFile,
     CmrQuery,
+    CountingFile,
     Dummy,
     HttpRequest,
     LocalFile,
+    ReadStats,
     S3File,
     Storage,
     StorageError,
 )
+from mandible.metadata_mapper.storage.file_index import FileIndex
 
 
 def test_registry():
@@ -106,6 +112,233 @@ def test_local_file_empty_context_error():
         storage.open_file(context)
 
 
+def test_file_index_first_match():
+    files = [
+        {"name": "a.txt", "type": "data"},
+        {"name": "b.json", "type": "metadata"},
+        {"name": "c.json", "type": "data"},
+        {"name": "d.json", "type": "data"},
+    ]
+    index = FileIndex(files)
+
+    assert index.find({}) is files[0]
+    assert index.find({"name": "b.json"}) is files[1]
+    assert index.find({"name": re.compile(r"b\.json")}) is files[1]
+    assert index.find({"name": re.compile(r".*\.json")}) is files[1]
+    assert index.find({"name": re.compile(r".*\.json"), "type": "data"}) is files[2]
+    assert index.find({"type": re.compile("data")}) is files[0]
+    assert index.find({"name": re.compile(r"[cd]\.json"), "type": "data"}) is files[2]
+    assert index.find({"name": "b.json", "type": "data"}) is None
+    assert index.find({"size": 10}) is None
+    assert index.find({"name": re.compile(r"x.*")}) is None
+
+
+def test_file_index_registered_patterns():
+    files = [{"name": f"file_{i}.txt"} for i in range(100)]
+    patterns = [re.compile(rf"file_{i}\..*") for i in range(10)]
+    index = FileIndex(files)
+    for pattern in patterns:
+        index.add_filters({"name": pattern})
+
+    for i, pattern in enumerate(patterns):
+        assert index.find({"name": pattern}) is files[i]
+
+
+def test_file_index_combined_patterns_with_groups():
+    files = [{"name": "aa"}, {"name": "ab"}, {"name": "bb"}]
+    index = FileIndex(files)
+    patterns = [
+        re.compile(r"(?P<x>a)b"),
+        re.compile(r"(?P<x>b)(?P=x)"),
+        re.compile(r"(a)\1"),
+    ]
+    for pattern in patterns:
+        index.add_filters({"name": pattern})
+
+    assert index.find({"name": patterns[0]}) is files[1]
+    assert index.find({"name": patterns[1]}) is files[2]
+    assert index.find({"name": patterns[2]}) is files[0]
+
+
+def test_file_index_unhashable_values():
+    files = [{"name": ["a", "b"]}, {"name": "a"}]
+    index = FileIndex(files)
+
+    assert index.find({"name": "a"}) is files[1]
+    assert index.find({"name": re.compile("a")}) is files[1]
+    assert index.find({"name": ["a", "b"]}) is files[0]
+
+
+def test_file_index_for_context():
+    context = Context(files=[{"name": "foo"}])
+
+    index = FileIndex.for_context(context)
+
+    assert FileIndex.for_context(context) is index
+
+    context.files.append({"name": "bar"})
+    new_index = FileIndex.for_context(context)
+
+    assert new_index is not index
+    assert new_index.find({"name": "bar"}) is context.files[1]
+
+    context.files[1] = {"name": "baz"}
+    new_index = FileIndex.for_context(context)
+
+    assert new_index.find({"name": "baz"}) is context.files[1]
+    assert new_index.find({"name": "bar"}) is None
+
+
+def test_file_index_modified_file():
+    context = Context(files=[{"name": "foo"}, {"name": "bar"}])
+    storage = LocalFile(filters={"name": "foo"})
+
+    assert storage.get_file_from_context(context) is context.files[0]
+
+    context.files[0]["name"] = "baz"
+
+    with pytest.raises(StorageError, match="no files matched filters"):
+        storage.get_file_from_context(context)
+
+
+def test_filtered_storage_many_sources():
+    context = Context(
+        files=[
+            # ruff hint
+            {"name": f"file_{i}.xml", "type": "data" if i % 2 else "metadata"}
+            for i in range(1000)
+        ],
+    )
+    storages = [
+        # ruff hint
+        LocalFile(filters={"name": rf"file_{i}\.xml", "type": "data"})
+        for i in range(1, 1000, 100)
+    ]
+    storages += [
+        # ruff hint
+        LocalFile(filters={"name": rf"file_{i}[0-9]\.xml"})
+        for i in range(1, 100, 10)
+    ]
+    for storage in storages:
+        storage.prepare(context)
+
+    for i, storage in zip(range(1, 1000, 100), storages):
+        assert storage.get_file_from_context(context) is context.files[i]
+    for i, storage in zip(range(1, 100, 10), storages[10:]):
+        assert storage.get_file_from_context(context) is context.files[i * 10]
+
+
+class ReadLogFile(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append((self.tell(), size))
+        return super().read(size)
+
+
+def test_block_cache_file():
+    data = bytes(range(256)) * 4
+    file = ReadLogFile(data)
+    cached = BlockCacheFile(file, block_size=100, max_blocks=4)
+
+    assert cached.read(10) == data[:10]
+    assert cached.read(95) == data[10:105]
+    cached.seek(50)
+    assert cached.read(100) == data[50:150]
+    assert file.reads == [(0, 100), (100, 100)]
+    assert cached.stats == ReadStats(requests=2, bytes_read=200)
+
+    cached.seek(-24, io.SEEK_END)
+    assert cached.read() == data[-24:]
+    assert cached.tell() == len(data)
+    assert cached.read(10) == b""
+    assert file.reads[-1] == (1000, 24)
+    assert cached.stats == ReadStats(requests=3, bytes_read=224)
+
+
+def test_block_cache_file_coalesce():
+    data = bytes(range(256)) * 4
+    file = ReadLogFile(data)
+    stats = ReadStats()
+    cached = BlockCacheFile(file, block_size=100, max_blocks=8, stats=stats)
+
+    cached.seek(250)
+    assert cached.read(10) == data[250:260]
+    # Blocks 0-1 and 3-5 are missing, block 2 is cached
+    cached.seek(0)
+    assert cached.read(600) == data[:600]
+    assert file.reads == [(200, 100), (0, 200), (300, 300)]
+    assert stats == ReadStats(requests=3, bytes_read=600)
+
+
+def test_block_cache_file_readahead():
+    data = bytes(range(256)) * 4
+    file = ReadLogFile(data)
+    cached = BlockCacheFile(file, block_size=100, max_blocks=4, readahead_blocks=2)
+
+    assert cached.read(150) == data[:150]
+    assert cached.read(150) == data[150:300]
+    assert file.reads == [(0, 400)]
+    # Read ahead stops at the end of the file
+    cached.seek(950)
+    assert cached.read(10) == data[950:960]
+    assert file.reads[-1] == (900, 124)
+
+
+def test_block_cache_file_eviction():
+    data = bytes(range(256)) * 4
+    file = ReadLogFile(data)
+    cached = BlockCacheFile(file, block_size=100, max_blocks=2)
+
+    for offset in (0, 100, 200, 100, 0):
+        cached.seek(offset)
+        assert cached.read(10) == data[offset : offset + 10]
+
+    assert file.reads == [(0, 100), (100, 100), (200, 100), (0, 100)]
+
+    # Reads larger than the cache bypass it
+    cached.seek(0)
+    assert cached.read(500) == data[:500]
+    assert file.reads[-1] == (0, 500)
+
+
+def test_counting_file():
+    file = CountingFile(io.BytesIO(b"foo bar baz"))
+
+    assert file.read(3) == b"foo"
+    file.seek(-3, io.SEEK_END)
+    assert file.read() == b"baz"
+    assert file.stats == ReadStats(requests=2, bytes_read=6)
+
+
+def test_counting_file_readall():
+    data = bytes(range(256)) * 4096
+    file = CountingFile(io.BytesIO(data))
+
+    assert file.read() == data
+    assert file.read(-1) == b""
+    file.seek(10)
+    assert file.read(-1) == data[10:]
+    assert file.stats == ReadStats(requests=2, bytes_read=2 * len(data) - 10)
+
+
+def test_block_cache_file_close():
+    file = io.BytesIO(b"foo")
+    with BlockCacheFile(file, block_size=100, max_blocks=1) as cached:
+        assert cached.read() == b"foo"
+
+    assert file.closed
+
+
+def test_block_cache_file_invalid():
+    with pytest.raises(ValueError, match="block_size must be positive"):
+        BlockCacheFile(io.BytesIO(), block_size=0, max_blocks=1)
+    with pytest.raises(ValueError, match="max_blocks must be positive"):
+        BlockCacheFile(io.BytesIO(), block_size=1, max_blocks=0)
+
+
 @pytest.mark.s3
 def test_s3_file_s3uri(s3_resource):
     bucket = s3_resource.Bucket("test-bucket")
@@ -156,6 +389,36 @@ def test_s3_file_s3fs_kwargs(s3_resource):
         assert f.read() == b"Some remote file content\n"
 
 
+@pytest.mark.s3
+def test_s3_file_range_reads(s3_resource):
+    bucket = s3_resource.Bucket("test-bucket")
+    bucket.create()
+    bucket.Object("bucket_file.txt").upload_fileobj(io.BytesIO(b"x" * 1_000_000 + b"end"))
+
+    context = Context(
+        files=[
+            {
+                "name": "s3_file",
+                "bucket": "test-bucket",
+                "key": "bucket_file.txt",
+            },
+        ],
+    )
+    storage = S3File(filters={"name": "s3_file"}, range_reads=True)
+
+    with storage.open_file(context) as f:
+        f.seek(-3, io.SEEK_END)
+        assert f.read(3) == b"end"
+        f.seek(10)
+        assert f.read(5) == b"xxxxx"
+
+    assert f.stats == ReadStats(requests=2, bytes_read=8)
+
+    # Every file counts its own requests
+    with storage.open_file(context) as f:
+        assert f.stats == ReadStats()
+
+
 @pytest.mark.s3
 def test_s3_file_filters(s3_resource):
     bucket = s3_resource.Bucket("test-bucket")
@@ -201,6 +464,66 @@ def test_s3_file_filters(s3_resource):
         assert f.read() == b"Content from file2.txt\n"
 
 
+def mock_response(status_code=200, content=b"", headers=None):
+    response = mock.Mock(status_code=status_code, content=content, headers=headers or {})
+    response.url = "http://foo.bar/file"
+    return response
+
+
+@pytest.mark.http
+def test_http_request_range_reads():
+    data = b"foo bar baz"
+
+    def request(method, headers, **kwargs):
+        assert headers["Accept-Encoding"] == "identity"
+        assert headers["X-Test"] == "test"
+        if method == "HEAD":
+            return mock_response(headers={"Content-Length": str(len(data))})
+
+        start, end = map(int, headers["Range"].removeprefix("bytes=").split("-"))
+        return mock_response(206, data[start : end + 1])
+
+    storage = HttpRequest(url="http://foo.bar/file", headers={"X-Test": "test"}, range_reads=True)
+    with mock.patch("requests.Session.request", side_effect=request):
+        with storage.open_file(Context()) as f:
+            f.seek(4)
+            assert f.read(3) == b"bar"
+            f.seek(-3, io.SEEK_END)
+            assert f.read() == b"baz"
+
+    assert f.stats == ReadStats(requests=2, bytes_read=6)
+
+
+@pytest.mark.http
+def test_http_request_range_reads_ignored():
+    data = b"foo bar baz"
+
+    def request(method, **kwargs):
+        if method == "HEAD":
+            return mock_response(headers={"Content-Length": str(len(data))})
+        return mock_response(200, data)
+
+    storage = HttpRequest(url="http://foo.bar/file", range_reads=True)
+    with mock.patch("requests.Session.request", side_effect=request):
+        with storage.open_file(Context()) as f:
+            f.seek(4)
+            assert f.read(3) == b"bar"
+
+    assert f.stats == ReadStats(requests=1, bytes_read=11)
+
+
+@pytest.mark.http
+def test_http_request_range_reads_errors():
+    storage = HttpRequest(url="http://foo.bar/file", method="POST", range_reads=True)
+    with pytest.raises(StorageError, match="range reads are only supported for GET requests"):
+        storage.open_file(Context())
+
+    storage = HttpRequest(url="http://foo.bar/file", range_reads=True)
+    with mock.patch("requests.Session.request", return_value=mock_response()):
+        with pytest.raises(StorageError, match="no Content-Length for 'http://foo.bar/file'"):
+            storage.open_file(Context())
+
+
 @pytest.mark.http
 def test_cmr_query_params():
     with pytest.raises(ValueError):